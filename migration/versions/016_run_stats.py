@@ -0,0 +1,11 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    run = Table('run', meta, autoload=True)
+
+    stats = Column('stats', Text)
+    stats.create(run)
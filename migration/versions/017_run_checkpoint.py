@@ -0,0 +1,14 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    run = Table('run', meta, autoload=True)
+
+    checkpoint_row = Column('checkpoint_row', Integer)
+    checkpoint_row.create(run)
+
+    source_checksum = Column('source_checksum', Unicode(64))
+    source_checksum.create(run)
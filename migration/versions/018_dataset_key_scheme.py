@@ -0,0 +1,12 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    dataset = Table('dataset', meta, autoload=True)
+
+    # datasets without a key scheme use the legacy entry ids.
+    key_scheme = Column('key_scheme', Unicode)
+    key_scheme.create(dataset)
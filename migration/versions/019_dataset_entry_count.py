@@ -0,0 +1,15 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    dataset = Table('dataset', meta, autoload=True)
+
+    # left empty, the count is taken on first use (or 'ostool db recount').
+    entry_count = Column('entry_count', Integer)
+    entry_count.create(dataset)
+
+    last_load = Column('last_load', Text)
+    last_load.create(dataset)
@@ -0,0 +1,23 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    source = Table('source', meta, autoload=True)
+
+    etag = Column('etag', Unicode)
+    etag.create(source)
+
+    last_modified = Column('last_modified', Unicode)
+    last_modified.create(source)
+
+    size = Column('size', BigInteger)
+    size.create(source)
+
+    content_hash = Column('content_hash', Unicode(64))
+    content_hash.create(source)
+
+    checked_at = Column('checked_at', DateTime)
+    checked_at.create(source)
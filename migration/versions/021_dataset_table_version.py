@@ -0,0 +1,13 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    dataset = Table('dataset', meta, autoload=True)
+
+    # empty for datasets whose tables have never been reloaded through
+    # a shadow load, i.e. which still use the unversioned table names.
+    table_version = Column('table_version', Integer)
+    table_version.create(dataset)
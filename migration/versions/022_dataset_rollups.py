@@ -0,0 +1,13 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    dataset = Table('dataset', meta, autoload=True)
+
+    # the drilldown combinations materialized as rollup tables, and
+    # the state of the data they were last built from.
+    rollups = Column('rollups', Text)
+    rollups.create(dataset)
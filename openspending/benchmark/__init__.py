@@ -0,0 +1,6 @@
+"""
+Import benchmarks. The ``generator`` builds models and CSV files of a
+configurable shape, the ``harness`` loads them and reports throughput,
+memory use and the number of SQL statements for each stage. Run them
+with ``ostool <config> benchmark``.
+"""
@@ -0,0 +1,85 @@
+"""
+Generate synthetic datasets for benchmarking: a model with a date
+dimension, a number of compound dimensions and measures, and a CSV file
+with matching rows. All values are derived from a seeded random number
+generator, so the same shape always yields the same file.
+"""
+import csv
+import random
+from datetime import date, timedelta
+
+START_DATE = date(2000, 1, 1)
+
+
+def make_model(name='benchmark', dimensions=3, measures=1):
+    """ Build a model (metadata and mapping) for a synthetic dataset
+    with ``dimensions`` compound dimensions and ``measures`` measures.
+    """
+    mapping = {
+        'time': {'type': 'value', 'label': 'Time', 'column': 'date',
+                 'datatype': 'date'},
+        'transaction': {'type': 'value', 'label': 'Transaction',
+                     'column': 'id', 'datatype': 'string', 'key': True}
+        }
+    for i in range(dimensions):
+        dimension = 'dim_%d' % i
+        mapping[dimension] = {
+            'type': 'compound',
+            'label': 'Dimension %d' % i,
+            'attributes': {
+                'name': {'column': dimension + '_id', 'datatype': 'id'},
+                'label': {'column': dimension + '_label',
+                          'datatype': 'string'}
+                }
+            }
+    for i in range(measures):
+        measure = 'amount' if i == 0 else 'amount_%d' % i
+        mapping[measure] = {'type': 'measure', 'label': 'Amount %d' % i,
+                            'column': measure, 'datatype': 'float'}
+    return {
+        'dataset': {
+            'name': name,
+            'label': 'Benchmark (%s)' % name,
+            'description': 'Synthetic dataset for import benchmarks',
+            'currency': 'EUR',
+            'category': 'spending'
+            },
+        'mapping': mapping
+        }
+
+
+def make_headers(dimensions=3, measures=1):
+    headers = ['id', 'date']
+    for i in range(dimensions):
+        headers.extend(['dim_%d_id' % i, 'dim_%d_label' % i])
+    headers.append('amount')
+    headers.extend(['amount_%d' % i for i in range(1, measures)])
+    return headers
+
+
+def make_rows(rows, dimensions=3, cardinality=100, date_spread=365,
+              measures=1, seed=0):
+    """ Generate ``rows`` lists of CSV values. Each compound dimension
+    has ``cardinality`` distinct members and dates are spread over
+    ``date_spread`` days. """
+    rand = random.Random(seed)
+    for i in xrange(rows):
+        day = START_DATE + timedelta(days=rand.randrange(date_spread))
+        row = ['entry-%d' % i, day.isoformat()]
+        for d in range(dimensions):
+            member = rand.randrange(cardinality)
+            row.extend(['member-%d-%d' % (d, member),
+                        'Member %d of dimension %d' % (member, d)])
+        for m in range(measures):
+            row.append('%.2f' % (rand.random() * 100000))
+        yield row
+
+
+def write_csv(fh, rows, dimensions=3, cardinality=100, date_spread=365,
+              measures=1, seed=0):
+    """ Write a synthetic CSV file with ``rows`` data rows to the file
+    object ``fh``. """
+    writer = csv.writer(fh)
+    writer.writerow(make_headers(dimensions, measures))
+    writer.writerows(make_rows(rows, dimensions, cardinality, date_spread,
+                               measures, seed))
@@ -0,0 +1,164 @@
+"""
+Run imports of generated datasets and measure each stage: wall clock
+time, rows per second, the number of SQL statements sent to the
+database and the peak resident memory of the process so far (which
+cannot be measured for a single stage). The database is the one
+configured for the application, so the same benchmark can be run
+against SQLite or a local Postgres.
+"""
+import logging
+import resource
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from openspending.model import Dataset, Source, Account
+from openspending.model import meta as db
+from openspending.importer import CSVImporter
+from openspending.importer.converter import RowConverter
+from openspending.importer.reader import FastCSVReader
+
+log = logging.getLogger(__name__)
+
+BENCHMARK_USER = 'benchmark'
+
+
+class StatementCounter(object):
+    """ Count the statements executed on an engine. The listener can't
+    be removed again, so there is only one counter per engine. """
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.count += 1
+
+    @classmethod
+    def for_engine(cls, engine):
+        if not hasattr(engine, '_statement_counter'):
+            engine._statement_counter = cls(engine)
+        return engine._statement_counter
+
+
+def peak_rss():
+    """ Peak resident set size of this process in megabytes. """
+    # ru_maxrss is given in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class Report(object):
+    """ Measurements for the stages of a benchmark run. """
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, per_row=True):
+        """ Measure a stage. Throughput is only reported for stages
+        which process the rows, i.e. if ``per_row`` is set. """
+        counter = StatementCounter.for_engine(db.engine)
+        statements = counter.count
+        begin = time.time()
+        yield
+        seconds = time.time() - begin
+        self.stages.append({
+            'stage': name,
+            'seconds': seconds,
+            'rows_per_sec': self.rows / seconds \
+                    if (per_row and seconds) else None,
+            'statements': counter.count - statements,
+            'process_peak_rss': peak_rss()
+            })
+
+    def format(self):
+        lines = ["%s (%s rows)" % (self.name, self.rows),
+                 "%-12s %10s %12s %12s %12s" % ('stage', 'seconds',
+                     'rows/sec', 'statements', 'proc peak MB')]
+        for s in self.stages:
+            lines.append("%-12s %10.2f %12s %12d %12.1f" % (s['stage'],
+                s['seconds'], '%.0f' % s['rows_per_sec'] \
+                        if s['rows_per_sec'] else '-',
+                s['statements'], s['process_peak_rss']))
+        return '\n'.join(lines)
+
+
+def _account():
+    account = Account.by_name(BENCHMARK_USER)
+    if account is None:
+        account = Account()
+        account.name = BENCHMARK_USER
+        db.session.add(account)
+    return account
+
+
+def _drop_dataset(dataset):
+    dataset.drop()
+    db.session.delete(dataset)
+    db.session.commit()
+
+
+def _create_dataset(model, replace=False):
+    """ Create the dataset of ``model``. An existing dataset of the same
+    name is only dropped if ``replace`` is set. """
+    dataset = Dataset.by_name(model['dataset']['name'])
+    if dataset is not None:
+        if not replace:
+            raise ValueError("Dataset %s exists already." % dataset.name)
+        _drop_dataset(dataset)
+    dataset = Dataset(model)
+    db.session.add(dataset)
+    db.session.commit()
+    return dataset
+
+
+def run_importer(model, csv_path, rows, keep=False, replace=False,
+                 **options):
+    """ Import ``csv_path`` with the ``CSVImporter``. ``options`` are
+    passed on to ``CSVImporter.run``, except for ``reader``. """
+    report = Report('CSVImporter', rows)
+    with report.stage('generate', per_row=False):
+        dataset = _create_dataset(model, replace)
+        dataset.generate()
+        source = Source(dataset, _account(), csv_path)
+        db.session.add(source)
+        db.session.commit()
+    with report.stage('import'):
+        importer = CSVImporter(source, reader=options.pop('reader', 'auto'))
+        importer.run(**options)
+    if importer.errors:
+        log.warn("The import had %s errors.", importer.errors)
+    if not keep:
+        with report.stage('drop', per_row=False):
+            _drop_dataset(dataset)
+    return report
+
+
+def run_load(model, csv_path, rows, keep=False, replace=False,
+             batch_size=None, staging=False):
+    """ Load ``csv_path`` by calling ``Dataset.load`` directly, with
+    reading and type conversion measured as a separate stage. """
+    report = Report('Dataset.load', rows)
+    with report.stage('generate', per_row=False):
+        dataset = _create_dataset(model, replace)
+        dataset.generate()
+    with report.stage('convert'):
+        convert = RowConverter(dataset.mapping)
+        data = [convert(row) for row in FastCSVReader(open(csv_path, 'rb'))]
+    if staging:
+        dataset.begin_staging(batch_size or 1000)
+    elif batch_size:
+        dataset.begin_batch(batch_size)
+    with report.stage('load'):
+        for row in data:
+            dataset.load(row)
+    with report.stage('commit', per_row=False):
+        dataset.commit()
+    if not keep:
+        with report.stage('drop', per_row=False):
+            _drop_dataset(dataset)
+    return report
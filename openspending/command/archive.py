@@ -1,20 +1,19 @@
 import logging
 import os
 import json
-import hashlib
-import urllib
+import shutil
 
 from pylons import config
 
 from openspending.model import Dataset, Source, meta as db
+from openspending.importer.opener import archive_path, read_sidecar, \
+        write_sidecar, conditional_fetch
 
 log = logging.getLogger(__name__)
 
 
 def file_name(path, source):
-    file_name = hashlib.sha1(source.url).hexdigest()[:10]
-    file_name += '-' + os.path.basename(source.url)
-    return os.path.join(path, file_name)
+    return archive_path(path, source.url)
 
 
 def sizeof_fmt(num):
@@ -26,18 +25,33 @@ def sizeof_fmt(num):
 
 
 def update_source(archive_dir, source):
+    """ Fetch a source into the archive, or refresh an archived copy if
+    the source has changed since it was archived, as far as the ETag and
+    Last-Modified validators recorded with the copy tell. """
     if source.dataset is None:
         return
     fname = file_name(archive_dir, source)
     fname_tmp = fname + '.tmp'
+    meta = read_sidecar(fname, source.url) or {}
     log.info("Fetching %s to %s", source.url, fname)
-    if not os.path.isfile(fname):
-        try:
-            (fn, headers) = urllib.urlretrieve(source.url, fname_tmp)
+    try:
+        fh, validators = conditional_fetch(source.url, meta.get('etag'),
+                                           meta.get('last_modified'))
+        if fh is None:
+            log.info("Not modified: %s", source.url)
+        else:
+            try:
+                with open(fname_tmp, 'wb') as out:
+                    shutil.copyfileobj(fh, out)
+            finally:
+                fh.close()
             os.rename(fname_tmp, fname)
-        except Exception, e:
-            log.exception(e)
+            meta = write_sidecar(fname, source.url, **validators)
+    except Exception, e:
+        log.exception(e)
     if os.path.isfile(fname):
+        if read_sidecar(fname, source.url) is None:
+            write_sidecar(fname, source.url)
         log.info("OK: %s", sizeof_fmt(os.path.getsize(fname)))
 
 
@@ -0,0 +1,84 @@
+from __future__ import print_function
+
+import logging
+import os
+import sys
+import tempfile
+
+from openspending.benchmark import generator, harness
+from openspending.model import Dataset
+
+log = logging.getLogger(__name__)
+
+
+def benchmark(args):
+    if not args.replace and Dataset.by_name(args.name) is not None:
+        print("Dataset %s exists already, use --replace to drop it."
+              % args.name, file=sys.stderr)
+        return 1
+    model = generator.make_model(args.name, args.dimensions, args.measures)
+    fd, csv_path = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            generator.write_csv(fh, args.rows, args.dimensions,
+                                args.cardinality, args.date_spread,
+                                args.measures, args.seed)
+        log.info("Generated %s rows in %s", args.rows, csv_path)
+        reports = []
+        if args.mode in ('all', 'load'):
+            reports.append(harness.run_load(model, csv_path, args.rows,
+                keep=args.keep, replace=args.replace,
+                batch_size=args.batch_size, staging=args.staging))
+        if args.mode in ('all', 'import'):
+            # a dataset kept by the load benchmark is replaced
+            replace = args.replace or len(reports) > 0
+            reports.append(harness.run_importer(model, csv_path, args.rows,
+                keep=args.keep, replace=replace,
+                batch_size=args.batch_size, staging=args.staging,
+                reader=args.reader))
+        for report in reports:
+            print(report.format())
+            print()
+    finally:
+        os.unlink(csv_path)
+    return 0
+
+
+def configure_parser(subparser):
+    p = subparser.add_parser('benchmark',
+                             help='Benchmark imports of a synthetic dataset')
+    p.add_argument('--name', action="store", dest='name',
+                   default='benchmark', help="Name of the dataset to create.")
+    p.add_argument('--rows', action="store", dest='rows', type=int,
+                   default=10000, help="Number of rows to generate.")
+    p.add_argument('--dimensions', action="store", dest='dimensions',
+                   type=int, default=3,
+                   help="Number of compound dimensions.")
+    p.add_argument('--cardinality', action="store", dest='cardinality',
+                   type=int, default=100,
+                   help="Number of members of each compound dimension.")
+    p.add_argument('--date-spread', action="store", dest='date_spread',
+                   type=int, default=365, metavar='DAYS',
+                   help="Number of days over which dates are spread.")
+    p.add_argument('--measures', action="store", dest='measures', type=int,
+                   default=1, help="Number of measures.")
+    p.add_argument('--seed', action="store", dest='seed', type=int,
+                   default=0, help="Random seed for the generated data.")
+    p.add_argument('--mode', action="store", dest='mode',
+                   choices=['all', 'import', 'load'], default='all',
+                   help="Benchmark the CSVImporter, Dataset.load or both.")
+    p.add_argument('--batch-size', action="store", dest='batch_size',
+                   type=int, default=None,
+                   help="Load entries in batches of this size.")
+    p.add_argument('--staging', action="store_true", dest='staging',
+                   default=False, help="Load entries through staging tables.")
+    p.add_argument('--reader', action="store", dest='reader',
+                   choices=['auto', 'fast', 'messytables'], default='auto',
+                   help="CSV reader used by the importer.")
+    p.add_argument('--keep', action="store_true", dest='keep',
+                   default=False,
+                   help="Keep the dataset after the benchmark.")
+    p.add_argument('--replace', action="store_true", dest='replace',
+                   default=False,
+                   help="Drop an existing dataset with the same name.")
+    p.set_defaults(func=benchmark)
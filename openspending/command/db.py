@@ -79,9 +79,24 @@ def modelmigrate():
         db.engine.execute(q)
     return 0
 
+def recount(name=None):
+    q = db.session.query(Dataset)
+    if name is not None:
+        q = q.filter_by(name=name)
+    for dataset in q:
+        before = dataset.entry_count
+        dataset.recount()
+        log.info("%s: %s entries (was: %s)", dataset.name,
+                 dataset.entry_count, before)
+    db.session.commit()
+    return 0
+
 def init():
     migrate()
 
+def _recount(args):
+    return recount(args.name)
+
 def _init(args):
     return init()
 
@@ -132,6 +147,11 @@ def configure_parser(subparsers):
                       help='Run pending data model migrations')
     p.set_defaults(func=_modelmigrate)
 
+    p = sp.add_parser('recount',
+                      help='Recount the entries of all or one dataset')
+    p.add_argument('name', nargs='?', default=None)
+    p.set_defaults(func=_recount)
+
     p = sp.add_parser('init',
                       help='Initialize the database')
     p.set_defaults(func=_init)
@@ -9,7 +9,8 @@ from openspending.lib import json
 
 from openspending.model import Source, Dataset, Account
 from openspending.model import meta as db
-from openspending.importer import CSVImporter
+from openspending.importer import STAGES, shadow_import
+from openspending.importer.formats import get_importer
 from openspending.validation.model import validate_model
 from openspending.validation.model import Invalid
 
@@ -24,12 +25,74 @@ import_parser.add_argument('-n', '--dry-run',
                            help="Perform a dry run, don't load any data.")
 
 import_parser.add_argument('--no-index', action="store_false", dest='build_indices',
-                           default=True, help='Suppress Solr index build.')
+                           default=True, help='Suppress Solr index build '
+                           '(shadow loads are always indexed).')
 
 import_parser.add_argument('--max-lines', action="store", dest='max_lines',
                            type=int, default=None, metavar='N',
                            help="Number of lines to import.")
 
+import_parser.add_argument('--batch-size', action="store", dest='batch_size',
+                           type=int, default=None, metavar='N',
+                           help="Write entries in batches of N rows.")
+
+import_parser.add_argument('--staging', action="store_true", dest='staging',
+                           default=False,
+                           help="Collect rows in staging tables and merge "
+                                "them into the dataset at the end.")
+
+import_parser.add_argument('--key-cache-size', action="store",
+                           dest='key_cache_size', type=int, default=None,
+                           metavar='MB',
+                           help="Memory budget of each dimension key cache.")
+
+import_parser.add_argument('--processes', action="store", dest='processes',
+                           type=int, default=None, metavar='N',
+                           help="Parse and convert local files in N "
+                                "worker processes (rows are still loaded "
+                                "by a single process).")
+
+import_parser.add_argument('--reader', action="store", dest='reader',
+                           choices=['auto', 'fast', 'messytables'],
+                           default='auto',
+                           help="CSV reader to use (default: fast reader "
+                                "for well-formed files, else messytables).")
+
+import_parser.add_argument('--max-log-records', action="store",
+                           dest='max_log_records', type=int, default=None,
+                           metavar='N',
+                           help="Store at most N error records, then only "
+                                "count errors per column.")
+
+import_parser.add_argument('--resume', action="store_true", dest='resume',
+                           default=False,
+                           help="Continue an interrupted import of the same "
+                                "source from its last checkpoint.")
+
+import_parser.add_argument('--incremental', action="store_true",
+                           dest='incremental', default=False,
+                           help="Only write entries which are new or have "
+                                "changed since the last incremental import.")
+
+import_parser.add_argument('--shadow', action="store_true", dest='shadow',
+                           default=False,
+                           help="Load into a new version of the dataset "
+                                "tables, together with all other sources "
+                                "of the dataset, and switch readers over "
+                                "to it once the load has succeeded.")
+
+import_parser.add_argument('--seed-calendar', action="store_true",
+                           dest='seed_calendar', default=False,
+                           help="Create a time dimension member for every "
+                                "day between the earliest and the latest "
+                                "date seen in the source.")
+
+import_parser.add_argument('--key-scheme', action="store",
+                           dest='key_scheme', choices=['legacy', 'fast'],
+                           default='legacy',
+                           help="Hashing scheme for the entry ids of a new "
+                                "dataset (default: legacy).")
+
 import_parser.add_argument('--raise-on-error', action="store_true",
                            dest='raise_errors', default=False,
                            help='Get full traceback on first error.')
@@ -65,6 +128,7 @@ def csvimport(csv_data_url, args):
 
     dataset = Dataset.by_name(model['dataset']['name'])
     if dataset is None:
+        model['dataset']['key_scheme'] = args.key_scheme
         dataset = Dataset(model)
         db.session.add(dataset)
     log.info("Dataset: %s", dataset.name)
@@ -79,8 +143,21 @@ def csvimport(csv_data_url, args):
     db.session.commit()
     
     dataset.generate()
-    importer = CSVImporter(source)
-    importer.run(**vars(args))
+    importer = get_importer(source, processes=args.processes,
+                            reader=args.reader, format=args.format)
+    options = vars(args)
+    # search only returns entries of the published table version, so
+    # the entries of a shadow load are indexed before it is published
+    options['build_indices'] = args.shadow
+    if args.shadow:
+        # a shadow load replaces the entries of all sources
+        importers = [importer] + [get_importer(s, processes=args.processes,
+                reader=args.reader) for s in dataset.sources if s != source]
+        del options['shadow']
+        shadow_import(importers, **options)
+    else:
+        importer.run(**options)
+    print(importer.timer.format(STAGES))
     return 0
 
 def _csvimport(args):
@@ -94,6 +171,10 @@ def configure_parser(subparser):
     p.add_argument('--model', action="store", dest='model',
                    default=None, metavar='url',
                    help="URL of JSON format model (metadata and mapping).")
+    p.add_argument('--format', action="store", dest='format', default=None,
+                   choices=['csv', 'ndjson', 'parquet', 'arrow'],
+                   help="Format of the data file (default: detect it from "
+                        "the file name or contents).")
     p.add_argument('dataset_url', help="Dataset file URL")
     p.set_defaults(func=_csvimport)
 
@@ -0,0 +1,86 @@
+import logging
+
+from openspending.model import Dataset, meta as db
+
+log = logging.getLogger(__name__)
+
+
+def _dataset(name):
+    dataset = Dataset.by_name(name)
+    if dataset is None:
+        log.warn("Dataset does not exist: '%s'", name)
+    return dataset
+
+def add(name, drilldowns, build=True):
+    dataset = _dataset(name)
+    if dataset is None:
+        return 1
+    dataset.add_rollup(drilldowns)
+    if build:
+        dataset.build_rollups()
+    db.session.commit()
+    return 0
+
+def remove(name, drilldowns):
+    dataset = _dataset(name)
+    if dataset is None:
+        return 1
+    dataset.remove_rollup(drilldowns)
+    db.session.commit()
+    return 0
+
+def build(name):
+    dataset = _dataset(name)
+    if dataset is None:
+        return 1
+    dataset.build_rollups()
+    db.session.commit()
+    return 0
+
+def list_(name):
+    dataset = _dataset(name)
+    if dataset is None:
+        return 1
+    for spec in dataset.rollups or []:
+        print ' x '.join(spec['drilldowns']), \
+                '(%s rows)' % spec['rows'] if 'rows' in spec else '(not built)'
+    return 0
+
+def _add(args):
+    return add(args.dataset, args.drilldowns, build=not args.no_build)
+
+def _remove(args):
+    return remove(args.dataset, args.drilldowns)
+
+def _build(args):
+    return build(args.dataset)
+
+def _list(args):
+    return list_(args.dataset)
+
+def configure_parser(subparsers):
+    parser = subparsers.add_parser('rollup',
+                                   help='Materialized aggregates')
+    sp = parser.add_subparsers(title='subcommands')
+
+    p = sp.add_parser('add', help='Add and build a rollup for a '
+                      'combination of drilldowns, e.g. time.year cofog1')
+    p.add_argument('dataset')
+    p.add_argument('drilldowns', nargs='+')
+    p.add_argument('--no-build', action='store_true', dest='no_build',
+                   default=False,
+                   help="Build the rollup with the next import only")
+    p.set_defaults(func=_add)
+
+    p = sp.add_parser('remove', help='Remove a rollup')
+    p.add_argument('dataset')
+    p.add_argument('drilldowns', nargs='+')
+    p.set_defaults(func=_remove)
+
+    p = sp.add_parser('build', help='Rebuild all rollups of a dataset')
+    p.add_argument('dataset')
+    p.set_defaults(func=_build)
+
+    p = sp.add_parser('list', help='List the rollups of a dataset')
+    p.add_argument('dataset')
+    p.set_defaults(func=_list)
@@ -2,17 +2,63 @@ import logging
 import traceback
 from datetime import datetime
 
-from urllib import urlopen
+from pylons import config
 from messytables import CSVRowSet, headers_processor, \
   offset_processor
 
-from openspending.model import Run, LogRecord
+from openspending.importer.converter import RowConverter
+from openspending.importer.opener import open_source, source_checksum, \
+        local_copy, is_compressed
+from openspending.importer.reader import FastCSVReader, UndecodableRow
+from openspending.lib.timer import StageTimer
+from openspending.model import Run, LogRecord, DateDimension
 from openspending.model import meta as db
 from openspending.validation.model import Invalid
-from openspending.validation.data import convert_types
 
 log = logging.getLogger(__name__)
 
+LOG_BATCH_SIZE = 500
+CHECKPOINT_INTERVAL = 10000
+PROGRESS_INTERVAL = 1000
+
+# The stages to which the time of an import is attributed: reading and
+# parsing the source, type conversion, dimension key resolution, writing
+# fact rows, commits and error logging.
+STAGES = ('read', 'convert', 'keys', 'write', 'commit', 'log')
+
+
+def shadow_import(importers, dry_run=False, resume=False,
+                  build_indices=False, **options):
+    """ Reload a dataset into a shadow version with the ``importers`` of
+    all of its sources, one after the other. The new version replaces
+    all entries, so it is only published if every source has been
+    imported without errors. Returns whether it was published. """
+    dataset = importers[0].dataset
+    sources = set([importer.source for importer in importers])
+    if sources != set(dataset.sources):
+        raise ValueError("A shadow load must reload all sources of the "
+                         "dataset.")
+    if dry_run:
+        for importer in importers:
+            importer.run(dry_run=True, **options)
+        return False
+    dataset.begin_shadow(resume=resume)
+    log.info("Loading into shadow tables: %s", dataset.table_namespace)
+    try:
+        for importer in importers:
+            importer.run(resume=resume, **options)
+    except:
+        dataset.discard_shadow(drop=False)
+        raise
+    if any(importer.errors for importer in importers):
+        # keep the shadow tables for a resumed load
+        log.warn("Not publishing the shadow tables of a failed load.")
+        dataset.discard_shadow(drop=False)
+        return False
+    importers[-1].publish_shadow(build_indices)
+    db.session.commit()
+    return True
+
 
 class BaseImporter(object):
 
@@ -21,36 +67,142 @@ class BaseImporter(object):
         self.dataset = source.dataset
         self.errors = 0
         self.row_number = None
+        self.position = None
+        self._converter = None
+        self._log_buffer = []
+        self._error_counts = {}
+        self.log_batch_size = LOG_BATCH_SIZE
+        self.max_log_records = None
+        self.log_records = 0
+        self.timer = StageTimer()
 
     def run(self,
             dry_run=False,
             max_lines=None,
             raise_errors=False,
+            batch_size=None,
+            staging=False,
+            key_cache_size=None,
+            log_batch_size=LOG_BATCH_SIZE,
+            max_log_records=None,
+            resume=False,
+            incremental=False,
+            seed_calendar=False,
+            checkpoint_interval=CHECKPOINT_INTERVAL,
+            shadow=False,
+            build_indices=False,
             **kwargs):
 
         self.dry_run = dry_run
         self.raise_errors = raise_errors
+        self.log_batch_size = log_batch_size
+        self.max_log_records = max_log_records
 
+        # entries are only durable once the staging tables are merged, so
+        # staged imports have no intermediate checkpoints.
+        self.checkpoint_interval = None if (dry_run or staging) \
+                else checkpoint_interval
+
+        # remote sources are only downloaded for their checksum if the
+        # import is to be resumed; otherwise it is recorded if it is
+        # known without reading the data.
+        source_checksum = None
+        resume_from, position = 0, None
+        if resume and not dry_run:
+            source_checksum = self.source_checksum()
+            resume_from, position = Run.last_checkpoint(self.source,
+                                                        source_checksum)
+            log.info("Resuming import after row %s", resume_from)
+        elif not dry_run:
+            source_checksum = self.source_checksum(download=False)
+
+        shadow = shadow and not dry_run
+        if shadow:
+            if self.dataset.sources.count() > 1:
+                raise ValueError("A shadow load replaces all entries of "
+                    "the dataset, use shadow_import to reload all of its "
+                    "sources.")
+            self.dataset.begin_shadow(resume=bool(resume_from))
+            log.info("Loading into shadow tables: %s",
+                     self.dataset.table_namespace)
         before_count = len(self.dataset)
+        if seed_calendar and not dry_run:
+            for dimension in self.dataset.dimensions:
+                if isinstance(dimension, DateDimension):
+                    dimension.auto_seed = True
+        if incremental and not dry_run:
+            self.dataset.begin_incremental()
+        elif not dry_run:
+            self.dataset.discard_hashes()
+        if staging and not dry_run:
+            self.dataset.begin_staging(batch_size or 1000)
+        elif batch_size and not dry_run:
+            self.dataset.begin_batch(batch_size)
 
         self.row_number = 0
+        self.position = None
+        self.timer = StageTimer()
 
         self._run = Run('import', Run.STATUS_RUNNING,
                         self.dataset, self.source)
+        self._run.source_checksum = source_checksum
+        self._run.checkpoint_row = resume_from
+        if resume_from:
+            self.record_stats(resumed_from=resume_from)
+        skipped = 0
+        if position is not None and self.seek(*position):
+            skipped = position[0]
+            self.record_stats(checkpoint_position=list(position))
+            log.info("Continuing to read the source after row %s",
+                     skipped)
         db.session.add(self._run)
         db.session.commit()
         log.info("Run reference: #%s", self._run.id)
 
+        bulk_load = not dry_run and self.dataset.is_generated
+        if bulk_load:
+            self.warm_caches(key_cache_size)
+            if self.dataset.begin_bulk_load():
+                log.info("Empty dataset, deferring index creation.")
+                self.record_stats(bulk_load=True)
+
+        self.dataset.timer = self.timer
+        self.timer.skip()
         try:
-            for row_number, line in enumerate(self.lines, start=1):
-                if max_lines and row_number >= max_lines:
-                    break
+            try:
+                for row_number, line in enumerate(self.lines,
+                                                  start=skipped + 1):
+                    self.timer.lap('read')
+                    if max_lines and row_number >= max_lines:
+                        break
 
-                self.row_number = row_number
-                self.process_line(line)
+                    self.row_number = row_number
+                    if row_number <= resume_from:
+                        continue
+                    self.process_line(line)
+                    if self.checkpoint_interval and \
+                            row_number % self.checkpoint_interval == 0:
+                        self.checkpoint()
+            finally:
+                # write out entries still pending in the load buffer or
+                # the staging tables
+                try:
+                    if not self.dry_run:
+                        self.dataset.commit()
+                        self.timer.lap('commit')
+                finally:
+                    self.dataset.timer = None
+                    # this also restores what an interrupted bulk load
+                    # left out, as the fact table is no longer empty
+                    if bulk_load:
+                        self.dataset.end_bulk_load()
         except Exception as ex:
             self.log_exception(ex)
             if self.raise_errors:
+                self.flush_log()
+                self.record_stats(timing=self.timer.as_dict())
+                if shadow:
+                    self.dataset.discard_shadow(drop=False)
                 self._run.status = Run.STATUS_FAILED
                 self._run.time_end = datetime.utcnow()
                 db.session.commit()
@@ -61,81 +213,292 @@ class BaseImporter(object):
                     error='')
 
         num_loaded = len(self.dataset) - before_count
-        if not self.errors and num_loaded < (self.row_number - 1):
+        if self.dataset.load_stats is not None:
+            # skipped and updated entries are already in the dataset
+            self.record_stats(entries=self.dataset.load_stats)
+            num_loaded += self.dataset.load_stats['unchanged'] + \
+                    self.dataset.load_stats['updated']
+        num_read = self.row_number - resume_from
+        if not self.errors and num_loaded < (num_read - 1):
             self.log_exception(ValueError("The number of entries loaded is "
                 "smaller than the number of source rows read."),
                 error="%s rows were read, but only %s entries created. "
                     "Check the unique key criteria, entries seem to overlap." \
-                    % (self.row_number, num_loaded))
+                    % (num_read, num_loaded))
+
+        self.flush_log()
+        self.record_stats(errors=self.errors,
+                          data_errors=self.error_summary(),
+                          timing=self.timer.as_dict())
+        if not dry_run:
+            self._run.checkpoint_row = self.row_number
+            self.record_stats(key_cache=dict([(d.name, d.cache_stats()) \
+                for d in self.dataset.compounds]))
 
         if self.errors:
             self._run.status = Run.STATUS_FAILED
         else:
             self._run.status = Run.STATUS_COMPLETE
             log.info("Finished import with no errors!")
+        if shadow and self.errors:
+            # keep the shadow tables for a resumed load
+            log.warn("Not publishing the shadow tables of a failed load.")
+            self.dataset.discard_shadow(drop=False)
+        elif shadow:
+            self.publish_shadow(build_indices)
         self._run.time_end = datetime.utcnow()
         self.dataset.updated_at = self._run.time_end
+        if not dry_run:
+            self.dataset.last_load = {'run': self._run.id,
+                                      'status': self._run.status,
+                                      'rows': num_read,
+                                      'entries': num_loaded}
+            if self.dataset.rollups:
+                self.record_stats(rollups=self.dataset.build_rollups())
         db.session.commit()
 
+    def publish_shadow(self, build_indices=False):
+        """ Switch readers over to the tables of a shadow load. With
+        ``build_indices``, the new entries are indexed in Solr first and
+        the documents of the previous version are removed afterwards,
+        so that search results are complete throughout. """
+        from openspending.lib import solr_util as solr
+        if build_indices:
+            solr.index_entries(self.dataset)
+        previous = self.dataset.end_shadow()
+        self.record_stats(table_version=self.dataset.table_version)
+        if build_indices:
+            solr.drop_version_index(self.dataset.name, previous)
+
+    def checkpoint(self):
+        """ Write all pending entries and log records and remember the
+        current row on the run, so that an interrupted import can be
+        resumed from here. """
+        self.dataset.commit()
+        self.flush_log()
+        self._run.checkpoint_row = self.row_number
+        if self.position is not None:
+            self.record_stats(checkpoint_position=list(self.position))
+        self.record_stats(timing=self.timer.as_dict())
+        db.session.commit()
+        self.timer.lap('commit')
+
+    def seek(self, row, offset):
+        """ Prepare ``lines`` to continue reading the source after
+        ``row``, whose record ended at byte ``offset`` of the source (a
+        ``position`` recorded by an earlier import). Returns whether
+        the importer can do so; otherwise it reads the source from the
+        start. Importers which can seek keep ``position`` up to date
+        while they read. """
+        return False
+
+    def source_checksum(self, download=True):
+        """ A checksum of the source data, used to make sure that an
+        import is only resumed on unchanged data. Unless ``download``
+        is set, it should only be returned if it is cheap to get. """
+        return None
+
+    def warm_caches(self, key_cache_size=None):
+        """ Pre-load the primary keys of all existing dimension members.
+        ``key_cache_size`` is the memory budget of each dimension's key
+        cache in megabytes. """
+        if key_cache_size is not None:
+            key_cache_size = key_cache_size * 1024 * 1024
+        for dimension in self.dataset.compounds:
+            dimension.warm_cache(self.dataset.bind, key_cache_size)
+            log.info("Key cache for '%s': %s members", dimension.name,
+                     dimension.cache_stats()['items'])
+
+    def record_stats(self, **stats):
+        """ Store statistics about the import on the ``Run``. """
+        run_stats = dict(self._run.stats or {})
+        run_stats.update(stats)
+        self._run.stats = run_stats
+
     @property
     def lines(self):
         raise NotImplementedError("lines not implemented in BaseImporter")
 
     def process_line(self, line):
-        if self.row_number % 1000 == 0:
+        if self.row_number % PROGRESS_INTERVAL == 0:
             log.info('Imported %s lines' % self.row_number)
+            self.timer.progress(self.row_number)
 
         try:
-            data = convert_types(self.dataset.mapping, line)
+            data = self.convert(line)
+            self.timer.lap('convert')
             if not self.dry_run:
                 self.dataset.load(data)
         except Invalid as invalid:
             for child in invalid.children:
                 self.log_invalid_data(child)
+            self.timer.lap('log')
             if self.raise_errors:
                 raise
         except Exception as ex:
             self.log_exception(ex)
+            self.timer.lap('log')
             if self.raise_errors:
                 raise
 
-    def log_invalid_data(self, invalid):
-        log_record = LogRecord(self._run, LogRecord.CATEGORY_DATA,
-                               logging.ERROR, invalid.msg)
-        log_record.attribute = invalid.node.name
-        log_record.column = invalid.column
-        log_record.value = invalid.value
-        log_record.data_type = invalid.datatype
+    def convert(self, line):
+        """ Convert a line of source data to the types given in the
+        dataset mapping. """
+        if self._converter is None:
+            self._converter = RowConverter(self.dataset.mapping)
+        return self._converter(line)
 
+    def log_invalid_data(self, invalid):
         msg = "'%s' (%s) could not be generated from column '%s'" \
               " (value: %s): %s"
         msg = msg % (invalid.node.name, invalid.datatype, \
                      invalid.column, invalid.value, invalid.msg)
         log.warn(msg)
-        self._log(log_record)
+
+        key = (invalid.node.name, invalid.column, invalid.datatype)
+        self._error_counts[key] = self._error_counts.get(key, 0) + 1
+        self._log(LogRecord.CATEGORY_DATA, invalid.msg,
+                  attribute=invalid.node.name,
+                  column=invalid.column,
+                  value=invalid.value,
+                  data_type=invalid.datatype)
 
     def log_exception(self, exception, error=None):
-        log_record = LogRecord(self._run, LogRecord.CATEGORY_SYSTEM,
-                               logging.ERROR, str(exception))
-        if error is not None:
-            log_record.error = error
-        else:
-            log_record.error = traceback.format_exc()
+        if error is None:
+            error = traceback.format_exc()
         log.error(unicode(exception))
-        self._log(log_record)
+        self._log(LogRecord.CATEGORY_SYSTEM, str(exception), error=error)
 
-    def _log(self, log_record):
+    def _log(self, category, message, **fields):
+        """ Queue a log record for the current run. Once
+        ``max_log_records`` have been stored, data errors are only
+        counted (see ``error_summary``). """
         self.errors += 1
-        log_record.row = self.row_number
-        db.session.add(log_record)
+        if category == LogRecord.CATEGORY_DATA and \
+                self.max_log_records is not None and \
+                self.log_records >= self.max_log_records:
+            return
+        self.log_records += 1
+        record = dict.fromkeys(('error', 'attribute', 'column',
+                                'data_type', 'value'))
+        record.update(fields)
+        record.update({'run_id': self._run.id,
+                       'category': category,
+                       'level': logging.ERROR,
+                       'message': message,
+                       'row': self.row_number})
+        self._log_buffer.append(record)
+        if len(self._log_buffer) >= self.log_batch_size:
+            self.flush_log()
+
+    def flush_log(self):
+        """ Write all queued log records in a single statement. """
+        if not len(self._log_buffer):
+            return
+        db.session.execute(LogRecord.__table__.insert(), self._log_buffer)
         db.session.commit()
+        self._log_buffer = []
+
+    def error_summary(self):
+        """ Number of data errors for each (attribute, column, data type)
+        combination, including those which were not stored as log
+        records. """
+        summary = []
+        for (attribute, column, data_type), count in \
+                sorted(self._error_counts.items()):
+            summary.append({'attribute': attribute, 'column': column,
+                            'data_type': data_type, 'count': count})
+        return summary
 
 
 class CSVImporter(BaseImporter):
+    """ Import a CSV source. Each source is sniffed on its own: if its
+    first kilobytes are well-formed, it is read with the plain ``csv``
+    module (``reader='fast'`` forces this), otherwise it goes through
+    messytables, which copes with messier input at a much higher cost
+    per row. Rows which are not valid UTF-8 are logged as errors.
+
+    Sources may be compressed, and a current copy in the source archive
+    (``archive_dir``, by default ``openspending.archive_dir``) is read
+    instead of the original URL. """
+
+    def __init__(self, source, reader='auto', archive_dir=None):
+        super(CSVImporter, self).__init__(source)
+        self.reader = reader
+        self.archive_dir = archive_dir or \
+                config.get('openspending.archive_dir')
+        self._start = None
+
+    def open(self):
+        return open_source(self.source.url, self.archive_dir,
+                           self.source.content_hash)
+
+    def local_file(self):
+        """ The path of an uncompressed local copy of the source, in
+        which records can be found by their byte offset, or ``None``. """
+        path = local_copy(self.source.url, self.archive_dir,
+                          self.source.content_hash)
+        if path is None or is_compressed(path):
+            return None
+        return path
+
+    def fast_reader(self, path=None):
+        """ A ``FastCSVReader`` for the local file ``path`` or else the
+        source, if the sample at its start shows that it can be read
+        without messytables, or ``None``. """
+        if self.reader == 'messytables':
+            return None
+        fh = open(path, 'rb') if path is not None else self.open()
+        reader = FastCSVReader(fh)
+        if self.reader == 'fast' or reader.well_formed:
+            return reader
+        fh.close()
+        return None
+
+    def seek(self, row, offset):
+        self._start = None
+        path = self.local_file()
+        if path is None:
+            return False
+        reader = self.fast_reader(path)
+        if reader is None:
+            return False
+        reader.fh.close()
+        self._start = (row, offset)
+        return True
 
     @property
     def lines(self):
-        fh = urlopen(self.source.url)
+        start, self._start = self._start, None
+        path = self.local_file()
+        reader = self.fast_reader(path)
+        if reader is None:
+            log.info("Reading %s with messytables.", self.source.url)
+            return self._messytables_lines(self.open())
+        log.info("Reading %s with the fast CSV reader.", self.source.url)
+        if path is not None:
+            return self._tracked_lines(reader, start)
+        return iter(reader)
+
+    def convert(self, line):
+        if isinstance(line, UndecodableRow):
+            raise line.error
+        return super(CSVImporter, self).convert(line)
+
+    def _tracked_lines(self, reader, start):
+        """ Read the rows of a local file, keeping ``position`` at the
+        end of the last row. """
+        row, offset = start or (0, None)
+        for offset, line in reader.records(offset):
+            row += 1
+            self.position = (row, offset)
+            yield line
+
+    def source_checksum(self, download=True):
+        return source_checksum(self.source.url, self.archive_dir,
+                               self.source.content_hash, download)
+
+    def _messytables_lines(self, fh):
         row_set = CSVRowSet('data', fh, window=3)
         headers = list(row_set.sample)[0]
         headers = [c.value for c in headers]
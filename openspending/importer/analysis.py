@@ -1,10 +1,19 @@
 from collections import defaultdict
-from urllib import urlopen
+import csv
 import logging
+from datetime import datetime
+from itertools import islice, chain
+from StringIO import StringIO
 
-from messytables import CSVRowSet, type_guess
-from messytables.types import TYPES, DateType
+from pylons import config
+from messytables import CSVRowSet
+from messytables.types import TYPES, DateType, StringType
+from openspending.lib import json
 from openspending.lib.util import slugify
+from openspending.importer.opener import open_source, decompress, \
+        conditional_fetch, content_length, HashingFile, PrefixedFile, \
+        BLOCK_SIZE
+from openspending.importer.reader import FastCSVReader
 
 log = logging.getLogger(__name__)
 
@@ -16,47 +25,232 @@ LIMITED_TYPES = list(TYPES)
 LIMITED_TYPES.remove(DateType)
 LIMITED_TYPES.append(LocalDateType)
 
+# Formats which are analyzed from typed records instead of text:
+TYPED_FORMATS = ('parquet', 'arrow')
 
-def frequent_values(sample):
-    values = defaultdict(lambda: defaultdict(int))
-    for row in sample:
-        for i, value in enumerate(row):
-            values[i][value.value] += 1
-    sorted_values = []
-    for idx, column in values.items():
-        frequent = sorted(column.items(), key=lambda (v, c): c, reverse=True)
-        sorted_values.append(frequent[:5])
-    return sorted_values
+class ColumnProfile(object):
+    """ Collect the type, the value frequencies and the number of empty
+    cells of a column from a stream of values. The type is guessed like
+    messytables' ``type_guess`` does: the successful conversions of the
+    values to each type are counted and weighted by the type's
+    ``guessing_weight``, so that a few stray values do not change the
+    type of a column. """
 
+    def __init__(self, header, types=LIMITED_TYPES):
+        self.header = header
+        self.types = types
+        self.guesses = defaultdict(int)
+        self.values = defaultdict(int)
+        self.count = 0
+        self.empty = 0
 
-def analyze_csv(url, sample=1000):
+    def add(self, value):
+        if value is None:
+            value = u''
+        elif not isinstance(value, basestring):
+            value = unicode(value)
+        for type_ in self.types:
+            guess = type_.test(value)
+            if guess is not None:
+                self.guesses[guess] += 1
+        if not value.strip():
+            self.empty += 1
+            return
+        self.count += 1
+        self.values[value] += 1
+
+    @property
+    def type(self):
+        if not self.guesses:
+            return StringType()
+        return max(self.guesses.items(),
+                   key=lambda (t, n): n * t.guessing_weight)[0]
+
+    def frequent(self, limit=5):
+        frequent = sorted(self.values.items(), key=lambda (v, c): (-c, v))
+        return [list(item) for item in frequent[:limit]]
+
+    @property
+    def cardinality(self):
+        """ Estimated number of distinct values in the whole column
+        (the Chao1 estimator), based on how many values of the sample
+        occur only once or twice. """
+        distinct = len(self.values)
+        counts = self.values.values()
+        singletons = counts.count(1)
+        doubletons = counts.count(2)
+        if not singletons:
+            return distinct
+        if not doubletons:
+            return distinct + singletons * (singletons - 1) / 2
+        return distinct + (singletons ** 2) / (2 * doubletons)
+
+    def to_dict(self):
+        return {'type': repr(self.type).lower(),
+                'count': self.count,
+                'empty': self.empty,
+                'distinct': len(self.values),
+                'cardinality': self.cardinality,
+                'frequent': self.frequent()}
+
+
+def record_rows(records):
+    """ Turn a list of dictionaries into headers (all keys, in the order
+    they first appear) and rows of values. """
+    headers, seen = [], set()
+    for record in records:
+        for key in record:
+            if key not in seen:
+                seen.add(key)
+                headers.append(key)
+    return headers, ([r.get(h) for h in headers] for r in records)
+
+
+def sample_rows(fileobj, sample):
+    """ Read the header and up to ``sample`` rows of a CSV or NDJSON file
+    as lists of values. CSV files which the ``csv`` module cannot read
+    reliably are read through messytables. """
+    reader = FastCSVReader(fileobj)
+    lines = chain(StringIO(reader.sample), fileobj)
+    if reader.sample.lstrip().startswith('{'):
+        lines = (l for l in lines if l.strip())
+        return record_rows([json.loads(l) for l in islice(lines, sample)])
+    if reader.well_formed:
+        rows = csv.reader(lines, **reader.dialect)
+        rows = ([v.decode('utf-8', 'ignore') for v in r] for r in rows)
+    else:
+        fileobj = PrefixedFile(fileobj, reader.sample)
+        row_set = CSVRowSet('data', fileobj, window=sample + 1)
+        rows = ([c.value for c in r] for r in row_set)
+    try:
+        headers = rows.next()
+    except StopIteration:
+        return [], []
+    return headers, islice(rows, sample)
+
+
+def profile_rows(headers, rows, types=LIMITED_TYPES):
+    """ Profile the columns of a table in a single pass over its rows.
+    """
+    profiles = [ColumnProfile(h, types) for h in headers]
+    num_rows = 0
+    for row in rows:
+        num_rows += 1
+        for profile, value in zip(profiles, row):
+            profile.add(value)
+    return num_rows, profiles
+
+
+def suggest_mapping(profiles):
+    """ Build a dimension mapping from the column profiles, which the
+    dimension editor offers as a starting point. """
+    mapping = {}
+    for profile in profiles:
+        type_ = repr(profile.type).lower()
+        name = slugify(profile.header).lower()
+        meta = {
+            'label': profile.header,
+            'column': profile.header,
+            'datatype': type_
+            }
+        if type_ in ['decimal', 'integer', 'float']:
+            meta['type'] = 'measure'
+            meta['datatype'] = 'float'
+        elif type_.startswith('date'):
+            meta['type'] = 'date'
+            meta['datatype'] = 'date'
+        else:
+            meta['type'] = 'attribute'
+        mapping[name] = meta
+    return mapping
+
+
+def analyze_columns(url, sample=1000, fileobj=None):
+    """ Analyze a sample of a CSV or NDJSON source in a single pass: a
+    profile of each column (its type, frequent values and estimated
+    number of distinct values) and a suggested mapping. """
+    try:
+        if fileobj is None:
+            fileobj = open_source(url, config.get('openspending.archive_dir'))
+        return analyze_rows(*sample_rows(fileobj, sample))
+    except Exception, e:
+        log.exception(e)
+        return {'error': unicode(e)}
+
+
+def analyze_records(source, sample=1000):
+    """ Analyze a sample of the typed records of a Parquet or Arrow
+    source, read by its importer. """
+    from openspending.importer.formats import get_importer
     try:
-        fileobj = urlopen(url)
-        row_set = CSVRowSet('data', fileobj, window=sample)
-        sample = list(row_set.sample)
-        headers, sample = sample[0], sample[1:]
-        #values = frequent_values(sample)
-        types = type_guess(sample[500:], types=LIMITED_TYPES)
-        mapping = {}
-        for header, type_ in zip(headers, types):
-            type_ = repr(type_).lower()
-            name = slugify(header.value).lower()
-            meta = {
-                'label': header.value,
-                'column': header.value,
-                'datatype': type_
-                }
-            if type_ in ['decimal', 'integer', 'float']:
-                meta['type'] = 'measure'
-                meta['datatype'] = 'float'
-            elif type_.startswith('date'):
-                meta['type'] = 'date'
-                meta['datatype'] = 'date'
-            else:
-                meta['type'] = 'attribute'
-            mapping[name] = meta
-        return {'columns': [h.value for h in headers], \
-                'mapping': mapping}
+        lines = get_importer(source).lines
+        return analyze_rows(*record_rows(list(islice(lines, sample))))
     except Exception, e:
         log.exception(e)
         return {'error': unicode(e)}
+
+
+def analyze_rows(headers, rows):
+    """ Column profiles and a suggested mapping for a sample of rows. """
+    num_rows, profiles = profile_rows(headers, rows)
+    return {'columns': [p.header for p in profiles],
+            'rows': num_rows,
+            'profile': dict([(p.header, p.to_dict()) for p in profiles]),
+            'mapping': suggest_mapping(profiles)}
+
+
+def update_analysis(source, force=False):
+    """ Re-analyze a source if its data has changed since it was last
+    fetched. A conditional request with the stored ETag and Last-Modified
+    validators avoids the download of unchanged data. If the server
+    ignores them, the content hash decides, or, for sources which are
+    larger than the analyzed sample (and are not downloaded further
+    to compute the hash), the validators and size. Returns ``True`` if
+    the analysis was updated. """
+    source.checked_at = datetime.utcnow()
+    if force:
+        fh, validators = conditional_fetch(source.url)
+    else:
+        fh, validators = conditional_fetch(source.url, source.etag,
+                                           source.last_modified)
+    if fh is None:
+        log.info("Not modified: %s", source.url)
+        return False
+    sample = int(config.get('openspending.analysis_sample', 1000))
+    typed = source.format in TYPED_FORMATS
+    size = content_length(fh)
+    hashing = HashingFile(fh)
+    try:
+        analysis = None
+        if not typed:
+            analysis = analyze_columns(source.url, sample=sample,
+                                       fileobj=decompress(hashing))
+        content_hash = hashing.hexdigest(limit=BLOCK_SIZE)
+    finally:
+        hashing.close()
+    if content_hash is not None:
+        size = hashing.size
+    if not force and _unchanged(source, content_hash, validators, size):
+        log.info("Unchanged content: %s", source.url)
+        unchanged = True
+    else:
+        unchanged = False
+    source.etag = validators.get('etag')
+    source.last_modified = validators.get('last_modified')
+    source.size = size
+    if unchanged:
+        return False
+    if analysis is None:
+        analysis = analyze_records(source, sample)
+    source.content_hash = content_hash
+    source.analysis = analysis
+    return True
+
+
+def _unchanged(source, content_hash, validators, size):
+    if content_hash is not None:
+        return content_hash == source.content_hash
+    if validators.get('etag') is not None:
+        return validators['etag'] == source.etag
+    return size is not None and size == source.size and \
+            validators.get('last_modified') == source.last_modified
@@ -0,0 +1,173 @@
+"""
+A row converter which is compiled once for a dataset mapping. It
+produces the same output and the same validation errors as
+``openspending.validation.data.convert_types``, but does not walk the
+mapping and look up the attribute types again for every row.
+
+Typed sources (JSON, Parquet, Arrow) can be converted with
+``typed=True``: values which already have the Python type of their
+attribute are passed through instead of being parsed from text.
+"""
+import re
+from datetime import datetime, date
+
+from colander import SchemaNode, Mapping
+
+from openspending.validation.model import Invalid
+from openspending.validation.data import InvalidData
+from openspending.validation.util import slugify
+
+FLOAT_RE = re.compile(r'^[0-9-\,]*(\.[0-9]*[Ee]?\+?[0-9]*)?$')
+DATE_FORMATS = ["%Y-%m-%dZ", "%Y-%m-%d", "%Y-%m", "%Y"]
+
+
+def _string(value):
+    return unicode(value)
+
+
+def _float(value):
+    if not FLOAT_RE.match(value):
+        raise ValueError("Numbers must only contain digits, periods, "
+                         "dashes and commas")
+    return float(unicode(value).replace(",", ""))
+
+
+def _date_parser(format_):
+    """ Make a date parser. Without an explicit format, the format
+    which matched last is tried first. """
+    if format_:
+        def parse(value):
+            try:
+                return datetime.strptime(unicode(value), format_).date()
+            except ValueError:
+                raise ValueError("date does not match the specified "
+                                 "format (%s)" % format_)
+        return parse
+
+    formats = list(DATE_FORMATS)
+
+    def guess(value):
+        value = unicode(value)
+        for i, format_ in enumerate(formats):
+            try:
+                date = datetime.strptime(value, format_).date()
+            except ValueError:
+                continue
+            if i > 0:
+                formats.insert(0, formats.pop(i))
+            return date
+        raise ValueError("'%s': invalid date value." % value)
+    return guess
+
+
+def _missing_datatype(value):
+    raise KeyError('datatype')
+
+
+def _typed_parser(datatype, parse):
+    """ Wrap a text parser so that typed values are used as they are
+    and only strings are parsed. """
+    def convert(value):
+        if isinstance(value, basestring):
+            return parse(value)
+        if datatype == 'float' and isinstance(value, (int, long, float)) \
+                and not isinstance(value, bool):
+            return float(value)
+        if datatype == 'date' and isinstance(value, date):
+            if isinstance(value, datetime):
+                return value.date()
+            return value
+        return parse(unicode(value))
+    return convert
+
+
+def _make_parser(meta, typed=False):
+    if 'datatype' not in meta:
+        return _missing_datatype
+    datatype = meta['datatype'].lower().strip()
+    if datatype == 'id':
+        parse = slugify
+    elif datatype == 'float':
+        parse = _float
+    elif datatype == 'date':
+        parse = _date_parser(meta.get('format'))
+    else:
+        parse = _string
+    if typed:
+        return _typed_parser(datatype, parse)
+    return parse
+
+
+class ColumnConverter(object):
+    """ Extract and convert a single attribute from a source row. """
+
+    def __init__(self, name, meta, typed=False):
+        self.name = name
+        self.column = meta.get('column')
+        self.default_value = meta.get('default_value')
+        self.datatype = meta.get('datatype')
+        self.parse = _make_parser(meta, typed)
+
+    def value(self, row):
+        if not self.column in row:
+            raise ValueError("Column '%s' does not exist in source data." %
+                    self.column)
+        value = row.get(self.column)
+        if (value is None) or \
+                (isinstance(value, basestring) and not len(value.strip())):
+            if self.default_value is not None:
+                value = self.default_value
+            else:
+                raise ValueError("Column is empty")
+        return value
+
+    def __call__(self, row):
+        try:
+            return self.parse(self.value(row))
+        except KeyError:
+            raise
+        except Exception, e:
+            try:
+                value = self.value(row)
+            except ValueError:
+                value = None
+            raise InvalidData(self.name, self.column, self.datatype,
+                              value, unicode(e))
+
+
+class RowConverter(object):
+    """ Translate a row of input data into the structure understood by
+    the dataset loader, like ``convert_types``. The mapping is compiled
+    into a flat list of column converters when the object is created.
+    """
+
+    def __init__(self, mapping, typed=False):
+        self.compounds = []
+        self.converters = []
+        for dimension, meta in mapping.items():
+            if 'column' in meta:
+                self.converters.append((dimension, None,
+                    ColumnConverter(dimension, meta, typed)))
+            else:
+                self.compounds.append(dimension)
+                for attribute, ameta in meta.get('attributes', {}).items():
+                    self.converters.append((dimension, attribute,
+                        ColumnConverter(dimension + '.' + attribute, ameta,
+                                        typed)))
+
+    def __call__(self, row):
+        out = dict([(d, {}) for d in self.compounds])
+        errors = None
+        for dimension, attribute, convert in self.converters:
+            try:
+                if attribute is None:
+                    out[dimension] = convert(row)
+                else:
+                    out[dimension][attribute] = convert(row)
+            except InvalidData, i:
+                if errors is None:
+                    errors = Invalid(SchemaNode(Mapping(unknown='preserve')))
+                errors.add(i)
+        if errors is not None:
+            raise errors
+        return out
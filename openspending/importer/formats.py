@@ -0,0 +1,160 @@
+"""
+Importers for sources which are not CSV: newline-delimited JSON,
+Parquet and Arrow IPC files (the latter two need the optional
+``pyarrow`` package, see ``requirements-arrow.txt``). They
+read the source in record batches and hand typed values to the row
+converter, which only parses values that arrive as text.
+
+``get_importer`` picks the importer class for the format of a source.
+"""
+import logging
+
+from pylons import config
+
+from openspending.lib import json
+from openspending.importer import BaseImporter, CSVImporter
+from openspending.importer.converter import RowConverter
+from openspending.importer.opener import open_source, source_checksum, \
+        source_format, local_copy, fetch
+
+log = logging.getLogger(__name__)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+BATCH_SIZE = 10000
+
+
+class TypedImporter(BaseImporter):
+    """ Base class for importers of sources whose values are already
+    typed. Like the ``CSVImporter``, it reads an archived copy of the
+    source if there is a current one in ``archive_dir``. """
+
+    def __init__(self, source, archive_dir=None):
+        super(TypedImporter, self).__init__(source)
+        self.archive_dir = archive_dir or \
+                config.get('openspending.archive_dir')
+
+    def source_checksum(self, download=True):
+        return source_checksum(self.source.url, self.archive_dir,
+                               self.source.content_hash, download)
+
+    def convert(self, line):
+        if self._converter is None:
+            self._converter = RowConverter(self.dataset.mapping, typed=True)
+        return self._converter(line)
+
+
+class NDJSONImporter(TypedImporter):
+    """ Import a file of JSON objects, one per line. Each object is a
+    row, its keys are the column names. Lines are decoded in
+    ``convert`` so that a malformed line is logged as an error of its
+    row instead of ending the import. """
+
+    @property
+    def lines(self):
+        fh = open_source(self.source.url, self.archive_dir,
+                         self.source.content_hash)
+        try:
+            for line in fh:
+                if line.strip():
+                    yield line
+        finally:
+            fh.close()
+
+    def convert(self, line):
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError("Each line must contain a JSON object.")
+        return super(NDJSONImporter, self).convert(row)
+
+
+class ArrowImporter(TypedImporter):
+    """ Import an Arrow IPC file or stream, one record batch at a
+    time. """
+
+    def __init__(self, source, archive_dir=None):
+        if pyarrow is None:
+            raise ValueError("Importing Parquet and Arrow sources requires "
+                             "the pyarrow package.")
+        super(ArrowImporter, self).__init__(source, archive_dir=archive_dir)
+
+    def open(self):
+        """ A pyarrow file object for the source: local files and
+        archived copies are memory-mapped, other sources are
+        downloaded into memory. """
+        path = local_copy(self.source.url, self.archive_dir,
+                          self.source.content_hash)
+        if path is not None:
+            return pyarrow.memory_map(path, 'r')
+        fh = fetch(self.source.url)
+        try:
+            return pyarrow.BufferReader(fh.read())
+        finally:
+            fh.close()
+
+    def batches(self, fh):
+        if fh.read(6) == 'ARROW1':
+            fh.seek(0)
+            reader = pyarrow.ipc.open_file(fh)
+            for i in xrange(reader.num_record_batches):
+                yield reader.get_batch(i)
+        else:
+            fh.seek(0)
+            for batch in pyarrow.ipc.open_stream(fh):
+                yield batch
+
+    @property
+    def lines(self):
+        fh = self.open()
+        try:
+            for batch in self.batches(fh):
+                columns = batch.to_pydict()
+                names = columns.keys()
+                for values in zip(*[columns[n] for n in names]):
+                    yield dict(zip(names, values))
+        finally:
+            fh.close()
+
+
+class ParquetImporter(ArrowImporter):
+    """ Import a Parquet file, one row group at a time. """
+
+    def batches(self, fh):
+        parquet = pyarrow.parquet.ParquetFile(fh)
+        for i in xrange(parquet.num_row_groups):
+            table = parquet.read_row_group(i)
+            for batch in table.to_batches(BATCH_SIZE):
+                yield batch
+
+
+IMPORTERS = {
+    'ndjson': NDJSONImporter,
+    'arrow': ArrowImporter,
+    'parquet': ParquetImporter
+    }
+
+
+def get_importer(source, processes=None, reader='auto', format=None,
+                 archive_dir=None):
+    """ Create an importer for the format of ``source`` (detected like
+    ``Source.format``, but from an archived copy in ``archive_dir`` if
+    there is one, unless ``format`` is given). CSV sources are parsed
+    and converted in worker processes by the ``PipelinedCSVImporter``
+    if ``processes`` is set. """
+    archive_dir = archive_dir or config.get('openspending.archive_dir')
+    if format is None:
+        format = source_format(source.url, archive_dir,
+                               source.content_hash)
+    if format in IMPORTERS:
+        log.info("Importing %s source.", format)
+        return IMPORTERS[format](source, archive_dir=archive_dir)
+    if processes:
+        from openspending.importer.pipelined import PipelinedCSVImporter
+        return PipelinedCSVImporter(source, processes=processes,
+                                    reader=reader, archive_dir=archive_dir)
+    return CSVImporter(source, reader=reader, archive_dir=archive_dir)
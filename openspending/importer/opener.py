@@ -0,0 +1,402 @@
+"""
+Open source files for reading. Sources can be remote URLs, ``file://``
+URLs or plain paths, and may be compressed with gzip, bzip2 or (if the
+``lzma`` module is installed) xz, which is detected from the first bytes
+of the file and decompressed while streaming.
+
+If an archive directory is configured (``openspending.archive_dir``,
+filled by ``ostool archive update``), a current archived copy of the
+source is read instead of downloading it again. A copy is current if it
+is unchanged since it was archived and, where the checksum of the
+source data as last fetched is known (``Source.content_hash``), it has
+the same checksum.
+"""
+import bz2
+import hashlib
+import json
+import logging
+import os
+import urllib2
+import zlib
+from email.utils import formatdate
+from urllib import urlopen
+from urlparse import urlparse
+
+from openspending.importer.reader import local_path, checksum
+
+log = logging.getLogger(__name__)
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+BLOCK_SIZE = 64 * 1024
+
+MAGIC = {
+    'gzip': '\x1f\x8b',
+    'bz2': 'BZh',
+    'xz': '\xfd7zXZ\x00'
+    }
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+FORMAT_EXTENSIONS = {
+    '.csv': 'csv',
+    '.tsv': 'csv',
+    '.txt': 'csv',
+    '.json': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.ndjson': 'ndjson',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow'
+    }
+
+# Arrow IPC files start with 'ARROW1', streams with a continuation
+# marker followed by the length of the schema message.
+FORMAT_MAGIC = [
+    ('PAR1', 'parquet'),
+    ('ARROW1', 'arrow'),
+    ('\xff\xff\xff\xff', 'arrow')
+    ]
+
+
+def archive_path(archive_dir, url):
+    """ Location of the archived copy of ``url`` in ``archive_dir``. """
+    name = hashlib.sha1(url).hexdigest()[:10]
+    name += '-' + os.path.basename(url)
+    return os.path.join(archive_dir, name)
+
+
+def write_sidecar(path, url, etag=None, last_modified=None):
+    """ Record the checksum of an archived file next to it, together
+    with its size and modification time and the HTTP validators it was
+    fetched with. """
+    fh = open(path, 'rb')
+    try:
+        md5 = checksum(fh)
+    finally:
+        fh.close()
+    stat = os.stat(path)
+    meta = {'url': url, 'md5': md5, 'size': stat.st_size,
+            'mtime': stat.st_mtime, 'etag': etag,
+            'last_modified': last_modified}
+    with open(path + '.json', 'w') as fh:
+        json.dump(meta, fh)
+    return meta
+
+
+def read_sidecar(path, url):
+    """ Return the metadata of an archived copy of ``url`` if the file
+    has not changed since its checksum was recorded, otherwise
+    ``None``. """
+    try:
+        with open(path + '.json') as fh:
+            meta = json.load(fh)
+        stat = os.stat(path)
+    except (IOError, OSError, ValueError):
+        return None
+    if meta.get('url') != url or meta.get('size') != stat.st_size or \
+            meta.get('mtime') != stat.st_mtime:
+        return None
+    return meta
+
+
+def archived_copy(url, archive_dir, md5=None):
+    """ The path and metadata of a current archived copy of ``url``, or
+    ``(None, None)``. If the checksum ``md5`` of the source data is
+    given, a copy with a different checksum is not current. """
+    if archive_dir is None:
+        return None, None
+    path = archive_path(archive_dir, url)
+    meta = read_sidecar(path, url)
+    if meta is None:
+        return None, None
+    if md5 is not None and meta.get('md5') != md5:
+        log.info("Archived copy of %s is outdated", url)
+        return None, None
+    return path, meta
+
+
+def local_copy(url, archive_dir=None, md5=None):
+    """ The path of a local file with the contents of ``url``: either
+    the file it refers to or its archived copy. """
+    path = local_path(url)
+    if path is None:
+        path, meta = archived_copy(url, archive_dir, md5)
+    return path
+
+
+def fetch(url, archive_dir=None, md5=None):
+    """ Open the raw (possibly compressed) source data. """
+    path = local_copy(url, archive_dir, md5)
+    if path is not None:
+        log.info("Reading %s from %s", url, path)
+        return open(path, 'rb')
+    return urlopen(url)
+
+
+def source_checksum(url, archive_dir=None, md5=None, download=True):
+    """ MD5 checksum of the raw source data. For archived copies, the
+    recorded checksum is used. Unless ``download`` is set, remote
+    sources without an archived copy are not fetched to compute it and
+    ``None`` is returned. """
+    path, meta = archived_copy(url, archive_dir, md5)
+    if meta is not None:
+        return meta['md5']
+    if not download and local_path(url) is None:
+        return None
+    fh = fetch(url)
+    try:
+        return checksum(fh)
+    finally:
+        fh.close()
+
+
+def compression(head):
+    """ Name of the compression format recognized from the first bytes
+    of a file, or ``None``. """
+    for name, magic in MAGIC.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def decompressor(name):
+    if name == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if name == 'bz2':
+        return bz2.BZ2Decompressor()
+    if lzma is None:
+        raise ValueError("Reading xz compressed sources requires the "
+                         "lzma module.")
+    return lzma.LZMADecompressor()
+
+
+def is_compressed(path):
+    fh = open(path, 'rb')
+    try:
+        return compression(fh.read(6)) is not None
+    finally:
+        fh.close()
+
+
+class DecompressedFile(object):
+    """ A read-only file object which decompresses a stream on the fly.
+    It supports what the CSV readers need: ``read``, ``readline`` and
+    iteration over lines. """
+
+    def __init__(self, fh, decompressor, head=''):
+        self.fh = fh
+        self.decompressor = decompressor
+        self.buffer = decompressor.decompress(head) if head else ''
+        # position of the first unread byte in the buffer:
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """ Append the next block of decompressed data to the buffer,
+        dropping what has been read already. """
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        while not self.eof:
+            data = self.fh.read(BLOCK_SIZE)
+            if not data:
+                self.eof = True
+                flush = getattr(self.decompressor, 'flush', None)
+                if flush is not None:
+                    data = flush()
+            else:
+                data = self.decompressor.decompress(data)
+            if data:
+                self.buffer += data
+                return
+
+    def read(self, size=-1):
+        while not self.eof and \
+                (size < 0 or len(self.buffer) - self.pos < size):
+            self._fill()
+        end = len(self.buffer) if size < 0 else self.pos + size
+        data = self.buffer[self.pos:end]
+        self.pos += len(data)
+        return data
+
+    def readline(self):
+        end = self.buffer.find('\n', self.pos)
+        while end < 0 and not self.eof:
+            searched = len(self.buffer) - self.pos
+            self._fill()
+            end = self.buffer.find('\n', searched)
+        end = len(self.buffer) if end < 0 else end + 1
+        line = self.buffer[self.pos:end]
+        self.pos = end
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def close(self):
+        self.fh.close()
+
+
+class PrefixedFile(object):
+    """ A file object which puts back the bytes read to detect the
+    compression of an uncompressed stream. """
+
+    def __init__(self, fh, head):
+        self.fh = fh
+        self.head = head
+
+    def read(self, size=-1):
+        head, self.head = self.head, ''
+        if size < 0:
+            return head + self.fh.read()
+        if len(head) >= size:
+            self.head = head[size:]
+            return head[:size]
+        return head + self.fh.read(size - len(head))
+
+    def readline(self):
+        head, self.head = self.head, ''
+        if '\n' in head:
+            pos = head.index('\n') + 1
+            self.head = head[pos:]
+            return head[:pos]
+        return head + self.fh.readline()
+
+    def __iter__(self):
+        while self.head:
+            yield self.readline()
+        for line in self.fh:
+            yield line
+
+    def close(self):
+        self.fh.close()
+
+
+def decompress(fh):
+    """ Wrap a raw file object so that compressed data is decompressed
+    while it is read. """
+    head = fh.read(6)
+    name = compression(head)
+    if name is None:
+        return PrefixedFile(fh, head)
+    log.info("Decompressing %s source", name)
+    return DecompressedFile(fh, decompressor(name), head)
+
+
+def open_source(url, archive_dir=None, md5=None):
+    """ Open a source for reading its (decompressed) contents. """
+    return decompress(fetch(url, archive_dir, md5))
+
+
+class HashingFile(object):
+    """ A file object wrapper which computes the MD5 checksum and the
+    size of everything read through it. """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.digest = hashlib.md5()
+        self.size = 0
+
+    def _update(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+    def read(self, size=-1):
+        return self._update(self.fh.read(size))
+
+    def readline(self):
+        return self._update(self.fh.readline())
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def hexdigest(self, limit=None):
+        """ Read the rest of the file and return its checksum. If more
+        than ``limit`` bytes are left, stop there and return ``None``. """
+        read = 0
+        while limit is None or read <= limit:
+            data = self.read(BLOCK_SIZE)
+            if not data:
+                return self.digest.hexdigest()
+            read += len(data)
+        return None
+
+    def close(self):
+        self.fh.close()
+
+
+def conditional_fetch(url, etag=None, last_modified=None):
+    """ Open the raw source data unless it is unchanged according to
+    the ``etag`` and ``last_modified`` validators of an earlier fetch.
+    Returns a tuple of the file object (``None`` if unchanged) and the
+    new validators. For local files, the modification time serves as
+    ``last_modified``. """
+    path = local_path(url)
+    if path is not None:
+        modified = formatdate(os.stat(path).st_mtime, usegmt=True)
+        if modified == last_modified:
+            return None, {}
+        return open(path, 'rb'), {'last_modified': modified}
+    request = urllib2.Request(url)
+    if etag is not None:
+        request.add_header('If-None-Match', etag)
+    if last_modified is not None:
+        request.add_header('If-Modified-Since', last_modified)
+    try:
+        fh = urllib2.urlopen(request)
+    except urllib2.HTTPError, e:
+        if e.code == 304:
+            return None, {}
+        raise
+    headers = fh.info()
+    return fh, {'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified')}
+
+
+def content_length(fh):
+    """ The size of the raw data of a file object opened by
+    ``conditional_fetch``, as announced by the server or of the local
+    file, or ``None`` if it is not known. """
+    if hasattr(fh, 'info'):
+        length = fh.info().get('Content-Length')
+        return int(length) if length else None
+    try:
+        return os.fstat(fh.fileno()).st_size
+    except (AttributeError, OSError):
+        return None
+
+
+def source_format(url, archive_dir=None, md5=None):
+    """ Guess the format of a source ('csv', 'ndjson', 'parquet' or
+    'arrow') from the extension of its URL or, if that is not known,
+    from the first bytes of its (decompressed) data. """
+    path = urlparse(url).path.lower()
+    base, ext = os.path.splitext(path)
+    if ext in COMPRESSED_EXTENSIONS:
+        base, ext = os.path.splitext(base)
+    if ext in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[ext]
+    fh = open_source(url, archive_dir, md5)
+    try:
+        head = fh.read(BLOCK_SIZE)
+    finally:
+        fh.close()
+    for magic, name in FORMAT_MAGIC:
+        if head.startswith(magic):
+            return name
+    if head.lstrip().startswith('{'):
+        return 'ndjson'
+    return 'csv'
@@ -0,0 +1,169 @@
+"""
+Pipelined CSV import. The source file is split into byte ranges which
+start and end on record boundaries, and the ranges are parsed and type
+converted in a pool of worker processes while the importing process
+loads the rows converted so far. Only parsing and conversion run in
+parallel: ``Dataset.load``, and with it the assignment of dimension
+keys and all writes, stays serial in the importing process, so this
+helps sources whose conversion costs about as much as their loading.
+"""
+import csv
+import logging
+from collections import deque
+from StringIO import StringIO
+from multiprocessing import Pool, cpu_count
+
+from colander import SchemaNode, Mapping
+
+from openspending.importer import CSVImporter
+from openspending.importer.converter import RowConverter
+from openspending.importer.reader import make_row
+from openspending.validation.model import Invalid
+from openspending.validation.data import InvalidData
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def record_ranges(fh, chunk_size, quotechar='"', start=None):
+    """ Split a CSV file into byte ranges of about ``chunk_size``,
+    skipping the header record. A line ending only terminates a record
+    if an even number of quote characters has been seen before it, so
+    ranges never split a quoted value which spans several lines. If the
+    file has been positioned at the record boundary ``start``, ranges
+    begin there. """
+    pos, quotes = start or 0, 0
+    for line in fh:
+        pos += len(line)
+        quotes += line.count(quotechar)
+        if quotes % 2:
+            continue
+        if start is None:
+            start = pos
+        elif pos - start >= chunk_size:
+            yield start, pos
+            start = pos
+    if start is not None and pos > start:
+        yield start, pos
+
+
+def splittable(sample, dialect):
+    """ Check that ``record_ranges`` finds the record boundaries in a
+    sample of a file: this fails if a quote character appears in an
+    unquoted value, so that quotes no longer come in pairs. """
+    fh = StringIO(sample)
+    for start, end in record_ranges(fh, 1, dialect['quotechar']):
+        records = csv.reader(StringIO(sample[start:end]), **dialect)
+        if len(list(records)) > 1:
+            return False
+    return True
+
+
+def convert_range(args):
+    """ Worker function: parse and convert all records in a byte range
+    of the file. Returns a list of ``(status, payload)`` tuples, one for
+    each record, which can be sent back to the importing process. """
+    path, start, end, dialect, headers, mapping = args
+    fh = open(path, 'rb')
+    try:
+        fh.seek(start)
+        data = fh.read(end - start)
+    finally:
+        fh.close()
+    convert = RowConverter(mapping)
+    results = []
+    for values in csv.reader(data.splitlines(True), **dialect):
+        try:
+            row = make_row(headers, values)
+            results.append(('data', convert(row)))
+        except Invalid as invalid:
+            results.append(('invalid', [(c.node.name, c.column, c.datatype,
+                c.value, c.msg) for c in invalid.children]))
+        except Exception as ex:
+            results.append(('error', unicode(ex)))
+    return results
+
+
+class PipelinedCSVImporter(CSVImporter):
+    """ A CSV importer which parses and converts the source in a pool of
+    worker processes, ahead of the rows it loads itself. Only
+    uncompressed local files (or archived copies) which the fast reader
+    would accept as well-formed can be split into ranges; other sources,
+    or all with ``reader='messytables'``, are read sequentially, as with
+    the ``CSVImporter``. """
+
+    def __init__(self, source, processes=None, chunk_size=CHUNK_SIZE,
+                 reader='auto', archive_dir=None):
+        super(PipelinedCSVImporter, self).__init__(source, reader=reader,
+                                                  archive_dir=archive_dir)
+        self.processes = processes or cpu_count()
+        self.chunk_size = chunk_size
+        self._converted = False
+
+    @property
+    def lines(self):
+        path = self.local_file()
+        reader = self.fast_reader(path) if path is not None else None
+        if reader is not None and \
+                not splittable(reader.sample, reader.dialect):
+            reader.fh.close()
+            reader = None
+        if reader is None:
+            log.info("Not a well-formed, uncompressed local file, "
+                     "importing sequentially.")
+            self._converted = False
+            for line in super(PipelinedCSVImporter, self).lines:
+                yield line
+            return
+
+        fh, dialect = reader.fh, reader.dialect
+        headers = csv.reader(StringIO(reader.sample), **dialect).next()
+        headers = [h.decode('utf-8') for h in headers]
+        # continue from a recorded range boundary:
+        rows, offset = self._start or (0, None)
+        self._start = None
+        fh.seek(offset or 0)
+
+        def results(item):
+            # ``position`` is the start of the range being loaded
+            start, result = item
+            lines = result.get()
+            self.position = (self._rows, start)
+            self._rows += len(lines)
+            return lines
+
+        self._converted = True
+        self._rows = rows
+        mapping = self.dataset.mapping
+        pool = Pool(self.processes)
+        pending = deque()
+        try:
+            for start, end in record_ranges(fh, self.chunk_size,
+                                            dialect['quotechar'], offset):
+                pending.append((start, pool.apply_async(convert_range,
+                    [(path, start, end, dialect, headers, mapping)])))
+                # bound the amount of converted data held in memory:
+                if len(pending) > self.processes * 2:
+                    for line in results(pending.popleft()):
+                        yield line
+            while len(pending):
+                for line in results(pending.popleft()):
+                    yield line
+        finally:
+            fh.close()
+            pool.terminate()
+            pool.join()
+
+    def convert(self, line):
+        if not self._converted:
+            return super(PipelinedCSVImporter, self).convert(line)
+        status, payload = line
+        if status == 'invalid':
+            errors = Invalid(SchemaNode(Mapping(unknown='preserve')))
+            for args in payload:
+                errors.add(InvalidData(*args))
+            raise errors
+        elif status == 'error':
+            raise ValueError(payload)
+        return payload
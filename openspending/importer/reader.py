@@ -0,0 +1,164 @@
+"""
+Plain CSV reading helpers which bypass messytables. They mirror the
+behaviour of ``CSVRowSet`` with the headers and offset processors
+(dialect sniffing, naming of missing or surplus cells) for files which
+are well-formed enough not to need its repair logic. Unlike
+messytables, cells are decoded strictly: a record which is not valid
+UTF-8 is reported instead of losing the bytes which don't decode.
+"""
+import csv
+import hashlib
+import os
+from itertools import chain, izip_longest
+from StringIO import StringIO
+from urlparse import urlparse
+
+SNIFF_SIZE = 64 * 1024
+
+DIALECT_PARAMS = ('delimiter', 'quotechar', 'doublequote',
+                  'escapechar', 'skipinitialspace', 'quoting')
+
+
+def local_path(url):
+    """ Return the file system path of a source URL if it refers to a
+    local file, otherwise ``None``. """
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        path = parsed.path
+    elif parsed.scheme == '':
+        path = url
+    else:
+        return None
+    if os.path.isfile(path):
+        return path
+    return None
+
+
+def checksum(fh, block_size=1024 * 1024):
+    """ Compute the MD5 hex digest of the contents of a file object. """
+    digest = hashlib.md5()
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            break
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def sniff_dialect(sample):
+    """ Guess the CSV dialect of a sample the same way messytables
+    does and return it as a dictionary of format parameters. """
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=['\t', ',', ';'])
+        dialect.doublequote = True
+    except csv.Error:
+        dialect = csv.excel
+    return dict([(p, getattr(dialect, p)) for p in DIALECT_PARAMS])
+
+
+def make_row(headers, values):
+    """ Build a row dictionary like the messytables header processor:
+    missing cells are ``None`` and surplus cells get generated names.
+    Raises ``UnicodeDecodeError`` if a cell is not valid UTF-8. """
+    row = {}
+    for i, (value, header) in enumerate(izip_longest(values, headers)):
+        if value is not None:
+            value = value.decode('utf-8')
+        row[header or "column_%d" % i] = value
+    return row
+
+
+class UndecodableRow(dict):
+    """ Read in place of a record which is not valid UTF-8, so that the
+    importer can log the ``error`` for this row and go on reading. """
+
+    def __init__(self, error):
+        super(UndecodableRow, self).__init__()
+        self.error = error
+
+
+def decode_row(headers, values):
+    """ Like ``make_row``, but return an ``UndecodableRow`` for a record
+    which is not valid UTF-8. """
+    try:
+        return make_row(headers, values)
+    except UnicodeDecodeError as error:
+        return UndecodableRow(error)
+
+
+def is_well_formed(sample, dialect):
+    """ Check whether a sample of complete lines can be read without
+    messytables: it must be valid UTF-8 with plain line endings, have
+    a header of unique, non-empty column names and the same number of
+    cells in every record. """
+    if not len(sample) or '\0' in sample:
+        return False
+    if '\r' in sample.replace('\r\n', ''):
+        return False
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    try:
+        records = list(csv.reader(StringIO(sample), **dialect))
+    except csv.Error:
+        return False
+    headers = records[0]
+    if not all(headers) or len(set(headers)) != len(headers):
+        return False
+    # the last record may have been cut off inside a quoted value
+    for record in records[1:-1]:
+        if len(record) != len(headers):
+            return False
+    return True
+
+
+class FastCSVReader(object):
+    """ Read rows from a CSV file object as plain dictionaries using
+    the ``csv`` module directly. The first ``SNIFF_SIZE`` bytes (up to
+    the next line break) are kept as a sample to guess the dialect and
+    decide if the file is ``well_formed``. """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.sample = fh.read(SNIFF_SIZE)
+        if len(self.sample) == SNIFF_SIZE:
+            self.sample += fh.readline()
+        self.dialect = sniff_dialect(self.sample)
+
+    @property
+    def well_formed(self):
+        return is_well_formed(self.sample, self.dialect)
+
+    def __iter__(self):
+        lines = chain(StringIO(self.sample), self.fh)
+        reader = csv.reader(lines, **self.dialect)
+        headers = [h.decode('utf-8') for h in reader.next()]
+        for values in reader:
+            yield decode_row(headers, values)
+
+    def records(self, offset=None):
+        """ Iterate over ``(offset, row)`` pairs, where ``offset`` is the
+        position in the file just after the record. If an ``offset`` is
+        given, reading continues at that position of the file, which
+        must be seekable and at the start of the sample. """
+        headers = csv.reader(StringIO(self.sample), **self.dialect).next()
+        headers = [h.decode('utf-8') for h in headers]
+        if offset is None:
+            lines = chain(StringIO(self.sample), self.fh)
+            position = [0]
+        else:
+            self.fh.seek(offset)
+            lines = self.fh
+            position = [offset]
+
+        def counted():
+            for line in lines:
+                position[0] += len(line)
+                yield line
+
+        reader = csv.reader(counted(), **self.dialect)
+        if offset is None:
+            reader.next()
+        for values in reader:
+            yield position[0], decode_row(headers, values)
@@ -17,7 +17,8 @@ class Browser(object):
                  stats=False,
                  facet_field=None,
                  facet_page=1,
-                 facet_pagesize=100):
+                 facet_pagesize=100,
+                 datasets=None):
 
         self.params = {
             'q': q,
@@ -30,6 +31,9 @@ class Browser(object):
             'facet_page': facet_page,
             'facet_pagesize': facet_pagesize
         }
+        # the datasets which were already loaded for the request, so
+        # that the filter for their published versions needs no queries
+        self.datasets = dict((d.name, d) for d in datasets or [])
 
     def execute(self):
         """
@@ -64,13 +68,14 @@ class Browser(object):
         return self.entries
 
     def query(self):
-        data = solr.get_connection().raw_query(**_build_query(self.params))
+        query = _build_query(self.params, self.datasets)
+        data = solr.get_connection().raw_query(**query)
         return json.loads(data)
 
-def _build_query(params):
+def _build_query(params, datasets=None):
     query = {
         'q':     params['q'] or '*:*',
-        'fq':    _build_fq(params['filter']),
+        'fq':    _build_fq(params['filter'], datasets),
         'wt':    'json',
         'fl':    'id, dataset',
         'sort':  _build_sort(params['order']),
@@ -97,13 +102,22 @@ def _build_query(params):
         })
     return query
 
-def _build_fq(filters):
+def _build_fq(filters, datasets=None):
     """
-    Make a Solr 'fq' object from a filters dict.
+    Make a Solr 'fq' object from a filters dict. Dataset filters match
+    the published version of the dataset, taken from ``datasets`` (a
+    dict of datasets by name) or else looked up once per name.
 
     Returns a list, suitable for passing as the 'fq' keyword argument to ``raw_query()``
     """
+    datasets = dict(datasets or {})
     def fq_for(key, value):
+        if key == 'dataset':
+            if value not in datasets:
+                datasets[value] = model.Dataset.by_name(value)
+            dataset = datasets[value]
+            if dataset is not None:
+                return solr.dataset_filter(dataset)
         return "+%s:\"%s\"" % (key, value.replace('"', '\\"'))
     fq = []
     for key, value in filters.iteritems():
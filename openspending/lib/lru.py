@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ A dictionary-like cache which keeps its contents within a size
+    budget by evicting the least recently used items first. The size
+    of an item is computed by ``sizeof(key, value)``; by default every
+    item counts as one, so ``max_size`` is simply a number of items.
+
+    Hits, misses and evictions are counted so that callers can report
+    on the effectiveness of the cache. """
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda key, value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            item = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # re-insert to mark the key as the most recently used.
+        self._data[key] = item
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, value):
+        self.invalidate(key)
+        size = self.sizeof(key, value)
+        if size > self.max_size:
+            return
+        self._data[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def invalidate(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'items': len(self._data),
+                'size': self.size}
+
+    def keys(self):
+        return self._data.keys()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
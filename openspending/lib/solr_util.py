@@ -72,6 +72,29 @@ def drop_index(dataset_name):
     solr.commit()
 
 
+def drop_version_index(dataset_name, version):
+    """ Delete the documents of one table version of a dataset. """
+    solr = get_connection()
+    solr.delete_query('+dataset:"%s" %s' % (dataset_name,
+                                           _version_clause(version)))
+    solr.commit()
+
+
+def _version_clause(version):
+    if version is None:
+        # documents indexed before the dataset was first reloaded
+        # through a shadow load have no version
+        return '-dataset.version:[* TO *]'
+    return '+dataset.version:"%d"' % version
+
+
+def dataset_filter(dataset):
+    """ A filter query for the documents of the published version of
+    ``dataset``, which hides those of a shadow load in progress. """
+    return '(+dataset:"%s" %s)' % (dataset.name,
+                                   _version_clause(dataset.table_version))
+
+
 def dataset_entries(dataset_name):
     solr = get_connection()
     f = 'dataset:"%s"' % dataset_name if dataset_name else ''
@@ -84,7 +107,12 @@ def extend_entry(entry, dataset):
     entry['dataset'] = dataset.name
     entry['dataset.id'] = dataset.id
     entry = flatten(entry)
-    entry['_id'] = dataset.name + '::' + unicode(entry['id'])
+    version = dataset.active_version
+    if version is None:
+        entry['_id'] = dataset.name + '::' + unicode(entry['id'])
+    else:
+        entry['dataset.version'] = version
+        entry['_id'] = '%s::v%d::%s' % (dataset.name, version, entry['id'])
     for k, v in entry.items():
         if k.endswith(".taxonomy") or k.endswith('.color'):
             continue
@@ -105,10 +133,15 @@ def extend_entry(entry, dataset):
 
 
 def build_index(dataset_name):
-    solr = get_connection()
     dataset_ = model.Dataset.by_name(dataset_name)
     if dataset_ is None:
         raise ValueError("No such dataset: %s" % dataset_name)
+    index_entries(dataset_)
+
+
+def index_entries(dataset_):
+    """ Index all entries in the active tables of a dataset. """
+    solr = get_connection()
     buf = []
     for i, entry in enumerate(dataset_.entries()):
         ourdata = extend_entry(entry, dataset_)
@@ -23,7 +23,7 @@ class StreamingResponse(object):
         current = dict(self.params)
         current['pagesize'] = self.pagesize
         current['page'] = page
-        self.browser = Browser(**current)
+        self.browser = Browser(datasets=self.datasets, **current)
         return self.browser
 
     def make_entries(self, entries):
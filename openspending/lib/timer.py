@@ -0,0 +1,70 @@
+import time
+
+
+class StageTimer(object):
+    """ Attribute the wall clock time of a long-running operation to
+    named stages. Instead of timing each stage separately, ``lap(stage)``
+    charges the time since the previous lap to ``stage``, so that the
+    stages of a row cost only one clock reading each.
+
+    ``progress(rows)`` records the throughput over time. The series is
+    kept short by dropping every other point once it reaches
+    ``max_points`` and recording points half as often from then on. """
+
+    def __init__(self, max_points=100):
+        self.max_points = max_points
+        self.seconds = {}
+        self.begin = self._last = time.time()
+        self.series = []
+        self._interval = 1
+        self._calls = 0
+        self._last_point = (0, self.begin)
+
+    def lap(self, stage):
+        now = time.time()
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + \
+                (now - self._last)
+        self._last = now
+
+    def skip(self):
+        """ Do not charge the time since the last lap to any stage. """
+        self._last = time.time()
+
+    def progress(self, rows):
+        self._calls += 1
+        if self._calls % self._interval:
+            return
+        now = time.time()
+        last_rows, last_time = self._last_point
+        elapsed = now - last_time
+        self.series.append({
+            'rows': rows,
+            'seconds': round(now - self.begin, 3),
+            'rows_per_sec': round((rows - last_rows) / elapsed, 1) \
+                    if elapsed else None
+            })
+        self._last_point = (rows, now)
+        if len(self.series) >= self.max_points:
+            self.series = self.series[1::2]
+            self._interval *= 2
+
+    @property
+    def total(self):
+        return time.time() - self.begin
+
+    def as_dict(self):
+        return {'seconds': round(self.total, 3),
+                'stages': dict([(s, round(t, 3)) for s, t in
+                                self.seconds.items()]),
+                'throughput': self.series}
+
+    def format(self, stages=None):
+        stages = stages or sorted(self.seconds)
+        total = self.total
+        lines = ["%-10s %10s %7s" % ('stage', 'seconds', 'share')]
+        for stage in stages:
+            seconds = self.seconds.get(stage, 0.0)
+            lines.append("%-10s %10.2f %6.1f%%" % (stage, seconds,
+                100 * seconds / total if total else 0))
+        lines.append("%-10s %10.2f" % ('total', total))
+        return '\n'.join(lines)
@@ -19,6 +19,42 @@ def hash_values(iterable):
     return sha1(''.join(sha1(unicode(val).encode('utf-8')).hexdigest() \
             for val in iterable)).hexdigest()
 
+def key_builder(namespace, scheme='legacy'):
+    """Return a function which hashes a list of key values within
+    ``namespace`` to a 40 character hex digest. The ``legacy`` scheme
+    gives the same result as ``hash_values([namespace] + values)``; the
+    ``fast`` scheme feeds type-tagged, length-prefixed UTF-8 values into
+    a single SHA1 instead of hashing each value separately."""
+    if scheme == 'legacy':
+        prefix = sha1(unicode(namespace).encode('utf-8')).hexdigest()
+
+        def build(values):
+            digest = sha1(prefix)
+            for val in values:
+                digest.update(sha1(unicode(val).encode('utf-8')).hexdigest())
+            return digest.hexdigest()
+        return build
+
+    if scheme != 'fast':
+        raise ValueError("Unknown key scheme: %s" % scheme)
+    base = sha1()
+
+    def feed(digest, val):
+        if val is None:
+            digest.update('n;')
+        else:
+            val = unicode(val).encode('utf-8')
+            digest.update('s%d:' % len(val))
+            digest.update(val)
+    feed(base, namespace)
+
+    def build(values):
+        digest = base.copy()
+        for val in values:
+            feed(digest, val)
+        return digest.hexdigest()
+    return build
+
 def check_rest_suffix(name):
     '''\
     Assert that the ``name`` does not end with a string like
@@ -1,12 +1,23 @@
 #coding: utf-8
 from json import dumps, loads
 from sqlalchemy.types import Text, MutableType, TypeDecorator
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext.compiler import compiles
 
 from openspending.model import meta as db
 
 ALIAS_PLACEHOLDER = u'‽'
 
 
+def supports_window_functions(bind):
+    """ Test whether the database can evaluate aggregates over a window
+    (``sum(...) OVER ()``), which SQLite only can since 3.25. """
+    if bind.dialect.name == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    return bind.dialect.name in ('postgresql', 'oracle', 'mssql')
+
+
 def decode_row(row, dataset):
     from openspending.model.dimension import CompoundDimension
 
@@ -49,6 +60,65 @@ class JSONType(MutableType, TypeDecorator):
         return loads(dumps(value))
 
 
+class InsertFromSelect(Executable, ClauseElement):
+    """ An ``INSERT INTO table (columns) SELECT ...`` statement, which
+    SQLAlchemy does not provide as a construct of its own. """
+
+    _execution_options = \
+        Executable._execution_options.union({'autocommit': True})
+
+    def __init__(self, table, columns, select):
+        self.table = table
+        self.columns = columns
+        self.select = select
+
+
+@compiles(InsertFromSelect)
+def visit_insert_from_select(element, compiler, **kw):
+    return "INSERT INTO %s (%s) %s" % (
+        compiler.process(element.table, asfrom=True),
+        ', '.join([compiler.preparer.format_column(c) for c in \
+                element.columns]),
+        compiler.process(element.select))
+
+
+class StagingTable(object):
+    """ A scratch table next to a generated table, used to collect rows
+    during a staged load. Rows are buffered and written in batches; the
+    owner then merges them into the target table with a few set-based
+    statements and drops the staging table again. """
+
+    def __init__(self, target, columns, batch_size=1000):
+        self.table = db.Table(target.name + '__staging', db.MetaData(),
+                              *columns)
+        self.batch_size = batch_size
+        self.buffer = []
+        self.created = False
+
+    def append(self, bind, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.write(bind)
+
+    def write(self, bind):
+        """ Write all buffered rows to the staging table, creating it
+        if necessary. """
+        if not len(self.buffer):
+            return
+        if not self.created:
+            # left over from an aborted load?
+            self.table.drop(bind, checkfirst=True)
+            self.table.create(bind)
+            self.created = True
+        bind.execute(self.table.insert(), self.buffer)
+        self.buffer = []
+
+    def drop(self, bind):
+        if self.created:
+            self.table.drop(bind)
+            self.created = False
+
+
 class TableHandler(object):
     """ Used by automatically generated objects such as datasets
     and dimensions to generate, write and clear the table under
@@ -75,17 +145,44 @@ class TableHandler(object):
         query for the set of unique columns and either update an
         existing row or create a new one. In both cases, the ID
         of the changed row will be returned. """
+        return self._upsert_row(bind, data, unique_columns)[0]
+
+    def _upsert_row(self, bind, data, unique_columns):
+        """ Like ``_upsert``, but return a tuple of the ID and a flag
+        which is set if a new row was created. """
         key = db.and_(*[self.table.c[c] == data.get(c) for \
                 c in unique_columns])
         q = self.table.update(key, data)
         if bind.execute(q).rowcount == 0:
             q = self.table.insert(data)
             rs = bind.execute(q)
-            return rs.inserted_primary_key[0]
+            return rs.inserted_primary_key[0], True
         else:
             q = self.table.select(key)
             row = bind.execute(q).fetchone()
-            return row['id']
+            return row['id'], False
+
+    def _upsert_many(self, bind, rows, key_column='id'):
+        """ Upsert a batch of rows which all share the same set of
+        columns. Rows are deduplicated on ``key_column`` (later rows
+        win), existing rows with the same keys are deleted and the
+        batch is written with a single INSERT statement. This leaves
+        the table in the same state as calling ``_upsert`` for each
+        row in turn. Returns the number of rows added to the table. """
+        unique = {}
+        for row in rows:
+            unique[row[key_column]] = row
+        if not len(unique):
+            return 0
+        keys = unique.keys()
+        column = self.table.c[key_column]
+        deleted = 0
+        # keep the IN clause below SQLite's bind parameter limit:
+        for i in xrange(0, len(keys), 500):
+            q = self.table.delete(column.in_(keys[i:i + 500]))
+            deleted += bind.execute(q).rowcount
+        bind.execute(self.table.insert(), unique.values())
+        return len(unique) - deleted
 
     def _flush(self, bind):
         """ Delete all rows in the table. """
@@ -99,6 +196,40 @@ class TableHandler(object):
         del self.table
 
 
+class HashTable(TableHandler):
+    """ A side table of a dataset which keeps a content hash for each
+    entry id, so that an incremental load can tell which entries have
+    changed since they were last loaded. It is only created when first
+    used. """
+
+    def __init__(self, meta, namespace):
+        self._init_table(meta, namespace, 'entry_hash',
+                         id_type=db.Unicode(42))
+        self.table.append_column(db.Column('hash', db.Unicode(42)))
+
+    @property
+    def exists(self):
+        return db.engine.has_table(self.table.name)
+
+    def load(self, bind):
+        """ Create the table if needed and return all stored hashes as
+        a dictionary of entry id to hash. """
+        self._generate_table()
+        q = db.select([self.table.c.id, self.table.c.hash])
+        return dict(bind.execute(q).fetchall())
+
+    def write(self, bind, rows):
+        self._upsert_many(bind, rows, 'id')
+
+    def flush(self, bind):
+        if self.exists:
+            self._flush(bind)
+
+    def drop(self, bind):
+        if self.exists:
+            self.table.drop(bind)
+
+
 class DatasetFacetMixin(object):
 
     @classmethod
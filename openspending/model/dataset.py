@@ -9,21 +9,34 @@ of logic functions upon which all other queries and loading functions rely.
 import math
 import logging
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 from itertools import count
 from sqlalchemy import ForeignKeyConstraint
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.schema import AddConstraint, DropConstraint
 
 from openspending.model import meta as db
-from openspending.lib.util import hash_values
+from openspending.lib.util import hash_values, key_builder, flatten
 
 from openspending.model.common import TableHandler, JSONType, \
-        ALIAS_PLACEHOLDER, decode_row
+        StagingTable, HashTable, InsertFromSelect, ALIAS_PLACEHOLDER, \
+        decode_row, supports_window_functions
 from openspending.model.dimension import CompoundDimension, \
         AttributeDimension, DateDimension
 from openspending.model.dimension import Measure
+from openspending.model.rollup import Rollup, LABELS, normalize, \
+        table_name as rollup_table
 
 log = logging.getLogger(__name__)
 
+# labels of the window aggregates added to the drilldown query; they have
+# no underscore so that they are not taken for dimension attributes.
+WINDOW_TOTAL = 'windowtotal'
+WINDOW_ENTRIES = 'windowentries'
+WINDOW_COUNT = 'windowcount'
+
 
 class Dataset(TableHandler, db.Model):
     """ The dataset is the core entity of any access to data. All
@@ -49,6 +62,11 @@ class Dataset(TableHandler, db.Model):
     serp_title = db.Column(db.Unicode(), nullable=True)
     serp_teaser = db.Column(db.Unicode(), nullable=True)
     private = db.Column(db.Boolean, default=False)
+    key_scheme = db.Column(db.Unicode())
+    entry_count = db.Column(db.Integer)
+    last_load = db.Column(JSONType)
+    table_version = db.Column(db.Integer)
+    rollups = db.Column(JSONType)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow,
                            onupdate=datetime.utcnow)
@@ -73,6 +91,7 @@ class Dataset(TableHandler, db.Model):
         self.languages = dataset.get('languages', [])
         self.territories = dataset.get('territories', [])
         self.ckan_uri = dataset.get('ckan_uri')
+        self.key_scheme = dataset.get('key_scheme', 'legacy')
         self._load_model()
 
     @property
@@ -107,8 +126,21 @@ class Dataset(TableHandler, db.Model):
             else:
                 dimension = CompoundDimension(self, dim, data)
             self.dimensions.append(dimension)
+        self._fields = self.dimensions + self.measures
+        self._key_fields = [f.name for f in self._fields if f.key]
+        self._key_builder = key_builder(self.name,
+                                        self.key_scheme or 'legacy')
+        if not hasattr(self, '_shadow_version'):
+            self._shadow_version = None
         self.init()
         self._is_generated = None
+        self._load_buffer = None
+        self._staging = None
+        self._hashes = None
+        self.load_stats = None
+        # a ``StageTimer`` which ``load`` charges with the time spent on
+        # dimension keys and on writing entries:
+        self.timer = None
 
     def __getitem__(self, name):
         """ Access a field (dimension or measure) by name. """
@@ -127,7 +159,7 @@ class Dataset(TableHandler, db.Model):
     @property
     def fields(self):
         """ Both the dimensions and metrics in this dataset. """
-        return self.dimensions + self.measures
+        return self._fields
 
     @property
     def compounds(self):
@@ -149,11 +181,33 @@ class Dataset(TableHandler, db.Model):
         #self.tx = self.bind.begin()
         self.meta.bind = db.engine
 
-        self._init_table(self.meta, self.name, 'entry',
+        self._init_table(self.meta, self.table_namespace, 'entry',
                          id_type=db.Unicode(42))
         for field in self.fields:
             field.column = field.init(self.meta, self.table)
         self.alias = self.table.alias('entry')
+        self.hash_table = HashTable(self.meta, self.table_namespace)
+
+    def _namespace(self, version):
+        if version is None:
+            return self.name
+        return '%s__v%d' % (self.name, version)
+
+    @property
+    def active_version(self):
+        """ The version of the tables this object reads and writes: the
+        shadow version during a shadow load, otherwise the published
+        ``table_version``. """
+        if self._shadow_version is not None:
+            return self._shadow_version
+        return self.table_version
+
+    @property
+    def table_namespace(self):
+        """ The prefix of all tables of the active version. Datasets
+        which were never reloaded through a shadow load keep the
+        unversioned prefix, i.e. their name. """
+        return self._namespace(self.active_version)
 
     def generate(self):
         """ Create the tables and columns necessary for this dataset
@@ -161,16 +215,65 @@ class Dataset(TableHandler, db.Model):
         """
         for field in self.fields:
             field.generate(self.meta, self.table)
-        for dim in self.dimensions:
-            if isinstance(dim, CompoundDimension):
-                self.table.append_constraint(ForeignKeyConstraint(
-                    [dim.name + '_id'], [dim.table.name + '.id'],
-                    #use_alter=True,
-                    name='fk_' + self.name + '_' + dim.name
-                ))
+        self._foreign_keys()
         self._generate_table()
         self._is_generated = True
 
+    def _foreign_keys(self):
+        """ Get the foreign key constraints from the fact table to the
+        compound dimension tables, adding them to the table model if
+        necessary. """
+        constraints = dict([(c.name, c) for c in self.table.constraints \
+                if isinstance(c, ForeignKeyConstraint)])
+        for dim in self.compounds:
+            name = 'fk_' + self.table_namespace + '_' + dim.name
+            if name not in constraints:
+                constraints[name] = ForeignKeyConstraint(
+                    [dim.name + '_id'], [dim.table.name + '.id'],
+                    #use_alter=True,
+                    name=name
+                )
+                self.table.append_constraint(constraints[name])
+        return constraints.values()
+
+    def begin_bulk_load(self):
+        """ Prepare an empty fact table for a bulk load by dropping its
+        indexes and, where the database can alter them, its foreign key
+        constraints, so that rows are written without maintaining them.
+        ``end_bulk_load`` restores both once all rows are in. Returns
+        ``False`` and does nothing if the table already has entries. """
+        if self.bind.execute(db.select([self.table.c.id],
+                                       limit=1)).fetchone() is not None:
+            return False
+        inspector = Inspector.from_engine(self.bind)
+        indexes = [i['name'] for i in inspector.get_indexes(self.table.name)]
+        for index in self.table.indexes:
+            if index.name in indexes:
+                index.drop(self.bind)
+        if self.bind.dialect.name != 'sqlite':
+            fks = [f['name'] for f in \
+                    inspector.get_foreign_keys(self.table.name)]
+            for constraint in self._foreign_keys():
+                if constraint.name in fks:
+                    self.bind.execute(DropConstraint(constraint))
+        return True
+
+    def end_bulk_load(self):
+        """ Create the indexes and foreign key constraints of the fact
+        table which are missing after a bulk load. The constraints are
+        validated against all rows at once. """
+        inspector = Inspector.from_engine(self.bind)
+        indexes = [i['name'] for i in inspector.get_indexes(self.table.name)]
+        for index in self.table.indexes:
+            if index.name not in indexes:
+                index.create(self.bind)
+        if self.bind.dialect.name != 'sqlite':
+            fks = [f['name'] for f in \
+                    inspector.get_foreign_keys(self.table.name)]
+            for constraint in self._foreign_keys():
+                if constraint.name not in fks:
+                    self.bind.execute(AddConstraint(constraint))
+
     @property
     def is_generated(self):
         if self._is_generated is None:
@@ -185,8 +288,170 @@ class Dataset(TableHandler, db.Model):
         # Cast the badge count as a boolean and return it
         return bool(self.badges.count())
 
+    def begin_batch(self, batch_size=1000):
+        """ Switch the dataset into buffered loading mode. Entries passed
+        to ``load`` are collected and written to the fact table in batches
+        of ``batch_size`` rows, with one DELETE and one INSERT statement
+        per batch instead of a round trip per row. Call ``commit`` to
+        write any entries still pending. """
+        self._batch_size = batch_size
+        self._load_buffer = []
+
+    def begin_staging(self, batch_size=1000):
+        """ Switch the dataset into staged loading mode. Entries and
+        dimension members are streamed into staging tables and only
+        merged into the fact and dimension tables on ``commit``, using a
+        handful of set-based statements instead of one upsert per row.
+        """
+        columns = [db.Column('seq', db.Integer, primary_key=True),
+                   db.Column('id', db.Unicode(42))]
+        for field in self.fields:
+            if isinstance(field, CompoundDimension):
+                # holds the member name rather than its key
+                columns.append(db.Column(field.column.name, db.UnicodeText))
+                field.begin_staging(batch_size)
+            else:
+                columns.append(db.Column(field.column.name,
+                                         field.column.type))
+        self._staging = StagingTable(self.table, columns, batch_size)
+
+    def begin_shadow(self, resume=False):
+        """ Switch this object to a new version of the dataset tables,
+        so that a load can replace all data while readers keep using
+        the published version. The new tables are created empty (unless
+        ``resume`` is set and they are left over from an interrupted
+        load). ``end_shadow`` publishes them, ``discard_shadow`` drops
+        them again. """
+        version = (self.table_version or 0) + 1
+        self.drop_previous_version()
+        if not resume:
+            self._drop_version(version)
+        self._shadow_version = version
+        self._load_model()
+        self.generate()
+        self.recount()
+
+    def end_shadow(self):
+        """ Publish the shadow tables by switching ``table_version`` in a
+        single commit. The tables of the previous version are kept for
+        requests which are still reading them, until the next shadow
+        load (see ``drop_previous_version``). Returns the previous
+        version. """
+        previous = self.table_version
+        self.table_version = self._shadow_version
+        self.entry_count = self._shadow_count
+        self.updated_at = datetime.utcnow()
+        self._shadow_version = None
+        db.session.commit()
+        log.info("Published version %s of %s", self.table_version,
+                 self.name)
+        return previous
+
+    def discard_shadow(self, drop=True):
+        """ Return to the published version. The shadow tables are
+        dropped, unless ``drop`` is false, e.g. to resume the load. """
+        if self._shadow_version is None:
+            return
+        version, self._shadow_version = self._shadow_version, None
+        if drop:
+            self._drop_version(version)
+        self._load_model()
+
+    def drop_previous_version(self):
+        """ Drop the tables of the version which was published before
+        ``table_version``, if they are left. """
+        if self.table_version is None:
+            return
+        if self.table_version > 1:
+            self._drop_version(self.table_version - 1)
+        else:
+            self._drop_version(None)
+
+    def _drop_version(self, version):
+        """ Drop all tables of a version of the dataset, as far as they
+        exist, without touching the in-memory table model. """
+        namespace = self._namespace(version)
+        names = [namespace + '__entry']
+        names += [namespace + '__' + d.name for d in self.compounds]
+        names.append(namespace + '__entry_hash')
+        names += [namespace + '__' + rollup_table(r['drilldowns']) \
+                for r in self.rollups or []]
+        meta = db.MetaData()
+        for name in names + [n + '__staging' for n in names]:
+            db.Table(name, meta).drop(self.bind, checkfirst=True)
+
+    def begin_incremental(self):
+        """ Switch the dataset into incremental loading mode. The
+        content hash of every entry passed to ``load`` is compared with
+        the hash stored when it was last loaded, and unchanged entries
+        are skipped before any dimension or fact table is touched. The
+        outcome is counted in ``load_stats``. This can be combined with
+        batched or staged loading. """
+        self._hashes = self.hash_table.load(self.bind)
+        self._hash_buffer = []
+        self.load_stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        # entries which were loaded without a hash, e.g. by a normal
+        # import, are updates rather than insertions:
+        self._unhashed_ids = set()
+        if self.is_generated and len(self._hashes) < len(self):
+            q = db.select([self.table.c.id])
+            self._unhashed_ids = set([r[0] for r in self.bind.execute(q)
+                                      if r[0] not in self._hashes])
+
+    def discard_hashes(self):
+        """ Forget all stored entry hashes. This must be done whenever
+        entries are loaded without ``begin_incremental``, since the
+        hashes would no longer describe the stored entries. """
+        self.hash_table.flush(self.bind)
+
+    def _content_hash(self, data):
+        return hash_values(sorted(flatten(data).items()))
+
+    def _merge_staging(self):
+        """ Merge the staged dimension members and entries into the
+        dataset tables. Dimension keys are resolved by joining on the
+        member names and, as with ``_upsert``, the last staged version
+        of an entry wins. """
+        for dimension in self.compounds:
+            dimension.merge_staging(self.bind)
+        self._staging.write(self.bind)
+        if not self._staging.created:
+            return
+        staging = self._staging.table
+        joins = staging
+        columns, values = [self.table.c.id], [staging.c.id]
+        for field in self.fields:
+            columns.append(self.table.c[field.column.name])
+            if isinstance(field, CompoundDimension):
+                joins = joins.join(field.table, field.table.c.name == \
+                        staging.c[field.column.name])
+                values.append(field.table.c.id)
+            else:
+                values.append(staging.c[field.column.name])
+        latest = db.select([db.func.max(staging.c.seq)],
+                           group_by=[staging.c.id])
+        q = self.table.delete(self.table.c.id.in_(
+            db.select([staging.c.id])))
+        with self._writing() as conn:
+            deleted = conn.execute(q).rowcount
+            q = db.select(values, staging.c.seq.in_(latest), joins)
+            rp = conn.execute(InsertFromSelect(self.table, columns, q))
+            self._count_entries(conn, rp.rowcount - deleted)
+        self._staging.drop(self.bind)
+
     def commit(self):
-        pass
+        """ Write all entries which are pending in the load buffer or
+        the staging tables. """
+        if self._staging is not None:
+            self._merge_staging()
+        elif self._load_buffer:
+            with self._writing() as conn:
+                added = self._upsert_many(conn, self._load_buffer, 'id')
+                self._count_entries(conn, added)
+            self._load_buffer = []
+        if self._hashes is not None and len(self._hash_buffer):
+            self.hash_table.write(self.bind, self._hash_buffer)
+            self._hash_buffer = []
         #self.tx.commit()
         #self.tx = self.bind.begin()
 
@@ -195,26 +460,59 @@ class Dataset(TableHandler, db.Model):
         than SQL auto-increment because it is stable across mutltiple
         loads and thus creates stable URIs for entries.
         """
-        uniques = [self.name]
-        for field in self.fields:
-            if not field.key:
-                continue
-            obj = data.get(field.name)
+        values = []
+        for name in self._key_fields:
+            obj = data.get(name)
             if isinstance(obj, dict):
                 obj = obj.get('name', obj.get('id'))
-            uniques.append(obj)
-        return hash_values(uniques)
+            values.append(obj)
+        return self._key_builder(values)
 
     def load(self, data):
         """ Handle a single entry of data in the mapping source format,
         i.e. with all needed columns. This will propagate to all dimensions
         and set values as appropriate. """
+        timer = self.timer
+        key = self._make_key(data)
+        if self._hashes is not None:
+            content = self._content_hash(data)
+            known = self._hashes.get(key)
+            if known == content:
+                self.load_stats['unchanged'] += 1
+                if timer is not None:
+                    timer.lap('keys')
+                return
+
         entry = dict()
         for field in self.fields:
             field_data = data[field.name]
             entry.update(field.load(self.bind, field_data))
-        entry['id'] = self._make_key(data)
-        self._upsert(self.bind, entry, ['id'])
+        entry['id'] = key
+        if timer is not None:
+            timer.lap('keys')
+        if self._staging is not None:
+            self._staging.append(self.bind, entry)
+        elif self._load_buffer is None:
+            with self._writing() as conn:
+                _, created = self._upsert_row(conn, entry, ['id'])
+                if created:
+                    self._count_entries(conn, 1)
+        else:
+            self._load_buffer.append(entry)
+
+        if self._hashes is not None:
+            existed = known is not None or key in self._unhashed_ids
+            self.load_stats['updated' if existed else 'inserted'] += 1
+            self._unhashed_ids.discard(key)
+            self._hashes[key] = content
+            self._hash_buffer.append({'id': key, 'hash': content})
+            if self._load_buffer is None and self._staging is None:
+                self.commit()
+        if self._load_buffer is not None and \
+                len(self._load_buffer) >= self._batch_size:
+            self.commit()
+        if timer is not None:
+            timer.lap('write')
 
     def flush(self):
         """ Delete all data from the dataset tables but leave the table
@@ -222,16 +520,97 @@ class Dataset(TableHandler, db.Model):
         """
         for dimension in self.dimensions:
             dimension.flush(self.bind)
-        self._flush(self.bind)
+        with self._writing() as conn:
+            self._flush(conn)
+            self._store_count(conn, 0)
+        self.hash_table.flush(self.bind)
+        self.drop_rollups()
+        if self._hashes is not None:
+            # the stored hashes are gone, and so are the entries
+            self._hashes = {}
+            self._hash_buffer = []
+            self._unhashed_ids = set()
+            self.load_stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
 
     def drop(self):
         """ Drop all tables created as part of this dataset, i.e. by calling
         ``generate()``. This will of course also delete the data itself.
         """
+        self.drop_rollups()
+        self.drop_previous_version()
         self._drop(self.bind)
+        self.hash_table.drop(self.bind)
         for dimension in self.dimensions:
             dimension.drop(self.bind)
         self._is_generated = False
+        with self._writing() as conn:
+            self._store_count(conn, 0)
+
+    def add_rollup(self, drilldowns):
+        """ Materialize the aggregates for a combination of drilldowns
+        (e.g. ``['time.year', 'cofog1']``) as a rollup table. The table
+        is created by ``build_rollups``, which is run after each
+        import. """
+        rollup = Rollup(self, drilldowns)
+        specs = [r for r in self.rollups or [] \
+                if r['drilldowns'] != rollup.drilldowns]
+        specs.append({'drilldowns': rollup.drilldowns})
+        self.rollups = specs
+        return rollup
+
+    def remove_rollup(self, drilldowns):
+        drilldowns = normalize(drilldowns)
+        specs = self.rollups or []
+        for spec in specs:
+            if spec['drilldowns'] == drilldowns:
+                Rollup(self, drilldowns).drop(self.bind)
+        self.rollups = [r for r in specs if r['drilldowns'] != drilldowns]
+
+    def build_rollups(self):
+        """ (Re-)build all rollup tables from the current entries. Each
+        rollup records the state of the data it was built from, so that
+        ``aggregate`` stops using it as soon as the data changes. """
+        if not self.is_generated:
+            return []
+        specs = []
+        for spec in self.rollups or []:
+            rollup = Rollup(self, spec['drilldowns'])
+            rows = rollup.build(self.bind)
+            log.info("Built %r: %s rows", rollup, rows)
+            specs.append({'drilldowns': rollup.drilldowns,
+                          'rows': rows,
+                          'built': self._rollup_state()})
+        self.rollups = specs
+        return specs
+
+    def drop_rollups(self):
+        """ Drop the rollup tables, but keep their definitions. """
+        specs = []
+        for spec in self.rollups or []:
+            Rollup(self, spec['drilldowns']).drop(self.bind)
+            specs.append({'drilldowns': spec['drilldowns']})
+        if self.rollups:
+            self.rollups = specs
+
+    def _rollup_state(self):
+        return {'version': self.active_version,
+                'entries': len(self),
+                'run': (self.last_load or {}).get('run')}
+
+    def find_rollup(self, keys):
+        """ The smallest current rollup which covers all of ``keys``, or
+        ``None``. """
+        state = self._rollup_state()
+        best = None
+        for spec in self.rollups or []:
+            if spec.get('built') != state:
+                continue
+            if best is not None and spec['rows'] >= best[0]:
+                continue
+            rollup = Rollup(self, spec['drilldowns'])
+            if all([rollup.covers(k) for k in keys]):
+                best = (spec['rows'], rollup)
+        return best[1] if best is not None else None
 
     def key(self, key):
         """ For a given ``key``, find a column to indentify it in a query.
@@ -299,7 +678,9 @@ class Dataset(TableHandler, db.Model):
             page=1, pagesize=10000, order=None):
         """ Query the dataset for a subset of cells based on cuts and
         drilldowns. It returns a structure with a list of drilldown items
-        and a summary about the slice cutted by the query.
+        and a summary about the slice cutted by the query. If a current
+        rollup (see ``add_rollup``) covers all drilldowns, cuts and sort
+        keys, the query is answered from the rollup table.
 
         ``measure``
             The numeric unit to be aggregated over, defaults to ``amount``.
@@ -351,22 +732,38 @@ class Dataset(TableHandler, db.Model):
         cuts = cuts or []
         drilldowns = drilldowns or []
         order = order or []
-        joins = alias = self.alias
         dataset = self
+
+        keys = drilldowns + [k for k, v in cuts] + \
+                [k for k, d in order if k != measure]
+        rollup = self.find_rollup(keys) if len(keys) else None
+        if rollup is not None:
+            log.debug("Aggregating from %r", rollup)
+            joins = alias = rollup.alias
+            entries = db.func.sum(alias.c.entries)
+            key_column, join = rollup.key, rollup.join
+            labels = dict([(l, rollup.column(l).label(l)) \
+                    for l in LABELS if rollup.covers(l)])
+        else:
+            joins = alias = self.alias
+            entries = db.func.count(alias.c.id)
+            key_column = dataset.key
+            join = lambda name, joins: dataset[name].join(joins)
+            labels = {
+                'year': dataset['time']['year'].column_alias.label('year'),
+                'month': dataset['time']['yearmonth'].column_alias\
+                        .label('month'),
+                }
         fields = [db.func.sum(alias.c[measure]).label(measure),
-                  db.func.count(alias.c.id).label("entries")]
+                  entries.label("entries")]
         stats_fields = list(fields)
-        labels = {
-            'year': dataset['time']['year'].column_alias.label('year'),
-            'month': dataset['time']['yearmonth'].column_alias.label('month'),
-            }
         dimensions = drilldowns + [k for k, v in cuts]
         dimensions = [d.split('.')[0] for d in dimensions]
         for dimension in set(dimensions):
             if dimension in labels:
                 dimension = 'time'
             if dimension not in [c.table.name for c in joins.columns]:
-                joins = dataset[dimension].join(joins)
+                joins = join(dimension, joins)
 
         group_by = []
         for key in drilldowns:
@@ -375,7 +772,7 @@ class Dataset(TableHandler, db.Model):
                 group_by.append(column)
                 fields.append(column)
             else:
-                column = dataset.key(key)
+                column = key_column(key)
                 if '.' in key or column.table == alias:
                     fields.append(column)
                     group_by.append(column)
@@ -390,7 +787,7 @@ class Dataset(TableHandler, db.Model):
             if key in labels:
                 column = labels[key]
             else:
-                column = dataset.key(key)
+                column = key_column(key)
             filters[column].add(value)
         for attr, values in filters.items():
             conditions.append(db.or_(*[attr == v for v in values]))
@@ -404,37 +801,54 @@ class Dataset(TableHandler, db.Model):
             elif key in labels:
                 column = labels[key]
             else:
-                column = dataset.key(key)
+                column = key_column(key)
             order_by.append(column.desc() if direction else column.asc())
 
-        # query 1: get overall sums.
-        query = db.select(stats_fields, conditions, joins)
-        rp = dataset.bind.execute(query)
-        total, num_entries = rp.fetchone()
-
-        # query 2: get total count of drilldowns
-        if len(group_by):
-            query = db.select(['1'], conditions, joins, group_by=group_by)
-            query = db.select([db.func.count('1')], '1=1', query.alias('q'))
-            rp = dataset.bind.execute(query)
-            num_drilldowns, = rp.fetchone()
-        else:
-            num_drilldowns = 1
-
-        drilldown = []
         offset = int((page - 1) * pagesize)
 
-        # query 3: get the actual data
+        # the page of drilldowns. If the database supports window
+        # functions, the totals and the number of drilldowns are computed
+        # over all groups by the same statement.
+        window = len(group_by) and supports_window_functions(dataset.bind)
+        if window:
+            fields = fields + [
+                db.func.sum(fields[0].element).over().label(WINDOW_TOTAL),
+                db.func.sum(fields[1].element).over().label(WINDOW_ENTRIES),
+                db.func.count('1').over().label(WINDOW_COUNT)]
         query = db.select(fields, conditions, joins, order_by=order_by,
                           group_by=group_by, use_labels=True,
                           limit=pagesize, offset=offset)
-        rp = dataset.bind.execute(query)
-        while True:
-            row = rp.fetchone()
-            if row is None:
-                break
-            result = decode_row(row, dataset)
-            drilldown.append(result)
+        rows = [dict(r.items()) for r in dataset.bind.execute(query)]
+
+        if window and len(rows):
+            total = rows[0][WINDOW_TOTAL]
+            num_entries = int(rows[0][WINDOW_ENTRIES])
+            num_drilldowns = int(rows[0][WINDOW_COUNT])
+            for row in rows:
+                for label in (WINDOW_TOTAL, WINDOW_ENTRIES, WINDOW_COUNT):
+                    del row[label]
+        elif not len(group_by) and len(rows):
+            # a single cell, which is also the total:
+            total, num_entries = rows[0][measure], rows[0]['entries']
+            num_drilldowns = 1
+        else:
+            # get overall sums.
+            query = db.select(stats_fields, conditions, joins)
+            rp = dataset.bind.execute(query)
+            total, num_entries = rp.fetchone()
+
+            # get total count of drilldowns
+            if len(group_by):
+                query = db.select(['1'], conditions, joins,
+                                  group_by=group_by)
+                query = db.select([db.func.count('1')], '1=1',
+                                  query.alias('q'))
+                rp = dataset.bind.execute(query)
+                num_drilldowns, = rp.fetchone()
+            else:
+                num_drilldowns = 1
+
+        drilldown = [decode_row(row, dataset) for row in rows]
 
         return {
                 'drilldown': drilldown,
@@ -453,11 +867,71 @@ class Dataset(TableHandler, db.Model):
         return "<Dataset(%s:%s:%s)>" % (self.name, self.dimensions,
                 self.measures)
 
+    @contextmanager
+    def _writing(self):
+        """ The session's connection, on which entries are written to
+        the fact table together with the change of the entry count. Both
+        are committed with the session, so the dataset row is never
+        updated from a second transaction while the session holds it. """
+        conn = db.session.connection()
+        try:
+            yield conn
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+    def _count_entries(self, bind, added):
+        """ Track the number of entries after ``added`` entries have been
+        written to the fact table through ``bind``. """
+        if self._shadow_version is not None:
+            # not published until ``end_shadow``
+            self._shadow_count += added
+        elif self.entry_count is None:
+            self.recount(bind)
+        elif added:
+            self._store_count(bind, self.entry_count + added,
+                              Dataset.__table__.c.entry_count + added)
+
+    def _store_count(self, bind, count, value=None):
+        """ Set the tracked entry count to ``count``. The dataset row is
+        updated (to ``value``, if that expression is given) with a
+        statement on ``bind``, the session's connection from
+        ``_writing``, so that the count is committed with the fact
+        table. """
+        if self._shadow_version is not None:
+            self._shadow_count = count
+            return
+        if self.id is None:
+            self.entry_count = count
+            return
+        table = Dataset.__table__
+        bind.execute(table.update(table.c.id == self.id,
+            {'entry_count': count if value is None else value}))
+        set_committed_value(self, 'entry_count', count)
+
+    def recount(self, bind=None):
+        """ Count the entries in the fact table and store the result as
+        the tracked ``entry_count``. """
+        if bind is None:
+            with self._writing() as conn:
+                return self.recount(conn)
+        count = 0
+        if self.is_generated:
+            rp = bind.execute(self.alias.count())
+            count = rp.fetchone()[0]
+        self._store_count(bind, count)
+        return count
+
     def __len__(self):
+        """ The number of entries, as tracked by loads and flushes. """
         if not self.is_generated:
             return 0
-        rp = self.bind.execute(self.alias.count())
-        return rp.fetchone()[0]
+        if self._shadow_version is not None:
+            return self._shadow_count
+        if self.entry_count is None:
+            return self.recount()
+        return self.entry_count
 
     def as_dict(self):
         return {
@@ -468,6 +942,7 @@ class Dataset(TableHandler, db.Model):
             'schema_version': self.schema_version,
             'currency': self.currency,
             'category': self.category,
+            'key_scheme': self.key_scheme,
             'serp_title': self.serp_title,
             'serp_teaser': self.serp_teaser,
             'languages': list(self.languages),
@@ -1,7 +1,21 @@
 
+import sys
+from datetime import date, timedelta
+
+from openspending.lib.lru import LRUCache
 from openspending.model import meta as db
 from openspending.model.attribute import Attribute
-from openspending.model.common import TableHandler, ALIAS_PLACEHOLDER
+from openspending.model.common import TableHandler, StagingTable, \
+        InsertFromSelect, ALIAS_PLACEHOLDER
+
+# Default memory budget (in bytes) for the primary key cache of each
+# compound dimension.
+KEY_CACHE_SIZE = 64 * 1024 * 1024
+
+
+def _key_size(name, pk):
+    # approximate footprint of the name, the id and the cache entry.
+    return sys.getsizeof(name) + 100
 
 
 class Dimension(object):
@@ -118,8 +132,8 @@ class CompoundDimension(Dimension, TableHandler):
         for name, attr in data.get('attributes', {}).items():
             self.attributes.append(Attribute(self, name, attr))
 
-        # TODO: possibly use a LRU later on?
-        self._pk_cache = {}
+        self._pk_cache = LRUCache(KEY_CACHE_SIZE, _key_size)
+        self._staging = None
 
     def join(self, from_clause):
         """ This will return a query fragment that can be used to establish
@@ -131,10 +145,12 @@ class CompoundDimension(Dimension, TableHandler):
         """ Clear all data in the dimension table but keep the table structure
         intact. """
         self._flush(bind)
+        self._pk_cache.clear()
 
     def drop(self, bind):
         """ Drop the dimension table and all data within it. """
         self._drop(bind)
+        self._pk_cache.clear()
         del self.column
 
     @property
@@ -156,7 +172,7 @@ class CompoundDimension(Dimension, TableHandler):
         column = db.Column(self.name + '_id', db.Integer, index=True)
         fact_table.append_column(column)
         if make_table is True:
-            self._init_table(meta, self.dataset.name, self.name)
+            self._init_table(meta, self.dataset.table_namespace, self.name)
             for attr in self.attributes:
                 attr.column = attr.init(meta, self.table)
             alias_name = self.name.replace('_', ALIAS_PLACEHOLDER)
@@ -180,13 +196,67 @@ class CompoundDimension(Dimension, TableHandler):
             attr_data = row[attr.name]
             dim.update(attr.load(bind, attr_data))
         name = dim['name']
-        if name in self._pk_cache:
-            pk = self._pk_cache[name]
-        else:
+        if self._staging is not None:
+            # the fact table refers to the member by name until the
+            # staged rows are merged.
+            if name not in self._staged:
+                self._staged.add(name)
+                self._staging.append(bind, dim)
+            return {self.column.name: name}
+        pk = self._pk_cache.get(name)
+        if pk is None:
             pk = self._upsert(bind, dim, ['name'])
-            self._pk_cache[name] = pk
+            self._pk_cache.put(name, pk)
         return {self.column.name: pk}
 
+    def warm_cache(self, bind, max_size=None):
+        """ Reset the primary key cache and fill it with the existing
+        members of the dimension, using a single query. ``max_size`` is
+        the memory budget of the new cache in bytes. """
+        if max_size is None:
+            max_size = self._pk_cache.max_size
+        self._pk_cache = LRUCache(max_size, _key_size)
+        q = db.select([self.table.c.name, self.table.c.id])
+        for name, pk in bind.execute(q):
+            self._pk_cache.put(name, pk)
+
+    def cache_stats(self):
+        """ Hit, miss and eviction counts of the primary key cache. """
+        return self._pk_cache.stats()
+
+    def begin_staging(self, batch_size=1000):
+        """ Collect new members in a staging table instead of upserting
+        them one by one. Only the first occurrence of each member is
+        staged, as with the primary key cache. """
+        columns = [db.Column(a.column.name, a.column.type) \
+                for a in self.attributes]
+        self._staging = StagingTable(self.table, columns, batch_size)
+        self._staged = set()
+
+    def merge_staging(self, bind):
+        """ Update existing members and insert new ones from the staging
+        table, using one UPDATE and one INSERT statement. """
+        self._staging.write(bind)
+        if not self._staging.created:
+            return
+        staging = self._staging.table
+        names = db.select([staging.c.name])
+        values = {}
+        for attr in self.attributes:
+            if attr.name == 'name':
+                continue
+            values[attr.column.name] = db.select([staging.c[attr.name]],
+                staging.c.name == self.table.c.name).as_scalar()
+        if len(values):
+            q = self.table.update(self.table.c.name.in_(names), values)
+            bind.execute(q)
+        columns = [a.column.name for a in self.attributes]
+        q = db.select([staging.c[c] for c in columns],
+            ~staging.c.name.in_(db.select([self.table.c.name])))
+        bind.execute(InsertFromSelect(self.table,
+            [self.table.c[c] for c in columns], q))
+        self._staging.drop(bind)
+
     def members(self, conditions="1=1", limit=None, offset=0):
         """ Get a listing of all the members of the dimension (i.e. all the
         distinct values) matching the filter in ``conditions``. This can also be
@@ -248,11 +318,16 @@ class DateDimension(CompoundDimension):
         for name, attr in self.DATE_ATTRIBUTES.items():
             self.attributes.append(Attribute(self, name, attr))
 
-        self._pk_cache = {}
+        self._pk_cache = LRUCache(KEY_CACHE_SIZE, _key_size)
+        self._staging = None
+        self._dates = {}
+        self._seeded = None
+        self.auto_seed = False
 
-    def load(self, bind, value):
-        """ Given a Python datetime.date, generate a date dimension with the
-        following attributes automatically set:
+    @staticmethod
+    def derive(value):
+        """ Given a Python datetime.date, generate the attributes of a date
+        dimension member:
 
         * name - a human-redable representation
         * year - the year only (e.g. 2011)
@@ -262,7 +337,7 @@ class DateDimension(CompoundDimension):
         * day - day of the month (e.g. 8)
         * yearmonth - combined year and month (e.g. 201112)
         """
-        data = {
+        return {
                 'name': value.isoformat(),
                 'label': value.strftime("%d. %B %Y"),
                 'year': value.strftime('%Y'),
@@ -272,7 +347,63 @@ class DateDimension(CompoundDimension):
                 'day': value.strftime('%d'),
                 'yearmonth': value.strftime('%Y%m')
             }
-        return super(DateDimension, self).load(bind, data)
+
+    def load(self, bind, value):
+        """ Load a member for the given Python datetime.date. The attributes
+        derived for each date are remembered, as a dataset usually has only
+        a few hundred distinct dates. If ``auto_seed`` is set, a date which
+        is not yet known causes all days between it and the dates loaded
+        before to be seeded (see ``seed_calendar``). """
+        data = self._dates.get(value)
+        if data is None:
+            data = self._dates[value] = self.derive(value)
+        if self._staging is not None:
+            return super(DateDimension, self).load(bind, data)
+
+        pk = self._pk_cache.get(data['name'])
+        if pk is None and self.auto_seed:
+            self._extend_calendar(bind, value)
+            pk = self._pk_cache.get(data['name'])
+        if pk is None:
+            pk = self._upsert(bind, data, ['name'])
+            self._pk_cache.put(data['name'], pk)
+        return {self.column.name: pk}
+
+    def _extend_calendar(self, bind, value):
+        """ Seed the days needed to extend the seeded range to ``value``,
+        so that members only cover the range from the earliest to the
+        latest date which has been loaded. """
+        day = date(value.year, value.month, value.day)
+        if self._seeded is None:
+            start, end = day, day
+            self.seed_calendar(bind, start, end)
+        else:
+            start, end = self._seeded
+            if day < start:
+                self.seed_calendar(bind, day, start - timedelta(days=1))
+                start = day
+            elif day > end:
+                self.seed_calendar(bind, end + timedelta(days=1), day)
+                end = day
+        self._seeded = (start, end)
+
+    def seed_calendar(self, bind, start, end):
+        """ Insert a member for every day from ``start`` to ``end`` which
+        does not exist yet, using a single INSERT statement, and put the
+        keys of all days in that range into the key cache. """
+        names = db.select([self.table.c.name, self.table.c.id],
+                          db.and_(self.table.c.name >= start.isoformat(),
+                                  self.table.c.name <= end.isoformat()))
+        existing = set([name for name, pk in bind.execute(names)])
+        rows, day = [], start
+        while day <= end:
+            if day.isoformat() not in existing:
+                rows.append(self.derive(day))
+            day += timedelta(days=1)
+        if len(rows):
+            bind.execute(self.table.insert(), rows)
+        for name, pk in bind.execute(names):
+            self._pk_cache.put(name, pk)
 
     def __repr__(self):
         return "<DateDimension(%s:%s)>" % (self.name, self.attributes)
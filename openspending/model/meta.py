@@ -1,7 +1,7 @@
 """SQLAlchemy Metadata and Session object"""
 
 from sqlalchemy import MetaData
-from sqlalchemy import Table, Column, ForeignKey, Integer, Boolean
+from sqlalchemy import Table, Column, ForeignKey, Integer, BigInteger, Boolean
 from sqlalchemy import Unicode, UnicodeText, Float, DateTime
 from sqlalchemy import or_, and_
 from sqlalchemy.orm import reconstructor, aliased
@@ -0,0 +1,142 @@
+"""
+Rollups are materialized aggregates of the fact table of a dataset for
+a combination of drilldowns which is requested often, e.g. ``time.year``
+by ``cofog1``. A rollup table holds one row for each combination of
+values of its drilldowns, with the sum of every measure and the number
+of entries. ``Dataset.aggregate`` answers a query from a rollup if all
+of its drilldowns, cuts and sort keys are covered by it.
+
+A drilldown of a rollup is either a dimension or an attribute of a
+compound dimension. For compound dimensions, the rollup keeps the id of
+the member, so that any attribute of the dimension can be joined in.
+"""
+import hashlib
+
+from openspending.model import meta as db
+from openspending.model.common import TableHandler, InsertFromSelect, \
+        ALIAS_PLACEHOLDER
+
+# shorthand keys accepted by ``Dataset.aggregate``
+LABELS = {
+    'year': 'time.year',
+    'month': 'time.yearmonth'
+    }
+
+
+def normalize(drilldowns):
+    """ The sorted, unique keys of a drilldown combination. """
+    return sorted(set([LABELS.get(k, k) for k in drilldowns]))
+
+
+def table_name(drilldowns):
+    """ The name of the rollup table, without the dataset namespace. """
+    digest = hashlib.sha1(','.join(normalize(drilldowns)).encode('utf-8'))
+    return 'rollup_' + digest.hexdigest()[:10]
+
+
+class Rollup(TableHandler):
+    """ The rollup table of one drilldown combination of a dataset, in
+    the active version of the dataset tables. """
+
+    def __init__(self, dataset, drilldowns):
+        self.dataset = dataset
+        self.drilldowns = normalize(drilldowns)
+        if not len(self.drilldowns):
+            raise ValueError("A rollup needs at least one drilldown.")
+        dimensions = [d.name for d in dataset.dimensions]
+        self._init_table(db.MetaData(), dataset.table_namespace,
+                         table_name(self.drilldowns), id_type=None)
+
+        # pairs of a rollup column and its source on the fact table:
+        self.keys = []
+        for key in self.drilldowns:
+            name, attr = key.split('.', 1) if '.' in key else (key, None)
+            if name not in dimensions:
+                raise KeyError(key)
+            dimension = dataset[name]
+            if attr is not None:
+                source = dataset.key(key)
+                column = db.Column('%s__%s' % (name, attr), source.type)
+            elif dimension.is_compound:
+                source = dimension.column_alias
+                column = db.Column(source.name, db.Integer)
+            else:
+                source = dimension.column_alias
+                column = db.Column(source.name, dimension.column.type)
+            self.table.append_column(column)
+            self.keys.append((column, source))
+
+        self.values = []
+        for measure in dataset.measures:
+            column = db.Column(measure.column.name, db.Float)
+            self.table.append_column(column)
+            self.values.append((column,
+                db.func.sum(measure.column_alias)))
+        column = db.Column('entries', db.Integer)
+        self.table.append_column(column)
+        self.values.append((column, db.func.count(dataset.alias.c.id)))
+        self.alias = self.table.alias('entry')
+
+    def build(self, bind):
+        """ (Re-)create the rollup table from the fact table. Returns
+        the number of rows in the rollup. """
+        joins = self.dataset.alias
+        for name in set([k.split('.')[0] for k in self.drilldowns \
+                if '.' in k]):
+            joins = self.dataset[name].join(joins)
+        self.drop(bind)
+        self.table.create(bind)
+        pairs = self.keys + self.values
+        query = db.select([s for c, s in pairs], from_obj=joins,
+                          group_by=[s for c, s in self.keys])
+        bind.execute(InsertFromSelect(self.table, [c for c, s in pairs],
+                                      query))
+        rp = bind.execute(db.select([db.func.count('1')],
+                                    from_obj=self.table))
+        return rp.fetchone()[0]
+
+    def drop(self, bind):
+        self.table.drop(bind, checkfirst=True)
+
+    def covers(self, key):
+        """ Test whether ``key`` (in the syntax of ``Dataset.key``, or
+        ``year`` and ``month``) can be queried from this rollup. """
+        key = LABELS.get(key, key)
+        if key in self.drilldowns:
+            return True
+        name = key.split('.')[0]
+        return name in self.drilldowns and self.dataset[name].is_compound
+
+    def column(self, key):
+        """ Like ``Dataset.key``, a column to identify ``key`` in a
+        query on the rollup. """
+        key = LABELS.get(key, key)
+        name = key.split('.')[0]
+        if name in self.drilldowns and self.dataset[name].is_compound:
+            return self.dataset.key(key)
+        if '.' in key:
+            return self.alias.c['%s__%s' % tuple(key.split('.', 1))]
+        return self.alias.c[self.dataset[name].column.name]
+
+    def key(self, key):
+        """ Like ``column``, but labelled as the query on the fact table
+        would label it, so that the rows decode the same way. """
+        column = self.column(key)
+        key = LABELS.get(key, key)
+        if '.' in key and column.table == self.alias:
+            name, attr = key.split('.', 1)
+            return column.label('%s_%s' % (
+                name.replace('_', ALIAS_PLACEHOLDER), attr))
+        return column
+
+    def join(self, name, from_clause):
+        """ Join the table of a compound dimension kept by member id. """
+        dimension = self.dataset[name]
+        if name in self.drilldowns and dimension.is_compound:
+            return from_clause.join(dimension.alias, dimension.alias.c.id ==
+                                    self.alias.c[dimension.column.name])
+        return from_clause
+
+    def __repr__(self):
+        return "<Rollup(%s:%s)>" % (self.dataset.name,
+                                    ','.join(self.drilldowns))
@@ -1,6 +1,7 @@
 from datetime import datetime
 
 from openspending.model import meta as db
+from openspending.model.common import JSONType
 from openspending.model.dataset import Dataset
 from openspending.model.source import Source
 
@@ -24,6 +25,9 @@ class Run(db.Model):
                            nullable=True)
     source_id = db.Column(db.Integer, db.ForeignKey('source.id'),
                            nullable=True)
+    stats = db.Column(JSONType, default=dict)
+    checkpoint_row = db.Column(db.Integer)
+    source_checksum = db.Column(db.Unicode(64))
 
     dataset = db.relationship(Dataset,
                               backref=db.backref('runs',
@@ -39,10 +43,27 @@ class Run(db.Model):
         self.status = status
         self.dataset = dataset
         self.source = source
+        self.stats = {}
 
     @classmethod
     def by_id(cls, id):
         return db.session.query(cls).filter_by(id=id).first()
 
+    @classmethod
+    def last_checkpoint(cls, source, checksum):
+        """ Find the row up to which the most recent import of
+        ``source`` was committed, if it did not complete and was run on
+        data with the same ``checksum``. Returns the row and, if the
+        importer recorded one, a ``(row, offset)`` position in the
+        source at or before it from which reading can continue. """
+        run = source.runs.filter_by(operation='import').first()
+        if run is None or run.status == cls.STATUS_COMPLETE:
+            return 0, None
+        if checksum is None or run.source_checksum != checksum:
+            return 0, None
+        position = (run.stats or {}).get('checkpoint_position')
+        return run.checkpoint_row or 0, \
+                tuple(position) if position else None
+
     def __repr__(self):
         return "<Run(%s,%s)>" % (self.source.id, self.id)
@@ -15,6 +15,14 @@ class Source(db.Model):
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
     analysis = db.Column(JSONType, default=dict)
 
+    # validators and checksum of the data as last fetched, used to skip
+    # the analysis of unchanged sources:
+    etag = db.Column(db.Unicode)
+    last_modified = db.Column(db.Unicode)
+    size = db.Column(db.BigInteger)
+    content_hash = db.Column(db.Unicode(64))
+    checked_at = db.Column(db.DateTime)
+
     dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'))
     dataset = db.relationship(Dataset,
                               backref=db.backref('sources', lazy='dynamic',
@@ -29,6 +37,13 @@ class Source(db.Model):
         self.creator = creator
         self.url = url
 
+    @property
+    def format(self):
+        """ The data format of the source, detected from its URL or
+        its contents (see ``importer.opener.source_format``). """
+        from openspending.importer.opener import source_format
+        return source_format(self.url)
+
     @property
     def loadable(self):
         if not len(self.dataset.mapping):
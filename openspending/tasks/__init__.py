@@ -19,26 +19,36 @@ def analyze_all_sources():
 
 
 @task(ignore_result=True)
-def analyze_source(source_id):
+def analyze_source(source_id, force=False):
     from openspending.model import Source, meta as db
-    from openspending.importer.analysis import analyze_csv
+    from openspending.importer.analysis import update_analysis
     source = Source.by_id(source_id)
     if not source:
         log.error("No such source: %s", source_id)
         return
     log.info("Analyzing: %s", source.url)
-    source.analysis = analyze_csv(source.url)
+    try:
+        changed = update_analysis(source, force=force)
+    except Exception, e:
+        log.exception(e)
+        source.analysis = {'error': unicode(e)}
+        changed = True
+    db.session.commit()
+    if not changed:
+        return
     if 'error' in source.analysis:
         log.error(source.analysis.get('error'))
     else:
         log.info("Columns: %r", source.analysis.get('columns'))
-    db.session.commit()
 
 
 @task(ignore_result=True)
-def load_source(source_id, sample=False):
+def load_source(source_id, sample=False, batch_size=None, staging=False,
+                processes=None, reader='auto', resume=False,
+                incremental=False, shadow=False):
     from openspending.model import Source
-    from openspending.importer import CSVImporter
+    from openspending.importer import shadow_import
+    from openspending.importer.formats import get_importer
     source = Source.by_id(source_id)
     if not source:
         log.error("No such source: %s", source_id)
@@ -48,12 +58,22 @@ def load_source(source_id, sample=False):
         return
 
     source.dataset.generate()
-    importer = CSVImporter(source)
+    importer = get_importer(source, processes=processes, reader=reader)
     if sample:
-        importer.run(max_lines=1000, max_errors=1000)
+        importer.run(max_lines=1000, max_errors=1000,
+                     batch_size=batch_size, staging=staging)
+    elif shadow:
+        # the new version has to hold the entries of every source
+        importers = [get_importer(s, processes=processes, reader=reader) \
+                for s in source.dataset.sources]
+        shadow_import(importers, batch_size=batch_size, staging=staging,
+                      resume=resume, incremental=incremental,
+                      build_indices=True)
     else:
-        importer.run()
-    index_dataset.delay(source.dataset.name)
+        importer.run(batch_size=batch_size, staging=staging, resume=resume,
+                     incremental=incremental)
+    if not shadow:
+        index_dataset.delay(source.dataset.name)
 
 
 @task(ignore_result=True)
@@ -20,7 +20,7 @@ def load_fixture(name, manager=None):
     """
     Load fixture data into the database.
     """
-    from openspending.validation.data import convert_types
+    from openspending.importer.converter import RowConverter
     fh = fixture_file('%s.js' % name)
     data = json.load(fh)
     fh.close()
@@ -33,8 +33,9 @@ def load_fixture(name, manager=None):
     dataset.generate()
     fh = fixture_file('%s.csv' % name)
     reader = csv.DictReader(fh)
+    convert = RowConverter(data['mapping'])
     for row in reader:
-        entry = convert_types(data['mapping'], row)
+        entry = convert(row)
         dataset.load(entry)
     fh.close()
     dataset.commit()
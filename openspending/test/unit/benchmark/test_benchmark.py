@@ -0,0 +1,63 @@
+import csv
+import os
+import tempfile
+from StringIO import StringIO
+
+from openspending.benchmark import generator, harness
+from openspending.validation.model import validate_model
+
+from ... import DatabaseTestCase, helpers as h
+
+
+def test_make_model():
+    model = generator.make_model('bench', dimensions=2, measures=2)
+    validate_model(model)
+    h.assert_true('dim_1' in model['mapping'])
+    h.assert_true('amount_1' in model['mapping'])
+
+
+def test_write_csv():
+    fh = StringIO()
+    generator.write_csv(fh, 50, dimensions=2, cardinality=5, date_spread=10)
+    rows = list(csv.reader(StringIO(fh.getvalue())))
+    h.assert_equal(len(rows), 51)
+    h.assert_equal(rows[0], generator.make_headers(2))
+    h.assert_true(len(set([r[2] for r in rows[1:]])) <= 5)
+    h.assert_true(len(set([r[1] for r in rows[1:]])) <= 10)
+
+
+class TestHarness(DatabaseTestCase):
+
+    def setup(self):
+        super(TestHarness, self).setup()
+        self.model = generator.make_model('bench', dimensions=2)
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as fh:
+            generator.write_csv(fh, 30, dimensions=2, cardinality=5)
+
+    def teardown(self):
+        os.unlink(self.path)
+        super(TestHarness, self).teardown()
+
+    def test_run_load(self):
+        report = harness.run_load(self.model, self.path, 30, batch_size=10)
+        stages = [s['stage'] for s in report.stages]
+        h.assert_equal(stages, ['generate', 'convert', 'load', 'commit',
+                                'drop'])
+        h.assert_true(report.stages[2]['statements'] > 0)
+        h.assert_true('rows/sec' in report.format())
+
+    def test_run_importer(self):
+        report = harness.run_importer(self.model, self.path, 30, keep=True)
+        h.assert_equal([s['stage'] for s in report.stages],
+                       ['generate', 'import'])
+        from openspending.model import Dataset
+        h.assert_equal(len(Dataset.by_name('bench')), 30)
+
+    def test_existing_dataset_is_kept(self):
+        harness.run_load(self.model, self.path, 30, keep=True)
+        h.assert_raises(ValueError, harness.run_importer, self.model,
+                        self.path, 30)
+        report = harness.run_importer(self.model, self.path, 30,
+                                      replace=True)
+        h.assert_true('proc peak MB' in report.format())
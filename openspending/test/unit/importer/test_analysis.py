@@ -0,0 +1,85 @@
+from StringIO import StringIO
+
+from openspending.importer.analysis import analyze_columns, ColumnProfile
+
+from ... import helpers as h
+from .test_csv import csvimport_fixture_path
+
+DATA = """id,year,amount,region,comment
+1,2010,10.5,North,first
+2,2010,7,North,
+3,2011,1.25,South,third
+4,2011,3,North,fourth
+5,2012,2,South,fifth
+"""
+
+
+class TestColumnProfile(object):
+
+    def test_weighted_guess(self):
+        profile = ColumnProfile(u'amount')
+        profile.add(u'2012')
+        h.assert_equal(repr(profile.type), 'Date(%Y)')
+        profile.add(u'12.5')
+        h.assert_equal(repr(profile.type), 'Decimal')
+        # a few stray values don't make it a string column:
+        profile.add(u'')
+        profile.add(u'n/a')
+        h.assert_equal(repr(profile.type), 'Decimal')
+        h.assert_equal(profile.empty, 1)
+        for i in range(3):
+            profile.add(u'n/a')
+        h.assert_equal(repr(profile.type), 'String')
+
+    def test_cardinality(self):
+        profile = ColumnProfile(u'region')
+        for value in [u'a', u'a', u'b', u'b', u'c']:
+            profile.add(value)
+        h.assert_equal(profile.frequent(2), [[u'a', 2], [u'b', 2]])
+        h.assert_equal(profile.cardinality, 3)
+        profile.add(u'd')
+        h.assert_equal(profile.cardinality, 5)
+
+
+class TestAnalyzeColumns(object):
+
+    def test_analyze(self):
+        analysis = analyze_columns('data', fileobj=StringIO(DATA))
+        h.assert_equal(analysis['columns'],
+                       ['id', 'year', 'amount', 'region', 'comment'])
+        h.assert_equal(analysis['rows'], 5)
+        mapping = analysis['mapping']
+        h.assert_equal(mapping['amount']['type'], 'measure')
+        h.assert_equal(mapping['year']['type'], 'date')
+        h.assert_equal(mapping['comment']['type'], 'attribute')
+        h.assert_equal(analysis['profile']['comment']['empty'], 1)
+        h.assert_equal(analysis['profile']['region']['frequent'][0],
+                       ['North', 3])
+
+    def test_sample(self):
+        analysis = analyze_columns('data', sample=2,
+                                   fileobj=StringIO(DATA))
+        h.assert_equal(analysis['rows'], 2)
+        h.assert_equal(analysis['profile']['year']['distinct'], 1)
+
+    def test_string_columns_are_attributes(self):
+        data = DATA + DATA.split('\n', 1)[1]
+        analysis = analyze_columns('data', fileobj=StringIO(data))
+        h.assert_equal(analysis['mapping']['region']['type'], 'attribute')
+
+    def test_fixture(self):
+        path = csvimport_fixture_path('lbhf', 'data.csv')
+        analysis = analyze_columns(path)
+        h.assert_equal(analysis['rows'], 10)
+        h.assert_equal(analysis['mapping']['amount']['type'], 'measure')
+        h.assert_equal(analysis['mapping']['date']['type'], 'date')
+
+    def test_ndjson(self):
+        data = '{"id": 1, "amount": 2.5, "when": "2010-01-01"}\n' \
+               '{"id": 2, "amount": 3, "region": "North"}\n'
+        analysis = analyze_columns('data', fileobj=StringIO(data))
+        h.assert_equal(sorted(analysis['columns']),
+                       ['amount', 'id', 'region', 'when'])
+        h.assert_equal(analysis['mapping']['amount']['type'], 'measure')
+        h.assert_equal(analysis['mapping']['when']['type'], 'date')
+        h.assert_equal(analysis['profile']['region']['empty'], 1)
@@ -0,0 +1,64 @@
+import copy
+from datetime import date
+
+from openspending.lib import json
+from openspending.importer.converter import RowConverter
+from openspending.importer.reader import FastCSVReader
+from openspending.validation.model import Invalid
+from openspending.validation.data import convert_types
+
+from ... import helpers as h
+from .test_csv import csvimport_fixture_file, csvimport_fixture_path
+
+
+def _convert(convert, mapping, row):
+    try:
+        return convert(mapping, row)
+    except Invalid, invalid:
+        return [(c.node.name, c.column, c.datatype, c.value, c.msg) \
+                for c in invalid.children]
+
+def _check_fixture(name):
+    mapping = json.load(csvimport_fixture_file(name, 'mapping.json'))
+    converter = RowConverter(copy.deepcopy(mapping))
+    path = csvimport_fixture_path(name, 'data.csv')
+    for row in FastCSVReader(open(path, 'rb')):
+        h.assert_equal(_convert(lambda m, r: converter(r), mapping, row),
+                       _convert(convert_types, mapping, row))
+
+def test_same_as_convert_types():
+    for name in ('empty_additional_date', 'erroneous_values',
+                 'import_errors', 'lbhf', 'mexico', 'sample', 'simple',
+                 'successful_import', 'uganda'):
+        yield _check_fixture, name
+
+def test_date_guess():
+    convert = RowConverter({'time': {'column': 'date', 'datatype': 'date'}})
+    h.assert_equal(convert({'date': '2010'}), {'time': date(2010, 1, 1)})
+    h.assert_equal(convert({'date': '2010-05-03'}),
+                   {'time': date(2010, 5, 3)})
+    h.assert_equal(convert({'date': '2010-06'}), {'time': date(2010, 6, 1)})
+    h.assert_raises(Invalid, convert, {'date': '2010-06-1x'})
+
+def test_default_value():
+    convert = RowConverter({'to': {'attributes': {
+        'name': {'column': 'to', 'datatype': 'id', 'default_value': 'x'}}}})
+    h.assert_equal(convert({'to': ' '}), {'to': {'name': u'x'}})
+    h.assert_equal(convert({'to': 'A B'}), {'to': {'name': u'a-b'}})
+
+def test_typed_values():
+    mapping = {'time': {'column': 'date', 'datatype': 'date'},
+               'amount': {'column': 'amount', 'datatype': 'float'},
+               'name': {'column': 'name', 'datatype': 'id'}}
+    convert = RowConverter(mapping, typed=True)
+    h.assert_equal(convert({'date': date(2010, 5, 3), 'amount': 12,
+                            'name': 42}),
+                   {'time': date(2010, 5, 3), 'amount': 12.0, 'name': '42'})
+    h.assert_equal(convert({'date': '2010', 'amount': '1,000.5',
+                            'name': 'A B'}),
+                   {'time': date(2010, 1, 1), 'amount': 1000.5,
+                    'name': 'a-b'})
+    invalid = _convert(lambda m, r: convert(r), mapping,
+                       {'date': 2010.5, 'amount': True, 'name': None})
+    h.assert_equal(sorted([i[0] for i in invalid]),
+                   ['amount', 'name', 'time'])
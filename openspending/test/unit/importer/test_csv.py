@@ -1,12 +1,18 @@
+import os
+import re
+import tempfile
 from os.path import dirname, join
 from StringIO import StringIO
 from urlparse import urlunparse
 
-from openspending.model import Dataset, Source
+from sqlalchemy.engine.reflection import Inspector
+
+from openspending.model import Dataset, Source, Run
 from openspending.model import meta as db
 from openspending.lib import json
 
-from openspending.importer import CSVImporter
+from openspending.importer import CSVImporter, shadow_import
+from openspending.importer.reader import FastCSVReader
 
 from ... import DatabaseTestCase, helpers as h
 
@@ -24,6 +30,16 @@ def csvimport_fixture_file(name, path):
 
     return fp
 
+def csvimport_data_copy(source, transform):
+    """ Point ``source`` at a temporary copy of its data file, changed by
+    ``transform``. Returns the path of the copy. """
+    data = transform(open(source.url, 'rb').read())
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.write(fd, data)
+    os.close(fd)
+    source.url = path
+    return path
+
 def csvimport_fixture(name):
     model_fp = csvimport_fixture_file(name, 'model.json')
     mapping_fp = csvimport_fixture_file(name, 'mapping.json')
@@ -58,6 +74,196 @@ class TestCSVImporter(DatabaseTestCase):
                       "Entry with name could not be found")
         h.assert_equal(entry['amount'], 66097.77)
 
+    def test_successful_import_batched(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run(batch_size=3)
+        h.assert_equal(importer.errors, 0)
+        dataset = db.session.query(Dataset).first()
+        entries = list(dataset.entries())
+        h.assert_equal(len(entries), 4)
+        h.assert_equal(dataset.entry_count, 4)
+        h.assert_equal(dataset.last_load['entries'], 4)
+        h.assert_true(importer._run.stats['bulk_load'])
+
+        importer = CSVImporter(source)
+        importer.run(batch_size=3)
+        h.assert_false('bulk_load' in importer._run.stats)
+
+    def test_interrupted_bulk_load(self):
+        source = csvimport_fixture('successful_import')
+        CSVImporter(source).run(max_lines=3)
+        dataset = db.session.query(Dataset).first()
+        def get_indexes():
+            inspector = Inspector.from_engine(dataset.bind)
+            return sorted(i['name'] for i in
+                          inspector.get_indexes(dataset.table.name))
+        indexes = get_indexes()
+        h.assert_true(len(indexes))
+        # an import killed during a bulk load leaves no indexes:
+        for index in dataset.table.indexes:
+            index.drop(dataset.bind)
+
+        CSVImporter(source).run()
+        h.assert_equal(get_indexes(), indexes)
+
+    def test_shadow_import(self):
+        source = csvimport_fixture('successful_import')
+        CSVImporter(source).run()
+        importer = CSVImporter(source)
+        importer.run(shadow=True)
+        h.assert_equal(importer.errors, 0)
+        dataset = source.dataset
+        h.assert_equal(dataset.table_version, 1)
+        h.assert_equal(importer._run.stats['table_version'], 1)
+        h.assert_equal(dataset.table.name, 'test-csv__v1__entry')
+        h.assert_equal(len(dataset), 4)
+        h.assert_equal(len(list(dataset.entries())), 4)
+
+    def test_shadow_import_all_sources(self):
+        source = csvimport_fixture('successful_import')
+        other = Source(source.dataset, source.creator, source.url)
+        path = csvimport_data_copy(other, lambda d: re.sub(r'\n(\d),',
+                lambda m: '\n%d,' % (int(m.group(1)) + 4), d))
+        db.session.add(other)
+        db.session.commit()
+        try:
+            CSVImporter(source).run()
+            CSVImporter(other).run()
+            dataset = source.dataset
+            h.assert_equal(len(dataset), 8)
+            # a shadow load of one source would lose the other's entries:
+            h.assert_raises(ValueError, CSVImporter(source).run,
+                            shadow=True)
+            h.assert_raises(ValueError, shadow_import, [CSVImporter(source)])
+            h.assert_equal(dataset.table_version, None)
+
+            importers = [CSVImporter(source), CSVImporter(other)]
+            h.assert_true(shadow_import(importers))
+            h.assert_equal([i.errors for i in importers], [0, 0])
+            h.assert_equal(dataset.table_version, 1)
+            h.assert_equal(dataset.table.name, 'test-csv__v1__entry')
+            h.assert_equal(len(dataset), 8)
+            h.assert_equal(len(list(dataset.entries())), 8)
+        finally:
+            os.unlink(path)
+
+    def test_stage_timing(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run()
+        timing = importer._run.stats['timing']
+        for stage in ('read', 'convert', 'keys', 'write', 'commit'):
+            h.assert_true(stage in timing['stages'], stage)
+        h.assert_true(timing['seconds'] >= timing['stages']['write'])
+        h.assert_true(source.dataset.timer is None)
+
+    def test_import_builds_rollups(self):
+        source = csvimport_fixture('successful_import')
+        source.dataset.add_rollup(['time.year'])
+        importer = CSVImporter(source)
+        importer.run()
+        h.assert_equal(importer._run.stats['rollups'][0]['drilldowns'],
+                       ['time.year'])
+        dataset = db.session.query(Dataset).first()
+        h.assert_true(dataset.find_rollup(['year']) is not None)
+        res = dataset.aggregate(drilldowns=['year'])
+        h.assert_equal(res['summary']['num_entries'], 4)
+
+    def test_successful_import_incremental(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run(incremental=True, batch_size=3)
+        h.assert_equal(importer._run.stats['entries']['inserted'], 4)
+        importer = CSVImporter(source)
+        importer.run(incremental=True)
+        h.assert_equal(importer.errors, 0)
+        h.assert_equal(importer._run.stats['entries'],
+                       {'inserted': 0, 'updated': 0, 'unchanged': 4})
+        dataset = db.session.query(Dataset).first()
+        h.assert_equal(len(list(dataset.entries())), 4)
+
+    def test_incremental_after_normal_import(self):
+        source = csvimport_fixture('successful_import')
+        CSVImporter(source).run()
+        importer = CSVImporter(source)
+        importer.run(incremental=True)
+        h.assert_equal(importer.errors, 0)
+        h.assert_equal(importer._run.status, Run.STATUS_COMPLETE)
+        h.assert_equal(importer._run.stats['entries'],
+                       {'inserted': 0, 'updated': 4, 'unchanged': 0})
+
+    def test_successful_import_seed_calendar(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run(seed_calendar=True)
+        h.assert_equal(importer.errors, 0)
+        dataset = db.session.query(Dataset).first()
+        # only the days which were seen in the source:
+        h.assert_equal(len(dataset['time']), 1)
+        entries = list(dataset.entries())
+        h.assert_equal(len(entries), 4)
+        h.assert_equal(entries[0]['time']['name'], '2010-01-01')
+
+    def test_successful_import_staged(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run(staging=True)
+        h.assert_equal(importer.errors, 0)
+        dataset = db.session.query(Dataset).first()
+        entries = list(dataset.entries())
+        h.assert_equal(len(entries), 4)
+        h.assert_equal(entries[1]['amount'], 66097.77)
+
+    def test_key_cache_stats(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run()
+        importer = CSVImporter(source)
+        importer.run()
+        stats = importer._run.stats['key_cache']
+        h.assert_true(len(stats) > 0, stats)
+        for name, dim_stats in stats.items():
+            h.assert_equal(dim_stats['misses'], 0)
+            h.assert_true(dim_stats['hits'] > 0, dim_stats)
+
+    def test_successful_import_messytables(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source, reader='messytables')
+        importer.run()
+        h.assert_equal(importer.errors, 0)
+        dataset = db.session.query(Dataset).first()
+        h.assert_equal(len(list(dataset.entries())), 4)
+
+    def test_reader_chosen_per_source(self):
+        source = csvimport_fixture('successful_import')
+        other = Source(source.dataset, source.creator, source.url)
+        path = csvimport_data_copy(other, lambda d: d.replace('\n', '\r'))
+        try:
+            h.assert_true(CSVImporter(source).fast_reader() is not None)
+            h.assert_equal(CSVImporter(other).fast_reader(), None)
+            importer = CSVImporter(other)
+            importer.run()
+            h.assert_equal(importer.errors, 0)
+            h.assert_equal(len(list(source.dataset.entries())), 4)
+        finally:
+            os.unlink(path)
+
+    def test_undecodable_row_is_logged(self):
+        source = csvimport_fixture('successful_import')
+        path = csvimport_data_copy(source,
+                lambda d: d.replace('NOLEGGIO', 'NOL\xe9GGIO', 1))
+        try:
+            importer = CSVImporter(source, reader='fast')
+            importer.run()
+            h.assert_equal(importer.errors, 1)
+            records = list(importer._run.records)
+            h.assert_equal(records[0].row, 2)
+            h.assert_true('utf8' in records[0].message, records[0].message)
+            h.assert_equal(len(list(source.dataset.entries())), 3)
+        finally:
+            os.unlink(path)
+
     def test_no_dimensions_for_measures(self):
         source = csvimport_fixture('simple')
         importer = CSVImporter(source)
@@ -85,6 +291,51 @@ class TestCSVImporter(DatabaseTestCase):
         h.assert_equal(entry['time']['name'], '2010-01-01')
         h.assert_equal(entry['amount'], 100.00)
 
+    def test_resume(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run(max_lines=3, checkpoint_interval=1)
+        run = importer._run
+        h.assert_equal(run.checkpoint_row, 2)
+        h.assert_true(run.source_checksum is not None)
+
+        # pretend the import died after the second row:
+        run.status = run.STATUS_FAILED
+        db.session.commit()
+
+        importer = CSVImporter(source)
+        with h.patch('openspending.importer.reader.FastCSVReader.records',
+                     autospec=True, side_effect=FastCSVReader.records) \
+                as records:
+            importer.run(resume=True)
+        h.assert_equal(importer.errors, 0)
+        h.assert_equal(importer._run.stats['resumed_from'], 2)
+        h.assert_equal(len(list(source.dataset.entries())), 4)
+        # reading continued after the second row:
+        offset = run.stats['checkpoint_position'][1]
+        h.assert_equal(records.call_args[0][1], offset)
+        h.assert_equal(run.stats['checkpoint_position'][0], 2)
+
+    def test_checksum_not_downloaded(self):
+        source = csvimport_fixture('successful_import')
+        source.url = u'http://example.com/data.csv'
+        importer = CSVImporter(source)
+        with h.patch('openspending.importer.opener.fetch') as fetch:
+            h.assert_equal(importer.source_checksum(download=False), None)
+        h.assert_false(fetch.called)
+
+    def test_resume_changed_source(self):
+        source = csvimport_fixture('successful_import')
+        importer = CSVImporter(source)
+        importer.run()
+        importer._run.status = importer._run.STATUS_FAILED
+        importer._run.source_checksum = u'changed'
+        db.session.commit()
+
+        importer = CSVImporter(source)
+        importer.run(resume=True)
+        h.assert_false('resumed_from' in importer._run.stats)
+
     def test_import_errors(self):
         source = csvimport_fixture('import_errors')
 
@@ -123,6 +374,17 @@ class TestCSVImporter(DatabaseTestCase):
                       "Should find badly formatted date")
         h.assert_equal(records[1].row, 5)
 
+    def test_max_log_records(self):
+        source = csvimport_fixture('import_errors')
+        importer = CSVImporter(source)
+        importer.run(dry_run=True, max_log_records=2, log_batch_size=1)
+        h.assert_true(importer.errors > 2, "Should have errors")
+        h.assert_equal(importer._run.records.count(), 2)
+        stats = importer._run.stats
+        h.assert_equal(stats['errors'], importer.errors)
+        h.assert_equal(sum([s['count'] for s in stats['data_errors']]),
+                       importer.errors)
+
     def test_error_with_empty_additional_date(self):
         source = csvimport_fixture('empty_additional_date')
         importer = CSVImporter(source)
@@ -0,0 +1,164 @@
+import csv
+import os
+import shutil
+import tempfile
+
+from openspending.lib import json
+from openspending.model import Dataset
+from openspending.model import meta as db
+from openspending.importer import CSVImporter
+from openspending.importer import formats
+from openspending.importer.formats import get_importer, NDJSONImporter
+from openspending.importer.opener import source_format, archive_path, \
+        write_sidecar
+
+from ... import DatabaseTestCase, helpers as h
+from .test_csv import csvimport_fixture, csvimport_fixture_path
+
+
+def fixture_records(name):
+    """ The rows of a CSV fixture, with typed amounts. """
+    path = csvimport_fixture_path(name, 'data.csv')
+    records = []
+    for row in csv.DictReader(open(path, 'rb')):
+        row['amount'] = float(row['amount'].replace(',', ''))
+        records.append(row)
+    return records
+
+
+class TestSourceFormat(object):
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def test_extension(self):
+        h.assert_equal(source_format('http://example.org/a.csv'), 'csv')
+        h.assert_equal(source_format('http://example.org/a.jsonl.gz'),
+                       'ndjson')
+        h.assert_equal(source_format('http://example.org/a.parquet?x=1'),
+                       'parquet')
+
+    def test_contents(self):
+        h.assert_equal(source_format(self._write('a', 'PAR1...')),
+                       'parquet')
+        h.assert_equal(source_format(self._write('b', 'ARROW1\0\0')),
+                       'arrow')
+        h.assert_equal(source_format(self._write('c', '\n {"a": 1}\n')),
+                       'ndjson')
+        h.assert_equal(source_format(self._write('d', 'a,b\n1,2\n')),
+                       'csv')
+
+
+class TestNDJSONImporter(DatabaseTestCase):
+
+    def setup(self):
+        super(TestNDJSONImporter, self).setup()
+        self.source = csvimport_fixture('successful_import')
+        fd, self.path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(fd)
+        self.source.url = self.path
+
+    def teardown(self):
+        os.unlink(self.path)
+        super(TestNDJSONImporter, self).teardown()
+
+    def _write(self, lines):
+        with open(self.path, 'wb') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+    def test_import(self):
+        self._write([json.dumps(r) for r in
+                     fixture_records('successful_import')])
+        importer = get_importer(self.source)
+        h.assert_true(isinstance(importer, NDJSONImporter))
+        importer.run()
+        h.assert_equal(importer.errors, 0)
+        dataset = db.session.query(Dataset).first()
+        h.assert_equal(len(dataset), 4)
+        entry = list(dataset.entries(limit=1, offset=1)).pop()
+        h.assert_equal(entry['amount'], 66097.77)
+
+    def test_malformed_line(self):
+        lines = [json.dumps(r) for r in fixture_records('successful_import')]
+        lines.insert(2, '{"id": ')
+        self._write(lines)
+        importer = NDJSONImporter(self.source)
+        importer.run()
+        h.assert_equal(importer.errors, 1)
+        h.assert_equal(len(self.source.dataset), 4)
+
+    def test_csv_importer(self):
+        self.source.url = csvimport_fixture_path('successful_import',
+                                                 'data.csv')
+        h.assert_true(isinstance(get_importer(self.source), CSVImporter))
+
+    def test_format_of_archived_copy(self):
+        self._write([json.dumps(r) for r in
+                     fixture_records('successful_import')])
+        self.source.url = u'http://example.org/data'
+        archive_dir = os.path.dirname(self.path)
+        path = archive_path(archive_dir, self.source.url)
+        shutil.copy(self.path, path)
+        write_sidecar(path, self.source.url)
+        try:
+            with h.patch('openspending.importer.opener.urlopen') as urlopen:
+                importer = get_importer(self.source,
+                                        archive_dir=archive_dir)
+            h.assert_false(urlopen.called)
+            h.assert_true(isinstance(importer, NDJSONImporter))
+            h.assert_equal(importer.archive_dir, archive_dir)
+        finally:
+            os.unlink(path)
+            os.unlink(path + '.json')
+
+
+class TestArrowImporters(DatabaseTestCase):
+
+    def setup(self):
+        if formats.pyarrow is None:
+            h.skip("pyarrow is not installed.")
+        super(TestArrowImporters, self).setup()
+        self.source = csvimport_fixture('successful_import')
+        self.dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+        super(TestArrowImporters, self).teardown()
+
+    def _table(self):
+        pyarrow = formats.pyarrow
+        records = fixture_records('successful_import')
+        return pyarrow.Table.from_pydict(dict([(k, [r[k] for r in records])
+                                               for k in records[0]]))
+
+    def _check(self, importer_class):
+        importer = get_importer(self.source)
+        h.assert_true(isinstance(importer, importer_class))
+        importer.run()
+        h.assert_equal(importer.errors, 0)
+        h.assert_equal(len(self.source.dataset), 4)
+
+    def test_parquet(self):
+        self.source.url = os.path.join(self.dir, 'data.parquet')
+        formats.pyarrow.parquet.write_table(self._table(), self.source.url,
+                                            row_group_size=2)
+        self._check(formats.ParquetImporter)
+
+    def test_arrow(self):
+        self.source.url = os.path.join(self.dir, 'data.arrow')
+        table = self._table()
+        sink = formats.pyarrow.OSFile(self.source.url, 'wb')
+        writer = formats.pyarrow.RecordBatchFileWriter(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+        sink.close()
+        self._check(formats.ArrowImporter)
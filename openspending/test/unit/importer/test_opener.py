@@ -0,0 +1,189 @@
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from openspending.importer import opener
+from openspending.importer import CSVImporter
+from openspending.importer.analysis import update_analysis
+
+from ... import DatabaseTestCase, helpers as h
+from .test_csv import csvimport_fixture, csvimport_fixture_path
+
+
+class TestOpener(object):
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = csvimport_fixture_path('successful_import', 'data.csv')
+        self.data = open(self.path, 'rb').read()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def _compressed(self, name, open_):
+        path = os.path.join(self.dir, name)
+        fh = open_(path, 'wb')
+        fh.write(self.data)
+        fh.close()
+        return path
+
+    def test_plain(self):
+        fh = opener.open_source(self.path)
+        h.assert_equal(fh.read(3), self.data[:3])
+        h.assert_equal(fh.readline() + ''.join(fh), self.data[3:])
+
+    def test_file_url(self):
+        fh = opener.open_source('file://' + self.path)
+        h.assert_equal(fh.read(), self.data)
+
+    def test_gzip(self):
+        path = self._compressed('data.csv.gz', gzip.open)
+        h.assert_true(opener.is_compressed(path))
+        fh = opener.open_source(path)
+        h.assert_equal(list(fh), list(StringIO(self.data)))
+
+    def test_bz2(self):
+        path = self._compressed('data.csv.bz2', bz2.BZ2File)
+        fh = opener.open_source(path)
+        h.assert_equal(fh.read(10), self.data[:10])
+        h.assert_equal(fh.read(), self.data[10:])
+
+    def test_small_blocks(self):
+        path = self._compressed('data.csv.gz', gzip.open)
+        block_size, opener.BLOCK_SIZE = opener.BLOCK_SIZE, 7
+        try:
+            fh = opener.open_source(path)
+            h.assert_equal(list(fh), list(StringIO(self.data)))
+        finally:
+            opener.BLOCK_SIZE = block_size
+
+    def test_archived_copy(self):
+        url = 'http://example.org/data.csv'
+        h.assert_equal(opener.local_copy(url, self.dir), None)
+        path = opener.archive_path(self.dir, url)
+        shutil.copy(self.path, path)
+        h.assert_equal(opener.local_copy(url, self.dir), None)
+        meta = opener.write_sidecar(path, url)
+        h.assert_equal(opener.local_copy(url, self.dir), path)
+        h.assert_equal(opener.source_checksum(url, self.dir), meta['md5'])
+        h.assert_equal(opener.open_source(url, self.dir).read(), self.data)
+
+        with open(path, 'ab') as fh:
+            fh.write('more,data\n')
+        h.assert_equal(opener.local_copy(url, self.dir), None)
+
+    def test_archived_copy_outdated(self):
+        url = 'http://example.org/data.csv'
+        path = opener.archive_path(self.dir, url)
+        shutil.copy(self.path, path)
+        meta = opener.write_sidecar(path, url)
+        h.assert_equal(opener.local_copy(url, self.dir, meta['md5']), path)
+        h.assert_equal(opener.local_copy(url, self.dir, 'other'), None)
+
+    def test_archive_update_refreshes(self):
+        from openspending.command.archive import update_source
+        source = h.Mock(url=os.path.join(self.dir, 'source.csv'))
+        shutil.copy(self.path, source.url)
+        update_source(self.dir, source)
+        path = opener.archive_path(self.dir, source.url)
+        h.assert_equal(open(path, 'rb').read(), self.data)
+        with open(source.url, 'ab') as fh:
+            fh.write('more,data\n')
+        os.utime(source.url, (0, 0))
+        update_source(self.dir, source)
+        h.assert_equal(open(path, 'rb').read(), self.data + 'more,data\n')
+        meta = opener.read_sidecar(path, source.url)
+        h.assert_equal(meta['md5'], opener.checksum(open(path, 'rb')))
+
+    def test_hashing_file(self):
+        fh = opener.HashingFile(open(self.path, 'rb'))
+        fh.readline()
+        h.assert_equal(fh.hexdigest(),
+                       opener.checksum(open(self.path, 'rb')))
+        h.assert_equal(fh.size, len(self.data))
+        fh = opener.HashingFile(open(self.path, 'rb'))
+        h.assert_equal(fh.hexdigest(limit=10), None)
+
+    def test_conditional_fetch(self):
+        fh, validators = opener.conditional_fetch(self.path)
+        h.assert_equal(fh.read(), self.data)
+        fh, again = opener.conditional_fetch(self.path,
+            last_modified=validators['last_modified'])
+        h.assert_equal(fh, None)
+        os.utime(self.path, (0, 0))
+        try:
+            fh, again = opener.conditional_fetch(self.path,
+                last_modified=validators['last_modified'])
+            h.assert_equal(fh.read(), self.data)
+        finally:
+            os.utime(self.path, None)
+
+
+class TestCompressedImport(DatabaseTestCase):
+
+    def test_import_gzip(self):
+        source = csvimport_fixture('successful_import')
+        fd, path = tempfile.mkstemp(suffix='.csv.gz')
+        os.close(fd)
+        try:
+            fh = gzip.open(path, 'wb')
+            fh.write(open(source.url, 'rb').read())
+            fh.close()
+            source.url = path
+            importer = CSVImporter(source)
+            importer.run()
+            h.assert_equal(importer.errors, 0)
+            h.assert_equal(len(source.dataset), 4)
+        finally:
+            os.unlink(path)
+
+
+class TestUpdateAnalysis(DatabaseTestCase):
+
+    def setup(self):
+        super(TestUpdateAnalysis, self).setup()
+        self.source = csvimport_fixture('successful_import')
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        shutil.copy(self.source.url, self.path)
+        self.source.url = self.path
+
+    def teardown(self):
+        os.unlink(self.path)
+        super(TestUpdateAnalysis, self).teardown()
+
+    def test_update_analysis(self):
+        h.assert_true(update_analysis(self.source))
+        h.assert_true('columns' in self.source.analysis)
+        h.assert_equal(self.source.size, os.path.getsize(self.path))
+        h.assert_false(self.source.content_hash is None)
+        h.assert_false(update_analysis(self.source))
+        h.assert_true(update_analysis(self.source, force=True))
+
+    def test_touched_but_unchanged(self):
+        update_analysis(self.source)
+        self.source.analysis = {}
+        os.utime(self.path, (0, 0))
+        h.assert_false(update_analysis(self.source))
+        h.assert_equal(self.source.analysis, {})
+
+    def test_changed(self):
+        update_analysis(self.source)
+        with open(self.path, 'ab') as fh:
+            fh.write('\n')
+        os.utime(self.path, (0, 0))
+        h.assert_true(update_analysis(self.source))
+
+    def test_large_source_is_sampled(self):
+        row = open(self.path, 'rb').read().splitlines()[-1]
+        with open(self.path, 'ab') as fh:
+            for i in xrange(5000):
+                fh.write('\n' + row)
+        # the source is not read beyond the sample for a checksum:
+        h.assert_true(update_analysis(self.source))
+        h.assert_true(self.source.content_hash is None)
+        h.assert_equal(self.source.size, os.path.getsize(self.path))
+        h.assert_true('columns' in self.source.analysis)
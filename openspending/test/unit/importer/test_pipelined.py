@@ -0,0 +1,89 @@
+from StringIO import StringIO
+
+from openspending.model import Dataset
+from openspending.model import meta as db
+from openspending.importer.pipelined import PipelinedCSVImporter, \
+        record_ranges, splittable
+from openspending.importer.reader import sniff_dialect
+
+from ... import DatabaseTestCase, helpers as h
+from .test_csv import csvimport_fixture
+
+
+def test_record_ranges_keep_quoted_newlines():
+    data = 'a,b\n1,"x\ny"\n2,z\n3,w\n'
+    ranges = list(record_ranges(StringIO(data), 1))
+    h.assert_equal([data[s:e] for s, e in ranges],
+                   ['1,"x\ny"\n', '2,z\n', '3,w\n'])
+
+def test_record_ranges_from_offset():
+    data = 'a,b\n1,"x\ny"\n2,z\n3,w\n'
+    fh = StringIO(data)
+    fh.seek(12)
+    ranges = list(record_ranges(fh, 1, start=12))
+    h.assert_equal([data[s:e] for s, e in ranges], ['2,z\n', '3,w\n'])
+
+def test_splittable():
+    data = 'a,b\n1,"x\ny"\n2,z\n'
+    h.assert_true(splittable(data, sniff_dialect(data)))
+    data = 'a,b\n1,x"y\n2,z\n3,"w"\n'
+    h.assert_false(splittable(data, sniff_dialect(data)))
+
+class TestPipelinedCSVImporter(DatabaseTestCase):
+
+    def test_successful_import(self):
+        source = csvimport_fixture('successful_import')
+        importer = PipelinedCSVImporter(source, processes=2, chunk_size=100)
+        importer.run()
+        h.assert_equal(importer.errors, 0)
+        dataset = db.session.query(Dataset).first()
+        entries = list(dataset.entries())
+        h.assert_equal(len(entries), 4)
+        entry = list(dataset.entries(limit=1, offset=1)).pop()
+        h.assert_equal(entry['amount'], 66097.77)
+
+    def test_resume(self):
+        source = csvimport_fixture('successful_import')
+        importer = PipelinedCSVImporter(source, processes=2, chunk_size=100)
+        importer.run(max_lines=4, checkpoint_interval=1)
+        run = importer._run
+        h.assert_equal(run.checkpoint_row, 3)
+        row, offset = run.stats['checkpoint_position']
+        h.assert_true(0 < row <= 3)
+        run.status = run.STATUS_FAILED
+        db.session.commit()
+
+        importer = PipelinedCSVImporter(source, processes=2, chunk_size=100)
+        importer.run(resume=True)
+        h.assert_equal(importer.errors, 0)
+        h.assert_equal(importer._run.stats['checkpoint_position'][0], row)
+        h.assert_equal(len(list(source.dataset.entries())), 4)
+
+    def test_messytables_reader_is_sequential(self):
+        source = csvimport_fixture('successful_import')
+        importer = PipelinedCSVImporter(source, processes=2, chunk_size=100,
+                                       reader='messytables')
+        with h.patch('openspending.importer.pipelined.Pool') as pool:
+            importer.run()
+        h.assert_false(pool.called)
+        h.assert_equal(importer.errors, 0)
+        h.assert_equal(len(list(source.dataset.entries())), 4)
+
+    def test_import_dataset(self):
+        source = csvimport_fixture('lbhf')
+        lines = len(open(source.url).read().splitlines()) - 1
+        importer = PipelinedCSVImporter(source, processes=2, chunk_size=1000)
+        importer.run()
+        h.assert_equal(importer.errors, 0)
+        dataset = db.session.query(Dataset).first()
+        h.assert_equal(len(list(dataset.entries())), lines)
+
+    def test_erroneous_values(self):
+        source = csvimport_fixture('erroneous_values')
+        importer = PipelinedCSVImporter(source, processes=2, chunk_size=10)
+        importer.run(dry_run=True)
+        h.assert_equal(importer.errors, 2)
+        records = list(importer._run.records)
+        h.assert_true("time" in records[1].attribute,
+                      "Should find badly formatted date")
+        h.assert_equal(records[1].row, 5)
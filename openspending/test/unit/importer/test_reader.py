@@ -0,0 +1,56 @@
+from StringIO import StringIO
+
+from openspending.importer import CSVImporter
+from openspending.importer.reader import FastCSVReader, is_well_formed, \
+        sniff_dialect, local_path, UndecodableRow
+
+from ... import helpers as h
+
+
+def _messytables_rows(path):
+    importer = CSVImporter.__new__(CSVImporter)
+    return list(importer._messytables_lines(open(path, 'rb')))
+
+def test_fast_reader_matches_messytables():
+    for name in ('lbhf', 'quoting', 'sample', 'simple', 'successful_import',
+                 'uganda'):
+        path = h.fixture_path('csv_import/%s/data.csv' % name)
+        reader = FastCSVReader(open(path, 'rb'))
+        h.assert_true(reader.well_formed, name)
+        h.assert_equal(list(reader), _messytables_rows(path))
+
+def test_well_formed():
+    def check(sample):
+        return is_well_formed(sample, sniff_dialect(sample))
+    h.assert_true(check('a,b\n1,2\n3,4\n'))
+    h.assert_false(check(''))
+    h.assert_false(check('a,a\n1,2\n3,4\n'))
+    h.assert_false(check('a,b\n1,2,3\n3,4\n'))
+    h.assert_false(check('a,b\r1,2\r3,4\r'))
+    h.assert_false(check('a,b\n\xe9,2\n3,4\n'))
+
+def test_fast_reader_rows():
+    reader = FastCSVReader(StringIO('a,b\n1,2\n3\n'))
+    h.assert_equal(list(reader), [{'a': u'1', 'b': u'2'},
+                                  {'a': u'3', 'b': None}])
+
+def test_fast_reader_strict_decoding():
+    reader = FastCSVReader(StringIO('a,b\n1,\xe92\n3,4\n'))
+    rows = list(reader)
+    h.assert_true(isinstance(rows[0], UndecodableRow))
+    h.assert_true(isinstance(rows[0].error, UnicodeDecodeError))
+    h.assert_equal(rows[1], {'a': u'3', 'b': u'4'})
+
+def test_fast_reader_records():
+    data = 'a,b\n1,"x\ny"\n3,4\n'
+    records = list(FastCSVReader(StringIO(data)).records())
+    h.assert_equal([o for o, r in records], [12, 16])
+    records = list(FastCSVReader(StringIO(data)).records(12))
+    h.assert_equal(records, [(16, {'a': u'3', 'b': u'4'})])
+
+def test_local_path():
+    h.assert_equal(local_path('http://example.com/data.csv'), None)
+    h.assert_equal(local_path('file:///dev/null/nonexistent'), None)
+    path = h.fixture_path('simple.csv')
+    h.assert_equal(local_path(path), path)
+    h.assert_equal(local_path('file://' + path), path)
@@ -24,14 +24,14 @@ class TestBrowser(TestCase):
         self.dataset.name = 'mock_dataset'
 
         self.solr_patcher = h.patch('openspending.lib.browser.solr')
-        mock_solr = self.solr_patcher.start()
-        mock_solr.get_connection.return_value = self.conn
+        self.mock_solr = self.solr_patcher.start()
+        self.mock_solr.get_connection.return_value = self.conn
 
         self.conn.raw_query.return_value = make_response([])
 
         self.model_patcher = h.patch('openspending.lib.browser.model')
-        mock_model = self.model_patcher.start()
-        mock_model.Dataset.by_name.return_value = self.dataset
+        self.mock_model = self.model_patcher.start()
+        self.mock_model.Dataset.by_name.return_value = self.dataset
 
     def teardown(self):
         self.solr_patcher.stop()
@@ -97,6 +97,24 @@ class TestBrowser(TestCase):
         _, solr_args = self.conn.raw_query.call_args
         h.assert_true('+foo:"bar" OR +foo:"baz"' in solr_args['fq'])
 
+    def test_dataset_filter(self):
+        self.mock_solr.dataset_filter.return_value = '+dataset:"v"'
+        b = Browser(filter={'dataset': ['mock_dataset', 'mock_dataset']})
+        b.execute()
+
+        _, solr_args = self.conn.raw_query.call_args
+        h.assert_true('+dataset:"v" OR +dataset:"v"' in solr_args['fq'])
+        # each dataset is only looked up once:
+        h.assert_equal(self.mock_model.Dataset.by_name.call_count, 1)
+
+    def test_dataset_filter_given_datasets(self):
+        b = Browser(filter={'dataset': 'mock_dataset'},
+                    datasets=[self.dataset])
+        b.execute()
+
+        h.assert_false(self.mock_model.Dataset.by_name.called)
+        self.mock_solr.dataset_filter.assert_called_with(self.dataset)
+
     def test_page_pagesize(self):
         b = Browser(page=2, pagesize=50)
         b.execute()
@@ -0,0 +1,34 @@
+from openspending.lib.lru import LRUCache
+
+from ... import helpers as h
+
+def test_lru_get_put():
+    cache = LRUCache(10)
+    cache.put('foo', 1)
+    h.assert_equal(cache.get('foo'), 1)
+    h.assert_equal(cache.get('bar'), None)
+    h.assert_equal(cache.stats()['hits'], 1)
+    h.assert_equal(cache.stats()['misses'], 1)
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    h.assert_true('a' in cache)
+    h.assert_false('b' in cache)
+    h.assert_true('c' in cache)
+    h.assert_equal(cache.evictions, 1)
+
+def test_lru_size_budget():
+    cache = LRUCache(10, lambda k, v: len(v))
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    cache.put('c', 'xxxx')
+    h.assert_equal(len(cache), 2)
+    h.assert_equal(cache.size, 8)
+    cache.put('d', 'x' * 11)
+    h.assert_false('d' in cache)
+    cache.put('b', 'x')
+    h.assert_equal(cache.size, 5)
@@ -51,6 +51,7 @@ class TestSolrUtil(TestCase):
         dataset = h.Mock()
         dataset.id = 123
         dataset.name = 'mydataset'
+        dataset.active_version = None
 
         now = datetime.now()
 
@@ -83,6 +84,25 @@ class TestSolrUtil(TestCase):
         h.assert_equal(res, expected)
 
 
+    def test_extend_entry_version(self):
+        dataset = h.Mock()
+        dataset.id = 123
+        dataset.name = 'mydataset'
+        dataset.active_version = 2
+        res = solr.extend_entry({'id': 456}, dataset)
+        h.assert_equal(res['_id'], 'mydataset::v2::456')
+        h.assert_equal(res['dataset.version'], 2)
+
+    def test_dataset_filter(self):
+        dataset = h.Mock()
+        dataset.name = 'mydataset'
+        dataset.table_version = None
+        h.assert_equal(solr.dataset_filter(dataset),
+                       '(+dataset:"mydataset" -dataset.version:[* TO *])')
+        dataset.table_version = 3
+        h.assert_equal(solr.dataset_filter(dataset),
+                       '(+dataset:"mydataset" +dataset.version:"3")')
+
     @h.patch('openspending.lib.solr_util.model.Dataset')
     def test_build_index_no_dataset(self, mock_ds):
         mock_ds.by_name.return_value = None
@@ -0,0 +1,23 @@
+from openspending.lib.timer import StageTimer
+
+from ... import helpers as h
+
+def test_timer_laps():
+    timer = StageTimer()
+    timer.lap('read')
+    timer.lap('read')
+    timer.skip()
+    timer.lap('write')
+    stats = timer.as_dict()
+    h.assert_equal(sorted(stats['stages'].keys()), ['read', 'write'])
+    h.assert_true(stats['seconds'] >= sum(stats['stages'].values()))
+    h.assert_true('write' in timer.format())
+
+def test_timer_thins_series():
+    timer = StageTimer(max_points=4)
+    for rows in range(1, 41):
+        timer.progress(rows)
+    h.assert_true(len(timer.series) < 4)
+    rows = [p['rows'] for p in timer.series]
+    h.assert_equal(rows, sorted(rows))
+    h.assert_equal(timer.series[-1]['rows'] % timer._interval, 0)
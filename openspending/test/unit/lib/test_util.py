@@ -12,6 +12,20 @@ def test_slugify():
 def test_hash_values():
     util.hash_values([u'fóo&bañ'])
 
+def test_key_builder_legacy():
+    build = util.key_builder(u'ds', 'legacy')
+    for values in ([u'fóo&bañ', 2010], [None], []):
+        h.assert_equal(build(values), util.hash_values([u'ds'] + values))
+
+def test_key_builder_fast():
+    build = util.key_builder(u'ds', 'fast')
+    h.assert_equal(len(build([u'fóo&bañ', 2010])), 40)
+    h.assert_equal(build([u'a', u'b']), build([u'a', u'b']))
+    h.assert_not_equal(build([u'ab', u'']), build([u'a', u'b']))
+    h.assert_not_equal(build([None]), build([u'None']))
+    h.assert_not_equal(build([u'a']), util.key_builder(u'ds2', 'fast')([u'a']))
+    h.assert_raises(ValueError, util.key_builder, u'ds', 'md5')
+
 
 def test_sort_by_reference():
     ids = [4, 7, 1, 3]
@@ -1,12 +1,16 @@
 
 
 from sqlalchemy import Integer, UnicodeText, Float, Unicode
+from sqlalchemy.engine.reflection import Inspector
 from nose.tools import assert_raises
 
-from openspending.test.unit.model.helpers import SIMPLE_MODEL, load_dataset
+from openspending.test.unit.model.helpers import SIMPLE_MODEL, TEST_DATA, \
+        load_dataset
 from openspending.test import DatabaseTestCase, helpers as h
 
 from openspending.model import meta as db
+from openspending.validation.data import convert_types
+from openspending.lib.util import hash_values
 from openspending.model import Dataset, AttributeDimension, \
         CompoundDimension, Measure, DateDimension
 
@@ -88,6 +92,218 @@ class TestDatasetLoad(DatabaseTestCase):
         assert row0['amount']==200, row0.items()
         assert row0['field']=='foo', row0.items()
 
+    def test_load_batched(self):
+        self.ds.begin_batch(4)
+        load_dataset(self.ds)
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==4,resn
+        self.ds.commit()
+        resn = self.engine.execute(self.ds.table.select()).fetchall()
+        assert len(resn)==6,resn
+
+    def test_load_batched_same_as_single(self):
+        load_dataset(self.ds)
+        q = self.ds.table.select(order_by=self.ds.table.c.id)
+        single = self.engine.execute(q).fetchall()
+        self.ds.begin_batch(4)
+        load_dataset(self.ds)
+        load_dataset(self.ds)
+        self.ds.commit()
+        batched = self.engine.execute(q).fetchall()
+        assert single==batched, (single, batched)
+
+    def test_load_staged_same_as_single(self):
+        load_dataset(self.ds)
+        q = self.ds.table.select(order_by=self.ds.table.c.id)
+        single = self.engine.execute(q).fetchall()
+        members = self.engine.execute(self.ds['to'].table.select()).fetchall()
+        self.ds.flush()
+        self.ds.begin_staging(4)
+        load_dataset(self.ds)
+        load_dataset(self.ds)
+        assert len(self.ds)==0, len(self.ds)
+        self.ds.commit()
+        staged = self.engine.execute(q).fetchall()
+        assert len(staged)==6, staged
+        for a, b in zip(single, staged):
+            assert a['id']==b['id'], (a, b)
+            assert a['amount']==b['amount'], (a, b)
+        staged_members = self.engine.execute(
+            self.ds['to'].table.select()).fetchall()
+        assert len(staged_members)==len(members), staged_members
+        res = self.ds.aggregate(drilldowns=['to'])
+        assert len(res['drilldown'])==3, res['drilldown']
+        tn = self.engine.table_names()
+        assert 'test__entry__staging' not in tn, tn
+
+    def test_bulk_load(self):
+        def get_indexes():
+            inspector = Inspector.from_engine(self.engine)
+            return inspector.get_indexes(self.ds.table.name)
+        indexes = get_indexes()
+        assert len(indexes)==3, indexes
+        assert self.ds.begin_bulk_load()
+        assert not get_indexes()
+        load_dataset(self.ds)
+        self.ds.end_bulk_load()
+        assert get_indexes()==indexes
+        assert not self.ds.begin_bulk_load()
+        assert get_indexes()==indexes
+
+    def test_shadow_load(self):
+        db.session.add(self.ds)
+        self.ds.generate()
+        load_dataset(self.ds)
+        db.session.commit()
+        live = self.ds.table.select()
+        self.ds.begin_shadow()
+        assert self.ds.table.name=='test__v1__entry', self.ds.table.name
+        assert self.ds['to'].table.name=='test__v1__to', self.ds['to'].table
+        assert len(self.ds)==0, len(self.ds)
+        self.ds.begin_batch(4)
+        load_dataset(self.ds)
+        self.ds.commit()
+        assert len(self.ds)==6, len(self.ds)
+        # readers still see the published tables and count:
+        db.session.commit()
+        assert self.ds.table_version is None, self.ds.table_version
+        assert self.ds.entry_count==6, self.ds.entry_count
+        assert len(self.engine.execute(live).fetchall())==6
+        assert self.ds.end_shadow() is None
+        assert self.ds.table_version==1, self.ds.table_version
+        assert len(list(self.ds.entries()))==6
+        res = self.ds.aggregate(drilldowns=['to'])
+        assert len(res['drilldown'])==3, res['drilldown']
+        # requests on the previous version can still finish:
+        assert len(self.engine.execute(live).fetchall())==6
+        self.ds.begin_shadow()
+        tn = self.engine.table_names()
+        assert 'test__entry' not in tn, tn
+        assert 'test__to' not in tn, tn
+        self.ds.discard_shadow()
+
+    def test_discard_shadow(self):
+        db.session.add(self.ds)
+        self.ds.generate()
+        load_dataset(self.ds)
+        self.ds.begin_shadow()
+        load_dataset(self.ds)
+        self.ds.discard_shadow()
+        assert self.ds.table.name=='test__entry', self.ds.table.name
+        assert 'test__v1__entry' not in self.engine.table_names()
+        assert len(self.ds)==6, len(self.ds)
+
+    def test_entry_count(self):
+        assert len(self.ds)==0, len(self.ds)
+        load_dataset(self.ds)
+        assert self.ds.entry_count==6, self.ds.entry_count
+        load_dataset(self.ds)
+        assert len(self.ds)==6, len(self.ds)
+        self.ds.begin_batch(4)
+        load_dataset(self.ds)
+        self.ds.commit()
+        assert len(self.ds)==6, len(self.ds)
+        self.ds.flush()
+        assert len(self.ds)==0, len(self.ds)
+        self.ds.begin_staging(4)
+        load_dataset(self.ds)
+        self.ds.commit()
+        assert len(self.ds)==6, len(self.ds)
+
+    def test_recount(self):
+        load_dataset(self.ds)
+        self.engine.execute(self.ds.table.delete(self.ds.table.c.amount > 500))
+        assert len(self.ds)==6, len(self.ds)
+        assert self.ds.recount()==4
+        assert len(self.ds)==4, len(self.ds)
+
+    def test_entry_count_written_with_entries(self):
+        db.session.add(self.ds)
+        db.session.commit()
+        self.ds.generate()
+        self.ds.begin_batch(4)
+        load_dataset(self.ds)
+        self.ds.commit()
+        # the count is not left to the session to write:
+        assert self.ds not in db.session.dirty
+        table = Dataset.__table__
+        q = db.select([table.c.entry_count], table.c.id == self.ds.id)
+        assert self.engine.execute(q).fetchone()[0]==6
+        db.session.commit()
+        assert self.ds.entry_count==6, self.ds.entry_count
+
+    def test_entry_count_written_in_session(self):
+        db.session.add(self.ds)
+        db.session.commit()
+        self.ds.generate()
+        # the session holds a change to the dataset row while loading:
+        self.ds.label = u'Relabelled'
+        db.session.flush()
+        self.ds.begin_batch(4)
+        load_dataset(self.ds)
+        self.ds.commit()
+        table = Dataset.__table__
+        q = db.select([table.c.entry_count, table.c.label],
+                      table.c.id == self.ds.id)
+        assert tuple(self.engine.execute(q).fetchone())==(6, u'Relabelled')
+
+    def test_key_schemes(self):
+        load_dataset(self.ds)
+        q = db.select([self.ds.table.c.id], order_by=self.ds.table.c.amount)
+        legacy = [r[0] for r in self.engine.execute(q)]
+        row = self.engine.execute(self.ds.table.select(
+            self.ds.table.c.id == legacy[0])).fetchone()
+        assert row['amount']==190, row.items()
+        values = {'time': '2009-01-01', 'to': 'bcorp', 'function': 'food'}
+        expected = hash_values([u'test'] + [values[f.name] \
+                for f in self.ds.fields if f.key])
+        assert legacy[0]==expected, (legacy, expected)
+        self.ds.drop()
+
+        model = dict(SIMPLE_MODEL)
+        model['dataset'] = dict(model['dataset'], key_scheme='fast')
+        ds = Dataset(model)
+        ds.generate()
+        load_dataset(ds)
+        fast = [r[0] for r in self.engine.execute(q)]
+        assert len(set(fast))==6, fast
+        assert not set(fast) & set(legacy), fast
+
+    def test_load_incremental(self):
+        self.ds.begin_incremental()
+        load_dataset(self.ds)
+        assert self.ds.load_stats['inserted']==6, self.ds.load_stats
+        q = self.ds.table.select(order_by=self.ds.table.c.id)
+        first = self.engine.execute(q).fetchall()
+
+        self.ds.begin_incremental()
+        load_dataset(self.ds)
+        assert self.ds.load_stats['unchanged']==6, self.ds.load_stats
+        assert self.engine.execute(q).fetchall()==first
+
+        # the entries exist, even though their hashes are gone:
+        self.ds.discard_hashes()
+        self.ds.begin_incremental()
+        load_dataset(self.ds)
+        assert self.ds.load_stats['updated']==6, self.ds.load_stats
+
+        row = dict(zip(TEST_DATA.splitlines()[0].split(','),
+                       TEST_DATA.splitlines()[1].replace('"', '').split(',')))
+        row['amount'] = '201'
+        self.ds.begin_incremental()
+        self.ds.load(convert_types(SIMPLE_MODEL['mapping'], row))
+        assert self.ds.load_stats['updated']==1, self.ds.load_stats
+        assert len(self.ds)==6, len(self.ds)
+
+    def test_flush_resets_hashes(self):
+        self.ds.begin_incremental()
+        load_dataset(self.ds)
+        self.ds.flush()
+        h.assert_equal(self.ds.load_stats['inserted'], 0)
+        load_dataset(self.ds)
+        assert self.ds.load_stats['inserted']==6, self.ds.load_stats
+        assert len(self.ds)==6, len(self.ds)
+
     def test_flush(self):
         load_dataset(self.ds)
         resn = self.engine.execute(self.ds.table.select()).fetchall()
@@ -154,6 +370,69 @@ class TestDatasetLoad(DatabaseTestCase):
         res = self.ds.aggregate(drilldowns=['function.name', 'function.label'])
         assert len(res['drilldown'])==2, res['drilldown']
 
+    def test_aggregate_window_same_as_separate_queries(self):
+        load_dataset(self.ds)
+        queries = [{},
+                   {'drilldowns': ['function', 'field']},
+                   {'drilldowns': ['to'], 'pagesize': 1, 'page': 2},
+                   {'drilldowns': ['field'], 'page': 5},
+                   {'drilldowns': ['year'], 'cuts': [('field', u'foo')]}]
+        with h.patch('openspending.model.dataset.supports_window_functions') \
+                as supported:
+            supported.return_value = False
+            expected = [self.ds.aggregate(**q) for q in queries]
+            supported.return_value = True
+            for query, res in zip(queries, expected):
+                h.assert_equal(self.ds.aggregate(**query), res)
+
+    def test_aggregate_from_rollup(self):
+        load_dataset(self.ds)
+        queries = [{'drilldowns': ['year', 'function']},
+                   {'drilldowns': ['function.label'],
+                    'cuts': [('time.year', 2010)]},
+                   {'drilldowns': ['function'], 'cuts': [('year', 2010)],
+                    'order': [('function.name', False)]}]
+        expected = [self.ds.aggregate(**q) for q in queries]
+        self.ds.add_rollup(['time.year', 'function'])
+        specs = self.ds.build_rollups()
+        h.assert_equal(specs[0]['rows'], 4)
+        for query, res in zip(queries, expected):
+            keys = query['drilldowns'] + [k for k, v in query.get('cuts', [])]
+            assert self.ds.find_rollup(keys) is not None, query
+            h.assert_equal(self.ds.aggregate(**query), res)
+
+    def test_rollup_not_covering(self):
+        load_dataset(self.ds)
+        self.ds.add_rollup(['time.year', 'function'])
+        self.ds.build_rollups()
+        h.assert_equal(self.ds.find_rollup(['function', 'field']), None)
+        h.assert_equal(self.ds.find_rollup(['time.month']), None)
+        res = self.ds.aggregate(drilldowns=['function', 'field'])
+        assert len(res['drilldown'])==5, res['drilldown']
+
+    def test_rollup_outdated(self):
+        load_dataset(self.ds)
+        self.ds.add_rollup(['field'])
+        assert self.ds.find_rollup(['field']) is None
+        self.ds.build_rollups()
+        assert self.ds.find_rollup(['field']) is not None
+        row = {'year': '2011', 'amount': '5', 'field': 'foo',
+               'to_name': 'bcorp', 'to_label': 'Big Corp',
+               'func_name': 'food', 'func_label': 'Food'}
+        self.ds.load(convert_types(SIMPLE_MODEL['mapping'], row))
+        h.assert_equal(self.ds.find_rollup(['field']), None)
+        res = self.ds.aggregate(cuts=[('field', u'foo')])
+        assert res['summary']['num_entries']==4, res
+
+    def test_drop_rollups(self):
+        load_dataset(self.ds)
+        rollup = self.ds.add_rollup(['field'])
+        self.ds.build_rollups()
+        assert rollup.table.name in self.engine.table_names()
+        self.ds.flush()
+        assert rollup.table.name not in self.engine.table_names()
+        h.assert_equal(self.ds.rollups, [{'drilldowns': ['field']}])
+
     def test_materialize_table(self):
         load_dataset(self.ds)
         itr = self.ds.entries()
@@ -1,3 +1,4 @@
+from datetime import date
 from nose.tools import assert_raises
 
 from openspending.test.unit.model.helpers import \
@@ -65,5 +66,51 @@ class TestCompoundDimension(DatabaseTestCase):
         members = list(self.entity.members())
         h.assert_equal(len(members), 5)
 
+    def test_warm_cache(self):
+        self.entity.warm_cache(self.engine)
+        h.assert_equal(self.entity.cache_stats()['items'], 5)
+        self.entity.warm_cache(self.engine, max_size=500)
+        items = self.entity.cache_stats()['items']
+        assert 0 < items < 5, items
+
         members = list(self.entity.members(self.entity.alias.c.name == 'Dept032'))
         h.assert_equal(len(members), 1)
+
+
+class TestDateDimension(DatabaseTestCase):
+
+    def setup(self):
+        super(TestDateDimension, self).setup()
+        self.engine = db.engine
+        self.ds = Dataset(SIMPLE_MODEL)
+        self.ds.generate()
+        self.time = self.ds['time']
+
+    def test_load_same_as_derived(self):
+        d = date(2011, 12, 8)
+        key = self.time.load(self.engine, d)['time_id']
+        member = list(self.time.members(self.time.alias.c.id == key))[0]
+        for name, value in self.time.derive(d).items():
+            h.assert_equal(member[name], value)
+        h.assert_equal(self.time.load(self.engine, d)['time_id'], key)
+        h.assert_equal(len(self.time), 1)
+
+    def test_seed_calendar(self):
+        self.time.load(self.engine, date(2010, 3, 1))
+        self.time.seed_calendar(self.engine, date(2010, 1, 1),
+                                date(2010, 12, 31))
+        h.assert_equal(len(self.time), 365)
+        h.assert_equal(self.time.cache_stats()['items'], 365)
+
+    def test_auto_seed(self):
+        self.time.auto_seed = True
+        key = self.time.load(self.engine, date(2012, 2, 29))['time_id']
+        h.assert_equal(len(self.time), 1)
+        self.time.load(self.engine, date(2012, 7, 1))
+        h.assert_equal(len(self.time), 124)
+        self.time.load(self.engine, date(2012, 1, 15))
+        h.assert_equal(len(self.time), 169)
+        self.time.load(self.engine, date(2012, 3, 1))
+        h.assert_equal(len(self.time), 169)
+        member = list(self.time.members(self.time.alias.c.id == key))[0]
+        h.assert_equal(member['name'], '2012-02-29')
@@ -81,6 +81,7 @@ def make_map():
     map.connect('/api/rest/', controller='rest', action='index')
     map.connect('/api/2/aggregate', controller='api2', action='aggregate')
     map.connect('/api/2/search', controller='api2', action='search')
+    map.connect('/api/2/cache', controller='api2', action='cache')
 
     map.connect('/500', controller='error', action='render', code="500")
 
@@ -14,7 +14,7 @@ from openspending.lib.csvexport import write_csv, csv_headers
 from openspending.lib.paramparser import AggregateParamParser, SearchParamParser
 from openspending.ui.lib.base import BaseController, require
 from openspending.ui.lib.base import etag_cache_keygen
-from openspending.ui.lib.cache import AggregationCache
+from openspending.ui.lib.cache import AggregationCache, cache_stats
 from openspending.ui.lib.hypermedia import entry_apply_links, \
         drilldowns_apply_links, dataset_apply_links
 
@@ -64,6 +64,11 @@ class Api2Controller(BaseController):
                 filename=dataset.name + '.csv')
         return to_jsonp(result)
 
+    def cache(self):
+        """ Hit, miss and eviction counts of the aggregation cache of
+        this application process. """
+        return to_jsonp(cache_stats())
+
     def search(self):
         parser = SearchParamParser(request.params)
         params, errors = parser.parse()
@@ -124,7 +129,7 @@ class Api2Controller(BaseController):
                 )
                 return streamer.response()
 
-        b = Browser(**params)
+        b = Browser(datasets=datasets, **params)
         try:
             b.execute()
         except SolrException, e:
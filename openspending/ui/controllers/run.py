@@ -4,6 +4,7 @@ from pylons import tmpl_context as c
 from pylons.i18n import _
 
 from openspending.model import Source, Run, LogRecord
+from openspending.importer import STAGES
 from webhelpers import paginate
 from openspending.ui.lib.base import BaseController, render
 from openspending.ui.lib.base import abort, require
@@ -46,4 +47,11 @@ class RunController(BaseController):
         c.data_page = Page(data.order_by(LogRecord.timestamp.asc()),
                 page=self._get_page('data_page'),
                 items_per_page=20)
+        stats = c.run.stats or {}
+        c.num_errors = stats.get('errors', c.num_system + c.num_data)
+        c.error_summary = stats.get('data_errors', [])
+        c.entry_stats = stats.get('entries')
+        c.timing = stats.get('timing')
+        if c.timing is not None:
+            c.stages = [(s, c.timing['stages'].get(s, 0.0)) for s in STAGES]
         return render('run/view.html')
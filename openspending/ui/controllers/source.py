@@ -64,7 +64,8 @@ class SourceController(BaseController):
         require.dataset.update(c.dataset)
         try:
             sample = asbool(request.params.get('sample', 'false'))
-            load_source.delay(c.source.id, sample)
+            shadow = asbool(request.params.get('shadow', 'false'))
+            load_source.delay(c.source.id, sample, shadow=shadow)
         except Exception, e:
             abort(400, e)
 
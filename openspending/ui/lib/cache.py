@@ -1,27 +1,339 @@
-from sys import maxint
-import math
+"""
+Caching of aggregation results. Results are kept in two tiers: a
+bounded in-process LRU cache, so that hot aggregates are served from
+memory, in front of a store shared by all application servers. The
+shared store is configured with ``openspending.cache_backend``:
+
+``beaker`` (default)
+    The Beaker cache of the application (a local ``dbm`` file).
+``memcached``, ``redis``
+    A memcached or Redis server at ``openspending.cache_url``. They need
+    the ``python-memcached`` or ``redis`` package, respectively.
+``memory``
+    A plain dictionary, e.g. for tests or a single process.
+
+Both tiers hold pickled results, so that callers can modify the result
+they get without changing the cached copy.
+
+The first rows of a drilldown (up to ``openspending.cache_full_limit``,
+by default 10000) are cached in one entry for all pages, so that paging
+through them only slices the cached result.
+
+Only one request at a time computes a missing result: others wait for
+it, or get the last result of the same query for an older version of the
+dataset if there is one. Requests in other processes are held off by a
+lock in the shared store, which memcached, Redis and the memory backend
+support; with Beaker, computations are only coalesced within a process.
+"""
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
 import hashlib
 import logging
+import math
+import threading
+import time
 
-from paste.deploy.converters import asbool
 from pylons import cache, config, app_globals
 
+from openspending.lib.lru import LRUCache
+
 log = logging.getLogger(__name__)
 
+try:
+    import memcache
+except ImportError:
+    memcache = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Default memory budget of the in-process tier, in megabytes.
+MEMORY_SIZE = 64
+
+# Number of drilldown rows cached in one entry for all pages.
+FULL_LIMIT = 10000
+
+# Seconds for which a computation holds its lock, i.e. how long other
+# requests wait for it before they compute the result themselves.
+LOCK_TIMEOUT = 60
+
+# Seconds between checks for a result computed by another process.
+POLL_INTERVAL = 0.05
+
+
+class MemoryBackend(object):
+    """ A shared store which is only shared within the process. """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, namespace, key):
+        return self.data.get((namespace, key))
+
+    def put(self, namespace, key, value):
+        self.data[(namespace, key)] = value
+
+    def add(self, namespace, key, value, timeout):
+        """ Store ``value`` unless ``key`` exists, and return whether it
+        was stored. ``timeout`` is the lifetime of the new value in
+        seconds. """
+        expires = self.data.get((namespace, key, 'expires'))
+        if (namespace, key) in self.data and expires > time.time():
+            return False
+        self.data[(namespace, key)] = value
+        self.data[(namespace, key, 'expires')] = time.time() + timeout
+        return True
+
+    def delete(self, namespace, key):
+        self.data.pop((namespace, key), None)
+        self.data.pop((namespace, key, 'expires'), None)
+
+    def clear(self, namespace):
+        for k in [k for k in self.data if k[0] == namespace]:
+            del self.data[k]
+
+
+class BeakerBackend(object):
+    """ Store values in the Beaker cache, one namespace per dataset. """
+
+    def __init__(self, type='dbm'):
+        self.type = type
+
+    def _cache(self, namespace):
+        return cache.get_cache(namespace, type=self.type)
+
+    def get(self, namespace, key):
+        try:
+            return self._cache(namespace).get(key)
+        except KeyError:
+            return None
+
+    def put(self, namespace, key, value):
+        self._cache(namespace).put(key, value)
+
+    def add(self, namespace, key, value, timeout):
+        # Beaker has no atomic add, so there is no lock across processes.
+        return True
+
+    def delete(self, namespace, key):
+        pass
+
+    def clear(self, namespace):
+        self._cache(namespace).clear()
+
+
+class MemcachedBackend(object):
+    """ Store values on memcached servers. memcached cannot list keys,
+    so ``clear`` has no effect: outdated results are not requested any
+    more because cache keys include the modification time of the
+    dataset, and they expire after ``ttl`` seconds if that is set. """
+
+    def __init__(self, url, ttl=0):
+        if memcache is None:
+            raise ValueError("The memcached cache backend requires the "
+                             "python-memcached package.")
+        self.client = memcache.Client(url.split(','))
+        self.ttl = ttl
+
+    def get(self, namespace, key):
+        return self.client.get(namespace + ':' + key)
+
+    def put(self, namespace, key, value):
+        self.client.set(namespace + ':' + key, value, time=self.ttl)
+
+    def add(self, namespace, key, value, timeout):
+        return bool(self.client.add(namespace + ':' + key, value,
+                                    time=timeout))
+
+    def delete(self, namespace, key):
+        self.client.delete(namespace + ':' + key)
+
+    def clear(self, namespace):
+        pass
+
+
+class RedisBackend(object):
+    """ Store values on a Redis server. """
+
+    def __init__(self, url, ttl=0):
+        if redis is None:
+            raise ValueError("The redis cache backend requires the "
+                             "redis package.")
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, namespace, key):
+        return self.client.get(namespace + ':' + key)
+
+    def put(self, namespace, key, value):
+        if self.ttl:
+            self.client.setex(namespace + ':' + key, self.ttl, value)
+        else:
+            self.client.set(namespace + ':' + key, value)
+
+    def add(self, namespace, key, value, timeout):
+        return bool(self.client.set(namespace + ':' + key, value,
+                                    nx=True, ex=timeout))
+
+    def delete(self, namespace, key):
+        self.client.delete(namespace + ':' + key)
+
+    def clear(self, namespace):
+        for key in self.client.scan_iter(namespace + ':*'):
+            self.client.delete(key)
+
+
+def make_backend(name, url=None, ttl=0):
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'memcached':
+        return MemcachedBackend(url or '127.0.0.1:11211', ttl=ttl)
+    if name == 'redis':
+        return RedisBackend(url or 'redis://localhost:6379/0', ttl=ttl)
+    if name == 'beaker':
+        return BeakerBackend()
+    raise ValueError("Unknown cache backend: %s" % name)
+
+
+class TwoTierCache(object):
+    """ An in-process LRU cache of ``memory_size`` bytes in front of a
+    shared ``backend``. Values found in the backend are copied to the
+    memory tier. The cache can be used from several threads. """
+
+    def __init__(self, backend, memory_size=MEMORY_SIZE * 1024 * 1024):
+        self.backend = backend
+        self.memory = LRUCache(memory_size,
+                               lambda key, value: len(value) + 100)
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        # computations in progress in this process:
+        self._flights = {}
+        self._mutex = threading.Lock()
+
+    def get(self, namespace, key, memory=True):
+        """ The pickled value for ``key``, or ``None``. Unless
+        ``memory`` is set, only the backend is asked. """
+        if memory:
+            with self._mutex:
+                value = self.memory.get((namespace, key))
+            if value is not None:
+                return value
+        value = self.backend.get(namespace, key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if memory:
+            with self._mutex:
+                self.memory.put((namespace, key), value)
+        return value
+
+    def put(self, namespace, key, value, memory=True):
+        if memory:
+            with self._mutex:
+                self.memory.put((namespace, key), value)
+        self.backend.put(namespace, key, value)
+
+    def lock(self, namespace, key, timeout=LOCK_TIMEOUT):
+        """ Try to become the only computation of ``key``, in this
+        process and, as far as the backend supports it, in all others.
+        Returns whether the lock was acquired; it must be released with
+        ``unlock``. """
+        with self._mutex:
+            if (namespace, key) in self._flights:
+                return False
+            self._flights[(namespace, key)] = threading.Event()
+        if self.backend.add(namespace, 'lock:' + key, '1', timeout):
+            return True
+        with self._mutex:
+            self._flights.pop((namespace, key)).set()
+        return False
+
+    def unlock(self, namespace, key):
+        self.backend.delete(namespace, 'lock:' + key)
+        with self._mutex:
+            self._flights.pop((namespace, key)).set()
+
+    def wait(self, namespace, key, timeout=LOCK_TIMEOUT):
+        """ Wait for the computation of ``key`` which holds the lock and
+        return its value, or ``None`` if it failed or timed out. """
+        self.waits += 1
+        flight = self._flights.get((namespace, key))
+        if flight is not None:
+            flight.wait(timeout)
+            return self.get(namespace, key)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            value = self.backend.get(namespace, key)
+            if value is not None:
+                with self._mutex:
+                    self.memory.put((namespace, key), value)
+                return value
+            if self.backend.get(namespace, 'lock:' + key) is None:
+                return None
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    def clear(self, namespace):
+        with self._mutex:
+            for key in [k for k in self.memory.keys() \
+                    if k[0] == namespace]:
+                self.memory.invalidate(key)
+        self.backend.clear(namespace)
+
+    def stats(self):
+        with self._mutex:
+            memory = self.memory.stats()
+        return {'memory': memory,
+                'shared': {'backend': self.backend.__class__.__name__,
+                           'hits': self.hits,
+                           'misses': self.misses},
+                'waits': self.waits}
+
+
+_cache = None
+
+
+def get_cache():
+    """ The cache of this process, created from the configuration on
+    first use. """
+    global _cache
+    if _cache is None:
+        backend = make_backend(config.get('openspending.cache_backend',
+                                          'beaker'),
+                               url=config.get('openspending.cache_url'),
+                               ttl=int(config.get('openspending.cache_ttl',
+                                                  0)))
+        size = int(config.get('openspending.cache_memory_size',
+                              MEMORY_SIZE))
+        _cache = TwoTierCache(backend, memory_size=size * 1024 * 1024)
+    return _cache
+
+
+def cache_stats():
+    """ Hit, miss and eviction counts of both tiers in this process. """
+    return get_cache().stats()
+
 
 class AggregationCache(object):
-    """ A proxy object to run cached calls against the dataset 
-    aggregation function. This is neither a concern of the data 
-    model itself, nor should it be repeated at each location 
-    where caching of aggreagtes should occur - thus it ends up 
+    """ A proxy object to run cached calls against the dataset
+    aggregation function. This is neither a concern of the data
+    model itself, nor should it be repeated at each location
+    where caching of aggreagtes should occur - thus it ends up
     here. """
 
-    def __init__(self, dataset, type='dbm'):
+    def __init__(self, dataset, cache=None, full_limit=None):
         self.dataset = dataset
         self.cache_enabled = app_globals.cache_enabled and \
                 not self.dataset.private
-        self.cache = cache.get_cache('DSCACHE_' + dataset.name,
-                                     type=type)
+        self.cache = cache or get_cache()
+        self.namespace = 'DSCACHE_' + dataset.name
+        if full_limit is None:
+            full_limit = int(config.get('openspending.cache_full_limit',
+                                        FULL_LIMIT))
+        self.full_limit = full_limit
 
     def aggregate(self, measure='amount', drilldowns=None, cuts=None,
         page=1, pagesize=10000, order=None):
@@ -35,33 +347,85 @@ class AggregationCache(object):
                                           pagesize=pagesize,
                                           order=order)
 
-        key_parts = (self.dataset.updated_at.isoformat(),
-                     measure,
-                     sorted(drilldowns or []),
-                     sorted(cuts or []),
-                     order, page, pagesize)
-        key = hashlib.sha1(repr(key_parts)).hexdigest()
+        # equivalent requests share their entries:
+        query = {'measure': measure,
+                 'drilldowns': sorted(set(drilldowns or [])),
+                 'cuts': sorted(set([tuple(c) for c in cuts or []])),
+                 'order': [tuple(o) for o in order or []]}
 
-        if self.cache.has_key(key):
-            log.debug("Cache hit: %s", key)
-            result = self.cache.get(key)
-        else:
-            log.debug("Generating: %s", key)
-            result = self.dataset.aggregate(measure=measure,
-                                            drilldowns=drilldowns,
-                                            cuts=cuts,
-                                            page=page,
-                                            pagesize=pagesize,
-                                            order=order)
-            self.cache.put(key, result)
+        if self.full_limit:
+            result, key, stale = self._cached(page=1,
+                                              pagesize=self.full_limit,
+                                              **query)
+            offset = int((page - 1) * pagesize)
+            num_drilldowns = result['summary']['num_drilldowns']
+            if num_drilldowns <= self.full_limit or \
+                    offset + pagesize <= self.full_limit:
+                key = hashlib.sha1(repr((key, page, pagesize))).hexdigest()
+                result['drilldown'] = \
+                        result['drilldown'][offset:offset + pagesize]
+                result['summary'].update({
+                    'page': page,
+                    'pages': int(math.ceil(num_drilldowns /
+                                           float(pagesize))),
+                    'pagesize': pagesize})
+                return self._finish(result, key, stale)
+
+        result, key, stale = self._cached(page=page, pagesize=pagesize,
+                                          **query)
+        return self._finish(result, key, stale)
 
+    def _finish(self, result, key, stale):
         result['summary']['cached'] = True
-        result['summary']['cache_key'] = key
+        if stale:
+            # not the result for the current version of the dataset
+            result['summary']['stale'] = True
+        else:
+            result['summary']['cache_key'] = key
         return result
 
-    def invalidate(self):
-        """ Clear the cache. """
-        self.cache.clear()
+    def _cached(self, **kwargs):
+        """ Get the result of an aggregation from the cache or compute
+        it. Returns the result, its cache key and whether it is a stale
+        result for an older version of the dataset. """
+        key_parts = (kwargs['measure'], kwargs['drilldowns'],
+                     kwargs['cuts'], kwargs['order'], kwargs['page'],
+                     kwargs['pagesize'])
+        # the same query on any version of the dataset:
+        query_key = hashlib.sha1(repr(key_parts)).hexdigest()
+        key = hashlib.sha1(repr((self.dataset.updated_at.isoformat(),) +
+                                key_parts)).hexdigest()
 
+        stale = False
+        data = self.cache.get(self.namespace, key)
+        if data is not None:
+            log.debug("Cache hit: %s", key)
+        elif self.cache.lock(self.namespace, key):
+            try:
+                data = self._generate(key, query_key, **kwargs)
+            finally:
+                self.cache.unlock(self.namespace, key)
+        else:
+            data = self.cache.get(self.namespace, 'latest:' + query_key,
+                                  memory=False)
+            stale = data is not None
+            if stale:
+                log.debug("Stale while generating: %s", key)
+            else:
+                log.debug("Waiting for: %s", key)
+                data = self.cache.wait(self.namespace, key)
+            if data is None:
+                data = self._generate(key, query_key, **kwargs)
+        return loads(data), key, stale
 
+    def _generate(self, key, query_key, **kwargs):
+        log.debug("Generating: %s", key)
+        data = dumps(self.dataset.aggregate(**kwargs), HIGHEST_PROTOCOL)
+        self.cache.put(self.namespace, key, data)
+        self.cache.put(self.namespace, 'latest:' + query_key, data,
+                       memory=False)
+        return data
 
+    def invalidate(self):
+        """ Clear the cache. """
+        self.cache.clear(self.namespace)
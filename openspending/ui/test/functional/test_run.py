@@ -23,6 +23,7 @@ class TestRunController(ControllerTestCase):
             extra_environ={'REMOTE_USER': 'test'},
             expect_errors=True)
         assert readable_url(self.source.url).encode('utf-8') in response.body
+        assert '<th>Errors</th>' in response.body, response.body
 
     def test_view_run_does_not_exist(self):
         response = self.app.get(url(controller='run',
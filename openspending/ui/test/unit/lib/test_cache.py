@@ -0,0 +1,192 @@
+import threading
+import time
+from datetime import datetime
+
+from ... import DatabaseTestCase, helpers as h
+
+from openspending import model
+from openspending.ui.lib.cache import AggregationCache, TwoTierCache, \
+        MemoryBackend, make_backend
+
+
+class SlowDataset(object):
+    """ Stands in for a dataset whose aggregates take a while. """
+
+    name = 'slow'
+    private = False
+
+    def __init__(self):
+        self.updated_at = datetime(2012, 1, 1)
+        self.calls = 0
+
+    def aggregate(self, **kwargs):
+        self.calls += 1
+        time.sleep(0.1)
+        return {'drilldown': [],
+                'summary': {'amount': self.calls, 'num_drilldowns': 0}}
+
+
+class TestTwoTierCache(object):
+
+    def test_backend_fills_memory(self):
+        backend = MemoryBackend()
+        backend.put('ns', 'a', 'xxx')
+        cache = TwoTierCache(backend, memory_size=1000)
+        h.assert_equal(cache.get('ns', 'a'), 'xxx')
+        h.assert_equal(cache.get('ns', 'a'), 'xxx')
+        h.assert_equal(cache.get('ns', 'b'), None)
+        stats = cache.stats()
+        h.assert_equal(stats['memory']['hits'], 1)
+        h.assert_equal(stats['shared']['hits'], 1)
+        h.assert_equal(stats['shared']['misses'], 1)
+
+    def test_memory_budget(self):
+        cache = TwoTierCache(MemoryBackend(), memory_size=250)
+        cache.put('ns', 'a', 'x' * 100)
+        cache.put('ns', 'b', 'x' * 100)
+        h.assert_equal(cache.stats()['memory']['evictions'], 1)
+        # still available from the shared store:
+        h.assert_equal(cache.get('ns', 'a'), 'x' * 100)
+
+    def test_clear_namespace(self):
+        cache = TwoTierCache(MemoryBackend(), memory_size=1000)
+        cache.put('ns', 'a', 'x')
+        cache.put('other', 'a', 'y')
+        cache.clear('ns')
+        h.assert_equal(cache.get('ns', 'a'), None)
+        h.assert_equal(cache.get('other', 'a'), 'y')
+
+    def test_unknown_backend(self):
+        h.assert_raises(ValueError, make_backend, 'floppy')
+
+
+class TestAggregationCache(DatabaseTestCase):
+
+    def setup(self):
+        super(TestAggregationCache, self).setup()
+        h.load_fixture('cra')
+        self.dataset = model.Dataset.by_name('cra')
+        self.patcher = h.patch('openspending.ui.lib.cache.app_globals')
+        self.patcher.start().cache_enabled = True
+        self.cache = TwoTierCache(MemoryBackend())
+
+    def teardown(self):
+        self.patcher.stop()
+        super(TestAggregationCache, self).teardown()
+
+    def test_aggregate_cached(self):
+        cache = AggregationCache(self.dataset, cache=self.cache)
+        res = cache.aggregate(drilldowns=['cofog1'])
+        res['drilldown'] = []
+        again = cache.aggregate(drilldowns=['cofog1'])
+        h.assert_equal(again['summary']['cache_key'],
+                       res['summary']['cache_key'])
+        h.assert_true(len(again['drilldown']) > 0)
+        h.assert_equal(self.cache.stats()['memory']['hits'], 1)
+
+    def test_pages_sliced_from_one_entry(self):
+        cache = AggregationCache(self.dataset, cache=self.cache)
+        full = self.dataset.aggregate(drilldowns=['cofog1'])
+        num = full['summary']['num_drilldowns']
+        h.assert_true(num > 2, num)
+        for page in range(1, num + 1):
+            res = cache.aggregate(drilldowns=['cofog1'], page=page,
+                                  pagesize=1)
+            expected = self.dataset.aggregate(drilldowns=['cofog1'],
+                                              page=page, pagesize=1)
+            h.assert_equal(res['drilldown'], expected['drilldown'])
+            h.assert_equal(res['summary']['pages'], num)
+            h.assert_equal(res['summary']['page'], page)
+        # one entry computed, the other pages came from memory:
+        h.assert_equal(self.cache.stats()['memory']['hits'], num - 1)
+
+    def test_equivalent_cuts_share_entry(self):
+        cache = AggregationCache(self.dataset, cache=self.cache)
+        cuts = [('cofog1.name', u'4'), ('cofog1.name', u'10')]
+        res = cache.aggregate(cuts=cuts)
+        again = cache.aggregate(cuts=list(reversed(cuts)) + cuts[:1])
+        h.assert_equal(again['summary']['cache_key'],
+                       res['summary']['cache_key'])
+        h.assert_equal(self.cache.stats()['memory']['hits'], 1)
+
+    def test_pages_beyond_limit(self):
+        cache = AggregationCache(self.dataset, cache=self.cache,
+                                 full_limit=1)
+        res = cache.aggregate(drilldowns=['cofog1'], page=2, pagesize=1)
+        expected = self.dataset.aggregate(drilldowns=['cofog1'], page=2,
+                                          pagesize=1)
+        h.assert_equal(res['drilldown'], expected['drilldown'])
+
+    def test_invalidate(self):
+        cache = AggregationCache(self.dataset, cache=self.cache)
+        cache.aggregate(drilldowns=['cofog1'])
+        cache.invalidate()
+        cache.aggregate(drilldowns=['cofog1'])
+        h.assert_equal(self.cache.stats()['memory']['hits'], 0)
+
+
+class TestSingleFlight(object):
+
+    def setup(self):
+        self.patcher = h.patch('openspending.ui.lib.cache.app_globals')
+        self.patcher.start().cache_enabled = True
+        self.backend = MemoryBackend()
+        self.dataset = SlowDataset()
+
+    def teardown(self):
+        self.patcher.stop()
+
+    def test_concurrent_requests_compute_once(self):
+        cache = TwoTierCache(self.backend)
+        results = []
+        def request():
+            results.append(AggregationCache(self.dataset, cache=cache,
+                                            full_limit=0).aggregate())
+        threads = [threading.Thread(target=request) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        h.assert_equal(self.dataset.calls, 1)
+        h.assert_equal(len(results), 5)
+        for result in results:
+            h.assert_equal(result['summary']['amount'], 1)
+        h.assert_equal(cache.stats()['waits'], 4)
+
+    def test_waits_for_other_process(self):
+        # another process holds the lock and delivers the result later
+        cache = AggregationCache(self.dataset,
+                                 cache=TwoTierCache(self.backend),
+                                 full_limit=0)
+        first = AggregationCache(self.dataset,
+                                 cache=TwoTierCache(MemoryBackend()),
+                                 full_limit=0)
+        key = first.aggregate()['summary']['cache_key']
+        self.backend.add(cache.namespace, 'lock:' + key, '1', 10)
+        def deliver():
+            time.sleep(0.1)
+            data = first.cache.backend.get(first.namespace, key)
+            self.backend.put(cache.namespace, key, data)
+        thread = threading.Thread(target=deliver)
+        thread.start()
+        result = cache.aggregate()
+        thread.join()
+        h.assert_equal(self.dataset.calls, 1)
+        h.assert_equal(result['summary']['cache_key'], key)
+
+    def test_stale_while_revalidate(self):
+        cache = AggregationCache(self.dataset,
+                                 cache=TwoTierCache(self.backend),
+                                 full_limit=0)
+        old = cache.aggregate()
+        self.dataset.updated_at = datetime(2012, 2, 1)
+        other = AggregationCache(self.dataset,
+                                 cache=TwoTierCache(MemoryBackend()),
+                                 full_limit=0)
+        key = other.aggregate()['summary']['cache_key']
+        self.backend.add(cache.namespace, 'lock:' + key, '1', 10)
+        result = cache.aggregate()
+        h.assert_true(result['summary']['stale'])
+        h.assert_false('cache_key' in result['summary'])
+        h.assert_equal(result['summary']['amount'],
+                       old['summary']['amount'])
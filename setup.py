@@ -33,6 +33,10 @@ setup(
     url='http://github.com/okfn/openspending',
     install_requires=[
     ],
+    extras_require={
+        # Parquet and Arrow sources, see requirements-arrow.txt
+        'arrow': ['pyarrow>=0.16.0'],
+    },
     setup_requires=[
         "PasteScript==1.7.5",
         "nose==1.1.2"